@@ -1,7 +1,16 @@
 import json
+import logging
+import os
 import re
+import sys
 from datetime import datetime
 
+current_script_path = os.path.abspath(__file__)
+project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(current_script_path))))
+sys.path.append(project_root_path)
+
+from src.utils.metrics_util import configure_logging, increment, record_event
+
 def evaluate_nl2formula(file_path):
     total_count = 0
     correct_count = 0
@@ -24,7 +33,7 @@ def evaluate_nl2formula(file_path):
                     formula_json = json.loads(formula_json_str)
                     label =  formula_json.get('formula').strip()
                 except json.JSONDecodeError:
-                    print(f"Error decoding JSON from string: {formula_json_str}")
+                    record_event("eval.label_json_error", "Error decoding JSON from string: %s", formula_json_str)
                     return None
             else:
                 return None
@@ -32,9 +41,9 @@ def evaluate_nl2formula(file_path):
 
             if is_correct:
                 correct_count += 1
-                # print(f"Label {label} is in prediction: {prediction}")
+                increment("eval.correct")
             else:
-                print(f"Label {label} is NOT in prediction: {prediction}")
+                record_event("eval.incorrect", "Label %s is NOT in prediction: %s", label, prediction, level=logging.INFO)
 
             total_count += 1
             results.append({
@@ -65,5 +74,6 @@ def evaluate_nl2formula(file_path):
         print(f"Failed to save results to file: {e}")
 
 if __name__ == '__main__':
+    configure_logging()
     file_path = "data/nl2formula_test_0shot_vanilla.jsonl"
     evaluate_nl2formula(file_path)
\ No newline at end of file
@@ -1,5 +1,14 @@
 import json
+import logging
+import os
 import re
+import sys
+
+current_script_path = os.path.abspath(__file__)
+project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(current_script_path))))
+sys.path.append(project_root_path)
+
+from src.utils.metrics_util import configure_logging, increment, record_event
 
 
 def evaluate_nl2semantic_range(file_path):
@@ -22,15 +31,15 @@ def evaluate_nl2semantic_range(file_path):
                     range_json = json.loads(range_json_str)
                     label =  range_json.get('cell range').strip()
                 except json.JSONDecodeError:
-                    print(f"Error decoding JSON from string: {range_json_str}")
+                    record_event("eval.label_json_error", "Error decoding JSON from string: %s", range_json_str)
                     return None
             else:
                 return None
             if label in prediction:
                 correct_count += 1
-                # print(f"Label {label} is in prediction: {prediction}")
+                increment("eval.correct")
             else:
-                print(f"Label {label} is NOT in prediction: {prediction}")
+                record_event("eval.incorrect", "Label %s is NOT in prediction: %s", label, prediction, level=logging.INFO)
 
             total_count += 1
 
@@ -43,6 +52,7 @@ def evaluate_nl2semantic_range(file_path):
         print("No data found in the file.")
 
 if __name__ == '__main__':
+    configure_logging()
     file_path = "data/nl2SR_test.jsonl"
 
     evaluate_nl2semantic_range(file_path)
\ No newline at end of file
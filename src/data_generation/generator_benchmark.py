@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+current_script_path = os.path.abspath(__file__)
+project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(current_script_path)))
+sys.path.append(project_root_path)
+
+from src.utils.api_util import MockBackend, set_backend, configure_rate_limiter
+from src.utils.formula_util import column_letters
+from src.utils.metrics_util import get_metrics
+from src.utils.string_util import generate_sheet_string_without_address_content
+from src.data_generation.nl2formula.nl2formula_generator_rs import NewNL2FormulaGenerator
+from src.data_generation.nl2semantic_range.nl2semantic_range_generator_rs import NL2SemanticRangeGenerator
+
+MOCK_MODEL = "mock/model"
+
+GENERATORS = {
+    "nl2formula": NewNL2FormulaGenerator,
+    "nl2semantic_range": NL2SemanticRangeGenerator
+}
+
+
+def generate_synthetic_sheet(index, rows, cols, rng):
+    """
+    Build a sheet JSON in the preprocessed format read by the generators.
+
+    The sheet has a header row, a label column, numeric data and a SUM/AVERAGE formula column at the
+    end of every data row.
+
+    Parameters:
+    index (int): Number of the sheet, used in its file name.
+    rows (int): Number of rows, including the header row.
+    cols (int): Number of columns, including the label and formula columns.
+    rng (random.Random): Random generator of the cell values.
+
+    Returns:
+    dict: The sheet data.
+    """
+    last_data_col = column_letters(cols - 1)
+    formula_col = column_letters(cols)
+    cells = []
+    formulas = []
+    for row in range(1, rows + 1):
+        row_cells = []
+        for col in range(1, cols + 1):
+            address = f"{column_letters(col)}{row}"
+            if row == 1:
+                text = "Item" if col == 1 else ("Total" if col == cols else f"Q{col - 1}")
+            elif col == 1:
+                text = f"Item {row - 1}"
+            elif col == cols:
+                function = rng.choice(["SUM", "AVERAGE"])
+                formula = f"={function}(B{row}:{last_data_col}{row})"
+                formulas.append({"Value": formula, "Address": address})
+                text = str(rng.randint(100, 10000))
+            else:
+                text = str(rng.randint(1, 1000))
+            row_cells.append({"Address": address, "Text": text})
+        cells.append(row_cells)
+
+    data = {
+        "filename": f"synthetic_{index:05d}.xlsx",
+        "sheetname": "Sheet1",
+        "Cells": cells,
+        "MergedRegions": [],
+        "FilteredFormulas": formulas
+    }
+    data["SheetString"] = generate_sheet_string_without_address_content(data, None)
+    return data
+
+
+def write_synthetic_sheets(directory, num_sheets, rows=20, cols=6, seed=0):
+    """
+    Write `num_sheets` synthetic sheet JSON files to `directory`.
+
+    Parameters:
+    directory (str): Output directory, created if missing.
+    num_sheets (int): Number of sheets to write.
+    rows (int): Number of rows per sheet. Default is 20.
+    cols (int): Number of columns per sheet. Default is 6.
+    seed (int): Seed of the cell values. Default is 0.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    for index in range(num_sheets):
+        data = generate_synthetic_sheet(index, rows, cols, rng)
+        with open(os.path.join(directory, f"synthetic_{index:05d}.json"), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+
+def run_benchmark(generator_name, json_directory, work_directory, mode, concurrency, num_sheets, candidate_num=3):
+    """
+    Run one generator over the synthetic sheets and measure its throughput.
+
+    Parameters:
+    generator_name (str): "nl2formula" or "nl2semantic_range".
+    json_directory (str): Directory of the synthetic sheet JSON files.
+    work_directory (str): Directory of the result, checkpoint and metrics files of the run.
+    mode (str): "threads" runs generate_dataset with `concurrency` workers, "async" runs
+        generate_dataset_async with `concurrency` requests in flight.
+    concurrency (int): Number of workers or requests in flight.
+    num_sheets (int): Number of sheets in `json_directory`.
+    candidate_num (int): Number of candidates per formula. Default is 3.
+
+    Returns:
+    dict: Sheets/s, requests/s, retries and request latency percentiles of the run.
+    """
+    get_metrics().reset()
+    # Give every run a fresh limiter that does not cap the concurrency being measured
+    configure_rate_limiter(initial_concurrency=max(32, concurrency), max_concurrency=max(128, concurrency))
+
+    result_path = os.path.join(work_directory, f"{generator_name}_{mode}_{concurrency}.jsonl")
+    generator = GENERATORS[generator_name](
+        api_request_limit=num_sheets * candidate_num,
+        json_directory=json_directory,
+        generation_model=MOCK_MODEL,
+        scoring_model=MOCK_MODEL,
+        candidate_num=candidate_num,
+        cache_path=None,
+        resume_from=result_path,
+        metrics_snapshot_interval=3600.0
+    )
+
+    start = time.perf_counter()
+    if mode == "async":
+        generator.generate_dataset_async(max_in_flight=concurrency)
+    else:
+        generator.generate_dataset(num_workers=concurrency)
+    elapsed = time.perf_counter() - start
+
+    snapshot = get_metrics().snapshot()
+    usage = snapshot["usage"].get(MOCK_MODEL, {})
+    latency = snapshot["latencies"].get(f"api.{MOCK_MODEL}", {})
+    return {
+        "generator": generator_name,
+        "mode": mode,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "sheets": snapshot["counters"].get("sheets.processed", 0),
+        "sheets_per_second": snapshot["counters"].get("sheets.processed", 0) / elapsed,
+        "requests_per_second": usage.get("requests", 0) / elapsed,
+        "retries": usage.get("retries", 0),
+        "p50_seconds": latency.get("p50_seconds"),
+        "p99_seconds": latency.get("p99_seconds"),
+        "max_seconds": latency.get("max_seconds")
+    }
+
+
+def _format_seconds(seconds):
+    return "-" if seconds is None else f"{seconds:.3f}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the generators against the offline mock backend.")
+    parser.add_argument("--generators", nargs='+', default=list(GENERATORS), choices=list(GENERATORS))
+    parser.add_argument("--modes", nargs='+', default=["threads", "async"], choices=["threads", "async"])
+    parser.add_argument("--concurrency", nargs='+', type=int, default=[1, 4, 16, 64],
+                        help="Worker counts (threads) or requests in flight (async) to measure.")
+    parser.add_argument("--sheets", type=int, default=50, help="Number of synthetic sheets.")
+    parser.add_argument("--rows", type=int, default=20, help="Rows per synthetic sheet.")
+    parser.add_argument("--cols", type=int, default=6, help="Columns per synthetic sheet.")
+    parser.add_argument("--candidates", type=int, default=3, help="Candidates per formula.")
+    parser.add_argument("--latency-median", type=float, default=0.2, help="Median mock latency in seconds.")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal sigma of the mock latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests failing with a 429.")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After of the mock 429s in seconds.")
+    parser.add_argument("--requests-per-second", type=float, default=None, help="Server-side rate limit of the mock.")
+    parser.add_argument("--output", help="Path of a JSON file to write the results to.")
+    args = parser.parse_args()
+
+    set_backend(MockBackend(latency_median=args.latency_median, latency_sigma=args.latency_sigma,
+                            error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                            retry_after=args.retry_after, requests_per_second=args.requests_per_second, seed=0))
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_directory:
+        json_directory = os.path.join(work_directory, "sheets")
+        write_synthetic_sheets(json_directory, args.sheets, args.rows, args.cols)
+
+        print(f"{'generator':<18} {'mode':<8} {'conc':>5} {'sheets/s':>9} {'req/s':>8} {'retries':>8} "
+              f"{'p50 s':>7} {'p99 s':>7} {'max s':>7}")
+        for generator_name in args.generators:
+            for mode in args.modes:
+                for concurrency in args.concurrency:
+                    result = run_benchmark(generator_name, json_directory, work_directory, mode, concurrency,
+                                           args.sheets, args.candidates)
+                    results.append(result)
+                    print(f"{generator_name:<18} {mode:<8} {concurrency:>5} {result['sheets_per_second']:>9.2f} "
+                          f"{result['requests_per_second']:>8.2f} {result['retries']:>8} "
+                          f"{_format_seconds(result['p50_seconds']):>7} {_format_seconds(result['p99_seconds']):>7} "
+                          f"{_format_seconds(result['max_seconds']):>7}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
@@ -1,98 +1,31 @@
 import sys
 import os
 import json
-import re
-import glob
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
-from tqdm import tqdm
-from functools import lru_cache
+import logging
 
 current_script_path = os.path.abspath(__file__)
 project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(current_script_path))))
 sys.path.append(project_root_path)
 
-from src.utils.api_util import request_and_log_api_openrouter,request_and_log_api_openrouter_parallel
-from src.utils.jsonl2csv import jsonl_to_csv
-from src.utils.string_util import generate_sheet_string_without_address_content
+from src.data_generation.rejection_sampling_generator import RejectionSamplingGenerator
+from src.utils.string_util import SheetSerializer, build_windowed_sheet_string, \
+    PromptTooLongError
+from src.utils.metrics_util import record_event, configure_logging, timed
 
 
-class PromptTooLongError(Exception):
-    pass
+class NewNL2FormulaGenerator(RejectionSamplingGenerator):
+    """Generate NL queries describing the formulas of a sheet, see RejectionSamplingGenerator for the parameters."""
 
+    task_name = 'nl2formula'
+    resources_directory = os.path.join(os.path.dirname(current_script_path), 'resources')
+    task_key = 'address'
+    scoring_target_key = 'formula'
+    scoring_prompt_field = 'formula'
+    context_label = 'Address'
+    record_fields = ('formula', 'address', 'best_query', 'queries', 'sheet_string', 'sheet_string_without_address')
 
-class NewNL2FormulaGenerator:
-    def __init__(self, api_request_limit, json_directory, processed_file_path=None,
-                 generation_model="google/gemini-2.0-flash-001", generation_max_tokens=256, generation_temperature=0.7,
-                 scoring_model="anthropic/claude-3-opus", scoring_max_tokens=256, scoring_temperature=0.0,
-                 candidate_num=3, min_accept_score=0.7):
-        """
-        Initialize the NL2Formula generator with configurable models and parameters.
-
-        Args:
-            api_request_limit (int): Maximum number of API requests allowed.
-            json_directory (str): Directory containing the input JSON files.
-            processed_file_path (str, optional): Path to the file tracking processed sheets.
-            generation_model (str): Model for generating queries. Default is "google/gemini-2.0-flash-001".
-            generation_max_tokens (int): Max tokens for query generation. Default is 256.
-            generation_temperature (float): Temperature for query generation. Default is 0.7.
-            scoring_model (str): Model for rejection sampling. Default is "anthropic/claude-3-opus".
-            scoring_max_tokens (int): Max tokens for scoring. Default is 256.
-            scoring_temperature (float): Temperature for scoring. Default is 0.0.
-            candidate_num (int): Number of candidates for rejection sampling. Default is 3.
-            min_accept_score (float): Minimum score to accept a candidate. Default is 0.7.
-        """
-        current_script_path = os.path.abspath(__file__)
-        project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(current_script_path))))
-
-        # API and processing limits
-        self.api_request_limit = api_request_limit
-        self.json_directory = os.path.join(project_root_path, json_directory)
-
-        # Query generation parameters
-        self.generation_model = generation_model
-        self.generation_max_tokens = generation_max_tokens
-        self.generation_temperature = generation_temperature
-
-        # Rejection sampling parameters
-        self.scoring_model = scoring_model
-        self.scoring_max_tokens = scoring_max_tokens
-        self.scoring_temperature = scoring_temperature
-        self.candidate_num = candidate_num
-        self.min_accept_score = min_accept_score
-
-        # File paths setup
-        current_date = datetime.now().strftime('%Y-%m-%d_%H-%M')
-        filename = f"nl2formula_rs_{current_date}.jsonl"
-        self.result_file_path = os.path.join(project_root_path, 'data', 'interim', 'task_specific', 'nl2formula',
-                                             filename)
-        os.makedirs(os.path.dirname(self.result_file_path), exist_ok=True)
-
-        # Load templates
-        current_script_dir = os.path.dirname(current_script_path)
-        self.system_message_template = self._load_template(
-            os.path.join(current_script_dir, 'resources/system_message_prompts.json'))
-        self.user_prompt_template = self._load_template(
-            os.path.join(current_script_dir, 'resources/user_message_template.txt'))
-        self.scoring_prompt_template = self._load_template(
-            os.path.join(current_script_dir, 'resources/scoring_prompt.txt'))
-
-        # Initialize state
-        self.processed_files = set()
-        if processed_file_path:
-            self._load_processed_files(os.path.join(project_root_path, processed_file_path))
-
-    def _load_template(self, template_path):
-        """Load a template from a file."""
-        with open(template_path, 'r') as f:
-            return json.load(f) if template_path.endswith('.json') else f.read()
-
-    def _load_processed_files(self, file_path):
-        """Load the set of already processed files."""
-        with open(file_path, 'r') as f:
-            for line in f:
-                item = json.loads(line)
-                self.processed_files.add((item['fileName'], item['sheetName']))
+    def _has_work(self, entry):
+        return bool(entry.formula_count)
 
     def build_generation_prompts(self, sheet_str, formula, address):
         """Construct prompts for query generation"""
@@ -132,180 +65,97 @@ class NewNL2FormulaGenerator:
 
         return messages
 
-    @lru_cache(maxsize=1000)
-    def evaluate_query_quality(self, query, formula, context):
-        """Evaluate query quality using the scoring model."""
-        try:
-            prompt = self.scoring_prompt_template.format(
-                formula=formula,
-                context=context,
-                query=query
-            )
-
-            response = request_and_log_api_openrouter(
-                messages=[{"role": "user", "content": prompt}],
-                model=self.scoring_model,
-                max_tokens=self.scoring_max_tokens,
-                temperature=self.scoring_temperature
-            )
-
-            response = response.strip()
-            json_match = re.search(r'(?i)(?:```json)?\s*(\{[\s\S]*\})(?:```)?', response, re.DOTALL)
-            if not json_match:
-                return {"score": 0, "details": {}, "rationale": "No valid JSON found in response"}
-
-            json_str = json_match.group(1)
-
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
-            print(f"JSON decoding failed: {e}")
-            return {"score": 0, "details": {}, "rationale": "Invalid JSON format"}
-        except Exception as e:
-            print(f"Scoring failed: {e}")
-            return {"score": 0, "details": {}, "rationale": "Evaluation failed"}
-
-    def generate_candidates(self, messages):
-        """Generate multiple candidate queries in parallel"""
-        responses = request_and_log_api_openrouter_parallel(
-            messages=messages,
-            model=self.generation_model,
-            max_tokens=self.generation_max_tokens,
-            temperature=self.generation_temperature,
-            concurrency=self.candidate_num
-        )
-        candidates = []
-        for response in responses:
-            try:
-                candidates.append(json.loads(response)["query"])
-            except:
-                continue
-        return candidates
-
-    def rejection_sampling(self, candidates, formula, context):
-        """Perform rejection sampling with model scoring in parallel"""
-        scored_candidates = []
-
-        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
-            futures = [
-                executor.submit(self.evaluate_query_quality, query, formula, context)
-                for query in candidates
-            ]
-
-            for future, query in zip(as_completed(futures), candidates):
-                try:
-                    score_result = future.result()
-                    normalized_score = score_result["score"] / 10  # Scale to 0-1
-                    if normalized_score >= self.min_accept_score:
-                        scored_candidates.append((
-                            normalized_score,
-                            query,
-                            score_result
-                        ))
-                except Exception as e:
-                    print(f"Scoring failed for query '{query}': {e}")
-
-        return sorted(scored_candidates, key=lambda x: x[0], reverse=True)
-
-    def process_formulas(self, data):
-        """Process formulas in a sheet and return simplified results"""
-        results = []
-        sheet_str = data['SheetString']
-
-        for formula_info in data['FilteredFormulas'][:1]:  # Process first 3 formulas
+    @timed("stage.prompt_build")
+    def prepare_tasks(self, data):
+        """Build the generation prompts for the formulas to process in a sheet"""
+        tasks = []
+
+        # Formulas the index marks as invalid are skipped before any tokenization
+        formula_infos = [formula_info for formula_info in data['FilteredFormulas']
+                         if not self._is_formula_invalid(data['filename'], data['sheetname'], formula_info["Address"])
+                         and self._is_formula_sampled(data['filename'], data['sheetname'], formula_info["Address"])]
+        # Only the first formula of a sheet is processed, unless there is a stratified sample: then every
+        # sampled formula of the sheet is
+        limit = 1 if self.sampled_formulas is None else None
+        # Serialize the sheet once; the per-formula strings are derived from it
+        serializer = SheetSerializer(data)
+
+        for formula_info in formula_infos[:limit]:
             formula = formula_info["Value"]
             address = formula_info["Address"]
+            # Skip the formulas a previous run finished in a partly processed sheet
+            if (data['filename'], data['sheetname'], address) in self.checkpoint:
+                continue
 
-            # Generate the sheet string without the address content
-            sheet_str_without_address = generate_sheet_string_without_address_content(data, address)
+            if self.context_token_budget:
+                # Only keep a window of the sheet around the formula, within the token budget
+                try:
+                    sheet_str_without_address, stats = build_windowed_sheet_string(
+                        data, address, self.context_token_budget, blank_address=address, serializer=serializer)
+                    context_sheet_str, _ = build_windowed_sheet_string(data, address, self.context_token_budget,
+                                                                       serializer=serializer)
+                except (PromptTooLongError, ValueError) as e:
+                    record_event("prompt.too_long", "Skipping formula at address %s: %s", address, e)
+                    continue
+                if stats["truncated"]:
+                    record_event("prompt.truncated", "Truncated sheet context for %s: kept %d/%d rows, %d/%d columns, "
+                                 "%d/%d characters", address, stats['rows_kept'], stats['rows_total'],
+                                 stats['cols_kept'], stats['cols_total'], stats['chars_kept'], stats['chars_total'],
+                                 level=logging.INFO)
+            else:
+                # Generate the sheet string without the address content
+                sheet_str_without_address = serializer.without_address(address)
+                context_sheet_str = data['SheetString']
 
-            # Generate candidates
             messages = self.build_generation_prompts(
                 sheet_str_without_address,
                 formula,
                 address
             )
-            candidates = self.generate_candidates(messages)
-
-            # Skip if no candidates were generated
-            if not candidates:
-                print(f"No candidates generated for formula: {formula} at address: {address}")
-                continue
-
-            # Score all candidates
-            scored_candidates = self.rejection_sampling(
-                candidates, formula,
-                f"Address: {address} | Sheet: {sheet_str}"
-            )
+            tasks.append({
+                "formula": formula,
+                "address": address,
+                "sheet_string_without_address": sheet_str_without_address,
+                "context_sheet_string": context_sheet_str,
+                "messages": messages
+            })
+
+        return tasks
+
+    def _build_result(self, task, scored_candidates, sheet_str):
+        """Build the result record of one formula from its accepted candidates."""
+        # Save all candidates with their scores as a list
+        queries_with_scores = []
+        for score, query, score_details in scored_candidates:
+            queries_with_scores.append({
+                "query": query,
+                "score": score,
+                "score_details": score_details
+            })
+
+        # Find the best query (highest score)
+        best_query = max(queries_with_scores, key=lambda x: x["score"])["query"]
+
+        return {
+            "formula": task["formula"],
+            "address": task["address"],
+            "queries": queries_with_scores,
+            "best_query": best_query,
+            "sheet_string": sheet_str,
+            "sheet_string_without_address": task["sheet_string_without_address"]
+        }
 
-            # Save all candidates with their scores as a list
-            queries_with_scores = []
-            for score, query, score_details in scored_candidates:
-                queries_with_scores.append({
-                    "query": query,
-                    "score": score,
-                    "score_details": score_details
-                })
-
-            # Save the entire formula result as one record
-            if queries_with_scores:
-                # Find the best query (highest score)
-                best_query = max(queries_with_scores, key=lambda x: x["score"])["query"]
-
-                results.append({
-                    "formula": formula,
-                    "address": address,
-                    "queries": queries_with_scores,
-                    "best_query": best_query,
-                    "sheet_string": sheet_str,
-                    "sheet_string_without_address": sheet_str_without_address
-                })
-
-        return results
-
-    def generate_dataset(self):
-        """Main generation workflow"""
-        processed_count = 0
-        files = glob.glob(os.path.join(self.json_directory, "*.json"))
-
-        with tqdm(total=min(self.api_request_limit, len(files) * 4), desc="Generating") as pbar:
-            for file_path in files:
-                if processed_count >= self.api_request_limit:
-                    break
-
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-
-                # Skip processed sheets
-                file_id = (data['filename'], data['sheetname'])
-                if file_id in self.processed_files:
-                    continue
-
-                # Process formulas
-                results = self.process_formulas(data)
-                processed_count += len(results)
-                pbar.update(len(results))
+    def process_formulas(self, data):
+        """Process formulas in a sheet and return simplified results"""
+        return self.process_sheet(data)
 
-                # Save results
-                self._save_results(data['filename'], data['sheetname'], results)
+    async def aprocess_formulas(self, engine, data):
+        """Async counterpart of process_formulas."""
+        return await self.aprocess_sheet(engine, data)
 
-        jsonl_to_csv(self.result_file_path)
 
-    def _save_results(self, filename, sheetname, results):
-        """Save simplified results to JSONL"""
-        with open(self.result_file_path, 'a') as f:
-            for result in results:
-                record = {
-                    "fileName": filename,
-                    "sheetName": sheetname,
-                    "formula": result["formula"],
-                    "address": result["address"],
-                    "best_query": result["best_query"],
-                    "queries": result["queries"],
-                    "sheet_string": result["sheet_string"],
-                    "sheet_string_without_address": result["sheet_string_without_address"]
-                }
-                f.write(json.dumps(record) + '\n')
 if __name__ == '__main__':
+    configure_logging()
     generator = NewNL2FormulaGenerator(
         api_request_limit=120,
         json_directory="data/raw/raw_data_json_0219_processed",
@@ -1,98 +1,36 @@
 import sys
 import os
 import json
+import logging
 import re
-import glob
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
-from tqdm import tqdm
-from functools import lru_cache
 
 current_script_path = os.path.abspath(__file__)
 project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(current_script_path))))
 sys.path.append(project_root_path)
 
-from src.utils.api_util import request_and_log_api_openrouter,request_and_log_api_openrouter_parallel
-from src.utils.jsonl2csv import jsonl_to_csv
-from src.utils.formula_util import extract_range_from_formula
+from src.data_generation.rejection_sampling_generator import RejectionSamplingGenerator
+from src.utils.formula_util import extract_ranges_from_formulas
+from src.utils.metrics_util import increment, record_event, configure_logging, timed
+from src.utils.string_util import SheetSerializer, build_windowed_sheet_string, PromptTooLongError
 
 
-class PromptTooLongError(Exception):
-    pass
+class NL2SemanticRangeGenerator(RejectionSamplingGenerator):
+    """Generate NL queries describing the cell ranges a sheet's formulas refer to, see RejectionSamplingGenerator."""
 
+    task_name = 'nl2semantic_range'
+    resources_directory = os.path.join(os.path.dirname(current_script_path), 'resources')
+    task_key = 'range'
+    scoring_target_key = 'range'
+    scoring_prompt_field = 'cell_range'
+    context_label = 'Range'
+    record_fields = ('range', 'best_query', 'queries', 'sheet_string')
 
-class NL2SemanticRangeGenerator:
-    def __init__(self, api_request_limit, json_directory, processed_file_path=None,
-                 generation_model="google/gemini-2.0-flash-001", generation_max_tokens=256, generation_temperature=0.7,
-                 scoring_model="anthropic/claude-3-opus", scoring_max_tokens=256, scoring_temperature=0.0,
-                 candidate_num=3, min_accept_score=0.7):
-        """
-        Initialize the NL2Formula generator with configurable models and parameters.
+    def _has_work(self, entry):
+        return entry.has_usable_ranges
 
-        Args:
-            api_request_limit (int): Maximum number of API requests allowed.
-            json_directory (str): Directory containing the input JSON files.
-            processed_file_path (str, optional): Path to the file tracking processed sheets.
-            generation_model (str): Model for generating queries. Default is "google/gemini-2.0-flash-001".
-            generation_max_tokens (int): Max tokens for query generation. Default is 256.
-            generation_temperature (float): Temperature for query generation. Default is 0.7.
-            scoring_model (str): Model for rejection sampling. Default is "anthropic/claude-3-opus".
-            scoring_max_tokens (int): Max tokens for scoring. Default is 256.
-            scoring_temperature (float): Temperature for scoring. Default is 0.0.
-            candidate_num (int): Number of candidates for rejection sampling. Default is 3.
-            min_accept_score (float): Minimum score to accept a candidate. Default is 0.7.
-        """
-        current_script_path = os.path.abspath(__file__)
-        project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(current_script_path))))
-
-        # API and processing limits
-        self.api_request_limit = api_request_limit
-        self.json_directory = os.path.join(project_root_path, json_directory)
-
-        # Query generation parameters
-        self.generation_model = generation_model
-        self.generation_max_tokens = generation_max_tokens
-        self.generation_temperature = generation_temperature
-
-        # Rejection sampling parameters
-        self.scoring_model = scoring_model
-        self.scoring_max_tokens = scoring_max_tokens
-        self.scoring_temperature = scoring_temperature
-        self.candidate_num = candidate_num
-        self.min_accept_score = min_accept_score
-
-        # File paths setup
-        current_date = datetime.now().strftime('%Y-%m-%d_%H-%M')
-        filename = f"nl2semantic_range_rs_{current_date}.jsonl"
-        self.result_file_path = os.path.join(project_root_path, 'data', 'interim', 'task_specific', 'nl2semantic_range',
-                                             filename)
-        os.makedirs(os.path.dirname(self.result_file_path), exist_ok=True)
-
-        # Load templates
-        current_script_dir = os.path.dirname(current_script_path)
-        self.system_message_template = self._load_template(
-            os.path.join(current_script_dir, 'resources/system_message_prompts.json'))
-        self.user_prompt_template = self._load_template(
-            os.path.join(current_script_dir, 'resources/user_message_template.txt'))
-        self.scoring_prompt_template = self._load_template(
-            os.path.join(current_script_dir, 'resources/scoring_prompt.txt'))
-
-        # Initialize state
-        self.processed_files = set()
-        if processed_file_path:
-            self._load_processed_files(os.path.join(project_root_path, processed_file_path))
-
-    def _load_template(self, template_path):
-        """Load a template from a file."""
-        with open(template_path, 'r') as f:
-            return json.load(f) if template_path.endswith('.json') else f.read()
-
-    def _load_processed_files(self, file_path):
-        """Load the set of already processed files."""
-        with open(file_path, 'r') as f:
-            for line in f:
-                item = json.loads(line)
-                self.processed_files.add((item['fileName'], item['sheetName']))
+    def _needs_cells(self):
+        # The cell grid is only needed to window the sheet string
+        return bool(self.context_token_budget)
 
     def build_generation_prompts(self, sheet_string, range_info):
         """Construct prompts for query generation"""
@@ -119,204 +57,117 @@ class NL2SemanticRangeGenerator:
         messages.append({"role": "user", "content": user_message})
         return messages
 
-    @lru_cache(maxsize=1000)
-    def evaluate_query_quality(self, query, range_str, context):
-        """Evaluate query quality using the scoring model."""
-        try:
-            prompt = self.scoring_prompt_template.format(
-                cell_range=range_str,
-                context=context,
-                query=query
-            )
-
-            response = request_and_log_api_openrouter(
-                messages=[{"role": "user", "content": prompt}],
-                model=self.scoring_model,
-                max_tokens=self.scoring_max_tokens,
-                temperature=self.scoring_temperature
-            )
-
-            response = response.strip()
-            json_match = re.search(r'(?i)(?:```json)?\s*(\{[\s\S]*\})(?:```)?', response, re.DOTALL)
-            if not json_match:
-                return {"score": 0, "details": {}, "rationale": "No valid JSON found in response"}
-
-            json_str = json_match.group(1)
-
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
-            print(f"JSON decoding failed: {e}")
-            return {"score": 0, "details": {}, "rationale": "Invalid JSON format"}
-        except Exception as e:
-            print(f"Scoring failed: {e}")
-            return {"score": 0, "details": {}, "rationale": "Evaluation failed"}
-
-    def generate_candidates(self, messages):
-        """Generate multiple candidate queries in parallel"""
-        responses = request_and_log_api_openrouter_parallel(
-            messages=messages,
-            model=self.generation_model,
-            max_tokens=self.generation_max_tokens,
-            temperature=self.generation_temperature,
-            concurrency=self.candidate_num
-        )
+    def _parse_candidates(self, responses):
+        """Extract the candidate queries from the generation responses."""
         candidates = []
         for response in responses:
             try:
                 response = response.strip()
                 json_match = re.search(r'(?i)(?:```json)?\s*(\{[\s\S]*\})(?:```)?', response, re.DOTALL)
                 if not json_match:
-                    return {"score": 0, "details": {}, "rationale": "No valid JSON found in response"}
+                    continue
 
                 json_str = json_match.group(1)
 
                 candidates.append(json.loads(json_str)["query"])
-            except:
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                record_event("generation.unparseable_candidate", "Could not parse candidate: %s", e, level=logging.INFO)
                 continue
         return candidates
 
-    def rejection_sampling(self, candidates, range_str, context):
-        """Perform rejection sampling with model scoring in parallel"""
-        scored_candidates = []
-
-        # Parrallel
-        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
-            futures = [
-                executor.submit(self.evaluate_query_quality, query, range_str, context)
-                for query in candidates
-            ]
-
-            for future, query in zip(as_completed(futures), candidates):
-                try:
-                    score_result = future.result()
-                    normalized_score = score_result["score"] / 10  # Scale to 0-1
-                    if normalized_score >= self.min_accept_score:
-                        scored_candidates.append((
-                            normalized_score,
-                            query,
-                            score_result
-                        ))
-                except Exception as e:
-                    print(f"Scoring failed for query '{query}': {e}")
-
-        return sorted(scored_candidates, key=lambda x: x[0], reverse=True)
-
-    def process_ranges(self, data):
-        results = []
-        sheet_str = data['SheetString']
+    def _select_ranges(self, data, max_ranges=1):
+        """Collect up to `max_ranges` valid ranges referenced by the sheet's formulas."""
         sheet_name = data['sheetname']
-        valid_ranges = set()
-        max_ranges = 1
-
-        for formula_info in data['FilteredFormulas']:
-            formula = formula_info["Value"]
-
-            try:
-                ranges = extract_range_from_formula(formula, sheet_name)
-                valid_ranges.update(ranges)
-
-                if len(valid_ranges) >= max_ranges:
-                    break
-            except Exception as e:
-                print(f"Error extracting ranges from formula {formula}: {e}")
-                continue
-
-        if not valid_ranges:
-            print("No valid ranges found for any formula")
-            return results
+        formula_infos = [formula_info for formula_info in data['FilteredFormulas']
+                         if not self._is_formula_invalid(data['filename'], sheet_name, formula_info.get("Address"))
+                         and self._is_formula_sampled(data['filename'], sheet_name, formula_info.get("Address"))]
+
+        extraction = extract_ranges_from_formulas(
+            [formula_info["Value"] for formula_info in formula_infos],
+            sheet_name,
+            addresses=[formula_info.get("Address") for formula_info in formula_infos],
+            max_ranges=max_ranges
+        )
+        if extraction.formula_errors:
+            index, error = extraction.formula_errors[0]
+            increment("ranges.unparseable_formulas", len(extraction.formula_errors))
+            record_event("ranges.sheet_with_unparseable_formulas",
+                         "Skipped %d/%d formulas in sheet %s that failed to parse, e.g. %s: %s",
+                         len(extraction.formula_errors), extraction.formulas_scanned, sheet_name,
+                         formula_infos[index]['Value'], error)
+
+        return list(extraction.ranges)[:max_ranges]
+
+    @timed("stage.prompt_build")
+    def prepare_tasks(self, data):
+        """Select the ranges to process in a sheet and build their generation prompts"""
+        tasks = []
+        sheet_str = data['SheetString']
 
-        ranges_to_process = list(valid_ranges)[:max_ranges]
+        ranges_to_process = self._select_ranges(data)
+        if not ranges_to_process:
+            record_event("ranges.none_found", "No valid ranges found for any formula", level=logging.INFO)
+            return tasks
 
+        # Parsed once and shared by the windows of all ranges of the sheet
+        serializer = SheetSerializer(data) if self.context_token_budget else None
         for range_str in ranges_to_process:
-
-            try:
-                messages = self.build_generation_prompts(sheet_str, range_str)
-                candidates = self.generate_candidates(messages)
-            except Exception as e:
-                print(f"Query generation failed for range {range_str}: {e}")
-                continue
-
-            if not candidates:
-                print(f"No candidates generated for range {range_str}")
+            # Skip the ranges a previous run finished in a partly processed sheet
+            if (data['filename'], data['sheetname'], range_str) in self.checkpoint:
                 continue
+            context_sheet_str = sheet_str
+            if self.context_token_budget:
+                # Only keep a window of the sheet around the range, within the token budget
+                try:
+                    context_sheet_str, stats = build_windowed_sheet_string(data, range_str, self.context_token_budget,
+                                                                           serializer=serializer)
+                except (PromptTooLongError, ValueError) as e:
+                    record_event("prompt.too_long", "Skipping range %s: %s", range_str, e)
+                    continue
+                if stats["truncated"]:
+                    record_event("prompt.truncated", "Truncated sheet context for %s: kept %d/%d rows, %d/%d columns, "
+                                 "%d/%d characters", range_str, stats['rows_kept'], stats['rows_total'],
+                                 stats['cols_kept'], stats['cols_total'], stats['chars_kept'], stats['chars_total'],
+                                 level=logging.INFO)
 
             try:
-                scored_candidates = self.rejection_sampling(
-                    candidates, range_str,
-                    f"Range: {range_str} | Sheet: {sheet_str}"
-                )
+                messages = self.build_generation_prompts(context_sheet_str, range_str)
             except Exception as e:
-                print(f"Rejection sampling failed for range {range_str}: {e}")
-                continue
-
-            if not scored_candidates:
-                print(f"No scored candidates for range {range_str}")
+                record_event("generation.failed", "Query generation failed for range %s: %s", range_str, e)
                 continue
+            tasks.append({"range": range_str, "context_sheet_string": context_sheet_str, "messages": messages})
 
-            queries_with_scores = []
-            for score, query, score_details in scored_candidates:
-                queries_with_scores.append({
-                    "query": query,
-                    "score": score,
-                    "score_details": score_details
-                })
-
-            if queries_with_scores:
-                best_query = max(queries_with_scores, key=lambda x: x["score"])["query"]
-
-                results.append({
-                    "range": range_str,
-                    "best_query": best_query,
-                    "queries": queries_with_scores,
-                    "sheet_string": sheet_str
-                })
+        return tasks
 
-        return results
+    def _build_result(self, task, scored_candidates, sheet_str):
+        """Build the result record of one range from its accepted candidates."""
+        queries_with_scores = []
+        for score, query, score_details in scored_candidates:
+            queries_with_scores.append({
+                "query": query,
+                "score": score,
+                "score_details": score_details
+            })
 
+        best_query = max(queries_with_scores, key=lambda x: x["score"])["query"]
 
+        return {
+            "range": task["range"],
+            "best_query": best_query,
+            "queries": queries_with_scores,
+            "sheet_string": sheet_str
+        }
 
-    def generate_dataset(self):
-        """Main generation workflow"""
-        processed_count = 0
-        files = glob.glob(os.path.join(self.json_directory, "*.json"))
-
-        with tqdm(total=min(self.api_request_limit, len(files) * 4), desc="Generating") as pbar:
-            for file_path in files:
-                if processed_count >= self.api_request_limit:
-                    break
-
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-
-                # Skip processed sheets
-                file_id = (data['filename'], data['sheetname'])
-                if file_id in self.processed_files:
-                    continue
-
-                # Process formulas
-                results = self.process_ranges(data)
-                processed_count += len(results)
-                pbar.update(len(results))
+    def process_ranges(self, data):
+        return self.process_sheet(data)
 
-                # Save results
-                self._save_results(data['filename'], data['sheetname'], results)
+    async def aprocess_ranges(self, engine, data):
+        """Async counterpart of process_ranges."""
+        return await self.aprocess_sheet(engine, data)
 
-        jsonl_to_csv(self.result_file_path)
 
-    def _save_results(self, filename, sheetname, results):
-        """Save simplified results to JSONL"""
-        with open(self.result_file_path, 'a') as f:
-            for result in results:
-                record = {
-                    "fileName": filename,
-                    "sheetName": sheetname,
-                    "range": result["range"],
-                    "best_query": result["best_query"],
-                    "queries": result["queries"],
-                    "sheet_string": result["sheet_string"],
-                }
-                f.write(json.dumps(record) + '\n')
 if __name__ == '__main__':
+    configure_logging()
     generator = NL2SemanticRangeGenerator(
         api_request_limit=2200,
         json_directory="data/output_json_formula",
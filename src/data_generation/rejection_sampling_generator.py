@@ -0,0 +1,811 @@
+import os
+import asyncio
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from tqdm import tqdm
+
+from src.utils.api_util import request_and_log_api_openrouter, request_and_log_api_openrouter_parallel, \
+    AsyncRequestEngine, ResponseCache, configure_rate_limiter
+from src.utils.jsonl2csv import jsonl_to_csv
+from src.utils.pipeline_util import TaskFailedError, run_pipeline
+from src.utils.checkpoint_util import CheckpointManifest
+from src.utils.sheet_util import CompactSheet, LazySheet
+from src.utils.corpus_index_util import update_corpus_index
+from src.utils.metrics_util import increment, record_event, get_metrics, timed
+from src.utils.formula_index_util import load_formula_index
+from src.utils.pattern_index_util import load_pattern_index, stratified_sample
+from src.utils.sampling_util import normalize_score, stream_rejection_sampling, astream_rejection_sampling
+
+current_script_path = os.path.abspath(__file__)
+project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(current_script_path)))
+
+
+class RejectionSamplingGenerator:
+    """
+    Shared machinery of the generators that create NL queries with an LLM and keep the best-scored ones.
+
+    A subclass turns a sheet into tasks (prepare_tasks), builds the generation prompts and the result
+    records, and sets the class attributes below. Candidate generation, scoring, rejection sampling, the
+    sheet pipelines, checkpointing and result writing are shared.
+    """
+
+    # Name of the task, used for the result file path, e.g. "nl2formula"
+    task_name = None
+    # Directory of the prompt templates
+    resources_directory = None
+    # Task field identifying a task within its sheet, used in the checkpoint manifest
+    task_key = None
+    # Task field holding what the queries describe, and its name in the scoring prompt templates
+    scoring_target_key = None
+    scoring_prompt_field = None
+    # Label of `task_key` in the scoring context
+    context_label = None
+    # Result fields written to the result file, in order, after fileName and sheetName
+    record_fields = ()
+
+    def __init__(self, api_request_limit, json_directory, processed_file_path=None,
+                 generation_model="google/gemini-2.0-flash-001", generation_max_tokens=256, generation_temperature=0.7,
+                 scoring_model="anthropic/claude-3-opus", scoring_max_tokens=256, scoring_temperature=0.0,
+                 candidate_num=3, min_accept_score=0.7, use_n_parameter=False,
+                 cache_path='data/cache/llm_response_cache.sqlite', cache_max_size_bytes=1 << 30, rate_limits=None,
+                 streaming_rejection=False, target_score=0.9, target_count=1, batch_scoring=False,
+                 context_token_budget=None, resume_from=None, checkpoint_fsync_every=32,
+                 formula_index_path=None, pattern_index_path=None, metrics_snapshot_interval=60.0,
+                 corpus_index_path=None):
+        """
+        Initialize the generator with configurable models and parameters.
+
+        Args:
+            api_request_limit (int): Maximum number of API requests allowed.
+            json_directory (str): Directory containing the input JSON files.
+            processed_file_path (str, optional): Path to the file tracking processed sheets.
+            generation_model (str): Model for generating queries. Default is "google/gemini-2.0-flash-001".
+            generation_max_tokens (int): Max tokens for query generation. Default is 256.
+            generation_temperature (float): Temperature for query generation. Default is 0.7.
+            scoring_model (str): Model for rejection sampling. Default is "anthropic/claude-3-opus".
+            scoring_max_tokens (int): Max tokens for scoring. Default is 256.
+            scoring_temperature (float): Temperature for scoring. Default is 0.0.
+            candidate_num (int): Number of candidates for rejection sampling. Default is 3.
+            min_accept_score (float): Minimum score to accept a candidate. Default is 0.7.
+            use_n_parameter (bool): Request all candidates in one call with the `n` parameter instead of
+                sending the same prompt `candidate_num` times. Default is False.
+            cache_path (str, optional): Path of the persistent response cache shared by generation and scoring.
+                Set to None to disable caching. Default is "data/cache/llm_response_cache.sqlite".
+            cache_max_size_bytes (int): Size budget of the response cache. Default is 1 GiB.
+            rate_limits (dict, optional): Per-model request/token budgets for the shared rate limiter, e.g.
+                {"anthropic/claude-3.7-sonnet": {"requests_per_minute": 500, "tokens_per_minute": 400000}}.
+            streaming_rejection (bool): Score each candidate as soon as it is generated and stop once
+                `target_count` candidates reach `target_score`. Default is False.
+            target_score (float): Score (0-1) that counts towards the early exit. Default is 0.9.
+            target_count (int): Number of candidates reaching `target_score` before stopping. Default is 1.
+            batch_scoring (bool): Score all candidates of a task in a single scoring request, falling back to
+                per-candidate scoring if the response cannot be parsed. Ignored in streaming mode. Default is False.
+            context_token_budget (int, optional): Token budget of the sheet string in the generation prompt and
+                scoring context. Larger sheets are cut to a window around the target. None keeps the whole sheet.
+            resume_from (str, optional): Result file of an interrupted run to append to. Work recorded in its
+                checkpoint manifest is skipped. By default a new timestamped result file is started.
+            checkpoint_fsync_every (int): Number of manifest entries between two fsync calls. Default is 32.
+            formula_index_path (str, optional): Formula index built by src/utils/formula_index_util.py. Formulas
+                it marks as invalid are skipped without being tokenized again.
+            pattern_index_path (str, optional): Pattern index built by src/utils/pattern_index_util.py. If given,
+                only `api_request_limit` formulas picked evenly across the formula patterns are processed.
+            metrics_snapshot_interval (float): Seconds between two snapshots of the failure counters, written as
+                JSON next to the result file while a dataset is generated. Default is 60.
+            corpus_index_path (str, optional): Corpus index of the sheet files, see src/utils/corpus_index_util.py.
+                It is updated at the start of every run. Default is a hidden file in `json_directory`.
+        """
+        # API and processing limits
+        self.api_request_limit = api_request_limit
+        self.json_directory = os.path.join(project_root_path, json_directory)
+
+        # Query generation parameters
+        self.generation_model = generation_model
+        self.generation_max_tokens = generation_max_tokens
+        self.generation_temperature = generation_temperature
+
+        # Rejection sampling parameters
+        self.scoring_model = scoring_model
+        self.scoring_max_tokens = scoring_max_tokens
+        self.scoring_temperature = scoring_temperature
+        self.candidate_num = candidate_num
+        self.min_accept_score = min_accept_score
+        self.use_n_parameter = use_n_parameter
+        self.streaming_rejection = streaming_rejection
+        self.target_score = target_score
+        self.target_count = target_count
+        self.batch_scoring = batch_scoring
+        self.context_token_budget = context_token_budget
+
+        # File paths setup
+        current_date = datetime.now().strftime('%Y-%m-%d_%H-%M')
+        filename = f"{self.task_name}_rs_{current_date}.jsonl"
+        self.result_file_path = os.path.join(project_root_path, 'data', 'interim', 'task_specific', self.task_name,
+                                             filename)
+        if resume_from:
+            self.result_file_path = os.path.join(project_root_path, resume_from)
+        os.makedirs(os.path.dirname(self.result_file_path), exist_ok=True)
+
+        # Checkpoint manifest of completed sheets and items, next to the result file
+        self.checkpoint = CheckpointManifest(self.result_file_path + '.manifest', fsync_every=checkpoint_fsync_every)
+
+        # Periodic JSON snapshot of the event counters, next to the result file
+        self.metrics_path = self.result_file_path + '.metrics.json'
+        self.summary_path = os.path.splitext(self.result_file_path)[0] + '_summary.json'
+        self.metrics_snapshot_interval = metrics_snapshot_interval
+
+        # Load templates
+        self.system_message_template = self._load_template(
+            os.path.join(self.resources_directory, 'system_message_prompts.json'))
+        self.user_prompt_template = self._load_template(
+            os.path.join(self.resources_directory, 'user_message_template.txt'))
+        self.scoring_prompt_template = self._load_template(
+            os.path.join(self.resources_directory, 'scoring_prompt.txt'))
+        self.batch_scoring_prompt_template = self._load_template(
+            os.path.join(self.resources_directory, 'batch_scoring_prompt.txt'))
+
+        # Shared rate limiter used by every request thread
+        if rate_limits:
+            configure_rate_limiter(model_limits=rate_limits)
+
+        # Persistent response cache, so that replayed runs and deterministic scoring calls are served locally
+        self.response_cache = None
+        if cache_path:
+            self.response_cache = ResponseCache(os.path.join(project_root_path, cache_path), cache_max_size_bytes)
+
+        # Initialize state
+        self.processed_files = set()
+        if processed_file_path:
+            self._load_processed_files(os.path.join(project_root_path, processed_file_path))
+
+        # Precomputed formula validity, so invalid formulas are skipped without tokenizing them
+        self.formula_index = {}
+        if formula_index_path:
+            self.formula_index = load_formula_index(os.path.join(project_root_path, formula_index_path))
+
+        # Formulas picked evenly across patterns under the request budget; None processes every formula
+        self.sampled_formulas = None
+        self.sampled_sheets = None
+        if pattern_index_path:
+            pattern_index = load_pattern_index(os.path.join(project_root_path, pattern_index_path))
+            self.sampled_formulas = set(stratified_sample(pattern_index, api_request_limit))
+            # Sheets holding a sampled formula; the other sheets are not selected at all
+            self.sampled_sheets = {(filename, sheetname) for filename, sheetname, _ in self.sampled_formulas}
+
+        # Sheet names, formula counts and usable ranges of the sheet files, so they are selected without reading them
+        self.corpus_index_path = os.path.join(project_root_path, corpus_index_path) if corpus_index_path else None
+
+    def _load_template(self, template_path):
+        """Load a template from a file."""
+        with open(template_path, 'r') as f:
+            return json.load(f) if template_path.endswith('.json') else f.read()
+
+    def _has_work(self, entry):
+        """Whether a corpus index entry may yield tasks. Implemented by subclasses."""
+        raise NotImplementedError
+
+    def _needs_cells(self):
+        """Whether the tasks need the cell grid of the sheet, not only its sheet string."""
+        return True
+
+    def prepare_tasks(self, data):
+        """Build the tasks of a sheet, dicts holding their `task_key` and "messages". Implemented by subclasses."""
+        raise NotImplementedError
+
+    def _build_result(self, task, scored_candidates, sheet_str):
+        """Build the result record of a task from its accepted candidates. Implemented by subclasses."""
+        raise NotImplementedError
+
+    def _select_sheet_files(self):
+        """
+        Pick the sheet files to process from the corpus index, without opening them.
+
+        The index is updated first, so only new or changed files are read. Processed sheets and
+        sheets without work (see _has_work) are skipped, as are sheets without a sampled formula when
+        there is a stratified sample.
+
+        Returns:
+            list: Paths of the sheet JSON files to process.
+        """
+        corpus = update_corpus_index(self.json_directory, self.corpus_index_path)
+        return [os.path.join(self.json_directory, name) for name, entry in corpus.items()
+                if self._has_work(entry) and self._is_sheet_sampled(entry.filename, entry.sheetname)
+                and not self._is_sheet_done(entry.filename, entry.sheetname)]
+
+    def _load_sheet(self, file_path):
+        """
+        Load a sheet file unless it was processed already.
+
+        The file is read lazily: a processed sheet is rejected after parsing its filename and sheetname only,
+        and the cell grid is only loaded when the tasks need it.
+
+        Returns:
+            CompactSheet: The sheet, or None if it was processed.
+        """
+        with LazySheet(file_path) as sheet:
+            if self._is_sheet_done(sheet['filename'], sheet['sheetname']):
+                return None
+            return CompactSheet(sheet, include_cells=self._needs_cells())
+
+    def _is_sheet_done(self, filename, sheetname):
+        """Whether a sheet was processed by an earlier run or is recorded in the checkpoint manifest."""
+        file_id = (filename, sheetname)
+        return file_id in self.processed_files or file_id in self.checkpoint
+
+    def _is_formula_invalid(self, filename, sheetname, address):
+        """Whether the formula index marks the formula at `address` as invalid."""
+        entry = self.formula_index.get((filename, sheetname, address))
+        return entry is not None and not entry.valid
+
+    def _is_sheet_sampled(self, filename, sheetname):
+        """Whether the sheet holds a formula of the stratified sample (always True without one)."""
+        return self.sampled_sheets is None or (filename, sheetname) in self.sampled_sheets
+
+    def _is_formula_sampled(self, filename, sheetname, address):
+        """Whether the formula at `address` is part of the stratified sample (always True without one)."""
+        return self.sampled_formulas is None or (filename, sheetname, address) in self.sampled_formulas
+
+    def _load_processed_files(self, file_path):
+        """Load the set of already processed files."""
+        with open(file_path, 'r') as f:
+            for line in f:
+                item = json.loads(line)
+                self.processed_files.add((item['fileName'], item['sheetName']))
+
+    def _build_scoring_prompt(self, query, target, context):
+        return self.scoring_prompt_template.format(context=context, query=query,
+                                                   **{self.scoring_prompt_field: target})
+
+    def evaluate_query_quality(self, query, target, context):
+        """Evaluate query quality using the scoring model."""
+        try:
+            response = request_and_log_api_openrouter(
+                messages=[{"role": "user", "content": self._build_scoring_prompt(query, target, context)}],
+                model=self.scoring_model,
+                max_tokens=self.scoring_max_tokens,
+                temperature=self.scoring_temperature,
+                cache=self.response_cache
+            )
+
+            return self._parse_score_response(response)
+        except json.JSONDecodeError as e:
+            record_event("scoring.json_decode_error", "JSON decoding failed: %s", e)
+            return {"score": 0, "details": {}, "rationale": "Invalid JSON format"}
+        except Exception as e:
+            record_event("scoring.failed", "Scoring failed: %s", e)
+            return {"score": 0, "details": {}, "rationale": "Evaluation failed"}
+
+    def _parse_score_response(self, response):
+        """Extract the score JSON object from a scoring model response."""
+        response = response.strip()
+        json_match = re.search(r'(?i)(?:```json)?\s*(\{[\s\S]*\})(?:```)?', response, re.DOTALL)
+        if not json_match:
+            return {"score": 0, "details": {}, "rationale": "No valid JSON found in response"}
+
+        json_str = json_match.group(1)
+
+        return json.loads(json_str)
+
+    def evaluate_queries_batch(self, queries, target, context):
+        """Score all queries in one request. Returns None if the response cannot be parsed."""
+        try:
+            prompt = self._build_batch_scoring_prompt(queries, target, context)
+            response = request_and_log_api_openrouter(
+                messages=[{"role": "user", "content": prompt}],
+                model=self.scoring_model,
+                max_tokens=self.scoring_max_tokens * len(queries),
+                temperature=self.scoring_temperature,
+                cache=self.response_cache
+            )
+            return self._parse_batch_score_response(response, len(queries))
+        except Exception as e:
+            record_event("scoring.batch_fallback", "Batch scoring failed, falling back to per-candidate scoring: %s", e)
+            return None
+
+    def _build_batch_scoring_prompt(self, queries, target, context):
+        numbered_queries = "\n".join(f"{i}. {query}" for i, query in enumerate(queries, 1))
+        return self.batch_scoring_prompt_template.format(
+            context=context,
+            queries=numbered_queries,
+            num_queries=len(queries),
+            **{self.scoring_prompt_field: target}
+        )
+
+    def _parse_batch_score_response(self, response, num_queries):
+        """Extract one score object per query from a batch scoring response, in query order."""
+        response = response.strip()
+        json_match = re.search(r'(?i)(?:```json)?\s*(\[[\s\S]*\])(?:```)?', response, re.DOTALL)
+        if not json_match:
+            raise ValueError("No valid JSON array found in response")
+
+        items = json.loads(json_match.group(1))
+        if not isinstance(items, list) or len(items) != num_queries:
+            raise ValueError(f"Expected {num_queries} scores, got {len(items) if isinstance(items, list) else 0}")
+        if not all(isinstance(item, dict) for item in items):
+            raise ValueError("Score objects must be JSON objects")
+        # Items carrying an index are put in query order; the indices must then be exactly 1..n
+        if any("index" in item for item in items):
+            indices = [item.get("index") for item in items]
+            if sorted(index for index in indices if type(index) is int) != list(range(1, num_queries + 1)):
+                raise ValueError(f"Expected indices 1..{num_queries}, got {indices}")
+            items = sorted(items, key=lambda item: item["index"])
+
+        score_results = []
+        for item in items:
+            if normalize_score(item) is None:
+                raise ValueError(f"Invalid score object: {item}")
+            score_results.append({
+                "score": item["score"],
+                "breakdown": item.get("breakdown", {}),
+                "rationale": item.get("rationale", "")
+            })
+        return score_results
+
+    def _select_candidates(self, candidates, score_results):
+        """Keep the candidates whose normalized score reaches the acceptance threshold, best first."""
+        scored_candidates = []
+        for query, score_result in zip(candidates, score_results):
+            normalized_score = normalize_score(score_result)
+            if normalized_score is None:
+                record_event("scoring.failed", "Scoring failed for query '%s': no numeric score in %r", query,
+                             score_result)
+                continue
+            if normalized_score >= self.min_accept_score:
+                scored_candidates.append((normalized_score, query, score_result))
+
+        return sorted(scored_candidates, key=lambda x: x[0], reverse=True)
+
+    def generate_candidates(self, messages):
+        """Generate multiple candidate queries in parallel"""
+        responses = request_and_log_api_openrouter_parallel(
+            messages=messages,
+            model=self.generation_model,
+            max_tokens=self.generation_max_tokens,
+            temperature=self.generation_temperature,
+            concurrency=self.candidate_num,
+            use_n=self.use_n_parameter,
+            cache=self.response_cache
+        )
+        return self._parse_candidates(responses)
+
+    def _parse_candidates(self, responses):
+        """Extract the candidate queries from the generation responses."""
+        candidates = []
+        for response in responses:
+            try:
+                candidates.append(json.loads(response)["query"])
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                record_event("generation.unparseable_candidate", "Could not parse candidate: %s", e, level=logging.INFO)
+                continue
+        return candidates
+
+    def _parse_candidate(self, response):
+        candidates = self._parse_candidates([response])
+        return candidates[0] if candidates else None
+
+    def rejection_sampling(self, candidates, target, context):
+        """Perform rejection sampling with model scoring in parallel"""
+        if self.batch_scoring:
+            score_results = self.evaluate_queries_batch(candidates, target, context)
+            if score_results is not None:
+                return self._select_candidates(candidates, score_results)
+
+        scored_candidates = []
+
+        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            futures = [
+                executor.submit(self.evaluate_query_quality, query, target, context)
+                for query in candidates
+            ]
+
+            for future, query in zip(futures, candidates):
+                try:
+                    score_result = future.result()
+                    normalized_score = normalize_score(score_result)
+                    if normalized_score is None:
+                        record_event("scoring.failed", "Scoring failed for query '%s': no numeric score in %r",
+                                     query, score_result)
+                    elif normalized_score >= self.min_accept_score:
+                        scored_candidates.append((
+                            normalized_score,
+                            query,
+                            score_result
+                        ))
+                except Exception as e:
+                    record_event("scoring.failed", "Scoring failed for query '%s': %s", query, e)
+
+        return sorted(scored_candidates, key=lambda x: x[0], reverse=True)
+
+    def streaming_rejection_sampling(self, messages, target, context):
+        """Generate and score candidates one by one, stopping early once enough of them reach the target score"""
+        def _generate():
+            # Not cached: identical sampling requests must yield independent candidates
+            return request_and_log_api_openrouter_parallel(
+                messages=messages,
+                model=self.generation_model,
+                max_tokens=self.generation_max_tokens,
+                temperature=self.generation_temperature
+            )
+
+        return stream_rejection_sampling(
+            _generate, self._parse_candidate,
+            lambda query: self.evaluate_query_quality(query, target, context),
+            candidate_num=self.candidate_num,
+            min_accept_score=self.min_accept_score,
+            target_score=self.target_score,
+            target_count=self.target_count
+        )
+
+    def _scoring_context(self, task):
+        return f"{self.context_label}: {task[self.task_key]} | Sheet: {task['context_sheet_string']}"
+
+    def run_task(self, task, sheet_str):
+        """
+        Generate and score candidates for one prepared task.
+
+        Returns the result, or None if no candidate was accepted. Raises TaskFailedError if the
+        candidates could not be generated or scored.
+        """
+        key = task[self.task_key]
+        target = task[self.scoring_target_key]
+        context = self._scoring_context(task)
+
+        if self.streaming_rejection:
+            try:
+                with timed("stage.generate_and_score"):
+                    scored_candidates = self.streaming_rejection_sampling(task["messages"], target, context)
+            except Exception as e:
+                record_event("scoring.rejection_failed", "Rejection sampling failed for %s: %s", key, e)
+                raise TaskFailedError(key)
+        else:
+            try:
+                with timed("stage.generate"):
+                    candidates = self.generate_candidates(task["messages"])
+            except Exception as e:
+                record_event("generation.failed", "Query generation failed for %s: %s", key, e)
+                raise TaskFailedError(key)
+
+            if not candidates:
+                record_event("generation.no_candidates", "No candidates generated for %s", key)
+                raise TaskFailedError(key)
+
+            try:
+                with timed("stage.score"):
+                    scored_candidates = self.rejection_sampling(candidates, target, context)
+            except Exception as e:
+                record_event("scoring.rejection_failed", "Rejection sampling failed for %s: %s", key, e)
+                raise TaskFailedError(key)
+
+        if not scored_candidates:
+            record_event("scoring.none_accepted", "No scored candidates for %s", key, level=logging.INFO)
+            return None
+
+        return self._build_result(task, scored_candidates, sheet_str)
+
+    def process_sheet(self, data):
+        """Process the tasks of a sheet and return their results"""
+        results, _ = self._run_sheet_tasks(self.prepare_tasks(data), data['SheetString'])
+        return results
+
+    def _run_sheet_tasks(self, tasks, sheet_str):
+        """
+        Run the prepared tasks of a sheet one after another.
+
+        Returns:
+            tuple: The results, and the keys (see task_key) of the tasks that finished with or without an
+                accepted candidate. Failed tasks are left out, so that the next run retries them.
+        """
+        results = []
+        finished = []
+        for task in tasks:
+            try:
+                result = self.run_task(task, sheet_str)
+            except TaskFailedError:
+                continue
+            except Exception as e:
+                record_event("pipeline.task_failed", "Task %s failed: %s", task[self.task_key], e)
+                continue
+            finished.append(task[self.task_key])
+            if result:
+                results.append(result)
+        return results, finished
+
+    async def aevaluate_query_quality(self, engine, query, target, context):
+        """Async counterpart of evaluate_query_quality that sends the request through the engine."""
+        try:
+            response = await engine.request(
+                messages=[{"role": "user", "content": self._build_scoring_prompt(query, target, context)}],
+                model=self.scoring_model,
+                max_tokens=self.scoring_max_tokens,
+                temperature=self.scoring_temperature
+            )
+
+            return self._parse_score_response(response)
+        except json.JSONDecodeError as e:
+            record_event("scoring.json_decode_error", "JSON decoding failed: %s", e)
+            return {"score": 0, "details": {}, "rationale": "Invalid JSON format"}
+        except Exception as e:
+            record_event("scoring.failed", "Scoring failed: %s", e)
+            return {"score": 0, "details": {}, "rationale": "Evaluation failed"}
+
+    async def agenerate_candidates(self, engine, messages):
+        """Async counterpart of generate_candidates."""
+        responses = await engine.request_parallel(
+            messages=messages,
+            model=self.generation_model,
+            max_tokens=self.generation_max_tokens,
+            temperature=self.generation_temperature,
+            concurrency=self.candidate_num,
+            use_n=self.use_n_parameter
+        )
+        return self._parse_candidates(responses)
+
+    async def arejection_sampling(self, engine, candidates, target, context):
+        """Async counterpart of rejection_sampling, scoring all candidates concurrently."""
+        if self.batch_scoring:
+            score_results = await self.aevaluate_queries_batch(engine, candidates, target, context)
+            if score_results is not None:
+                return self._select_candidates(candidates, score_results)
+
+        score_results = await asyncio.gather(
+            *[self.aevaluate_query_quality(engine, query, target, context) for query in candidates]
+        )
+
+        return self._select_candidates(candidates, score_results)
+
+    async def aevaluate_queries_batch(self, engine, queries, target, context):
+        """Async counterpart of evaluate_queries_batch."""
+        try:
+            prompt = self._build_batch_scoring_prompt(queries, target, context)
+            response = await engine.request(
+                messages=[{"role": "user", "content": prompt}],
+                model=self.scoring_model,
+                max_tokens=self.scoring_max_tokens * len(queries),
+                temperature=self.scoring_temperature
+            )
+            return self._parse_batch_score_response(response, len(queries))
+        except Exception as e:
+            record_event("scoring.batch_fallback", "Batch scoring failed, falling back to per-candidate scoring: %s", e)
+            return None
+
+    async def astreaming_rejection_sampling(self, engine, messages, target, context):
+        """Async counterpart of streaming_rejection_sampling; outstanding requests are cancelled on early exit."""
+        async def _generate():
+            return await engine.request(
+                messages=messages,
+                model=self.generation_model,
+                max_tokens=self.generation_max_tokens,
+                temperature=self.generation_temperature,
+                use_cache=False
+            )
+
+        return await astream_rejection_sampling(
+            _generate, self._parse_candidate,
+            lambda query: self.aevaluate_query_quality(engine, query, target, context),
+            candidate_num=self.candidate_num,
+            min_accept_score=self.min_accept_score,
+            target_score=self.target_score,
+            target_count=self.target_count
+        )
+
+    async def arun_task(self, engine, task, sheet_str):
+        """Async counterpart of run_task."""
+        key = task[self.task_key]
+        target = task[self.scoring_target_key]
+        context = self._scoring_context(task)
+
+        if self.streaming_rejection:
+            try:
+                with timed("stage.generate_and_score"):
+                    scored_candidates = await self.astreaming_rejection_sampling(engine, task["messages"], target,
+                                                                                 context)
+            except Exception as e:
+                record_event("scoring.rejection_failed", "Rejection sampling failed for %s: %s", key, e)
+                raise TaskFailedError(key)
+        else:
+            try:
+                with timed("stage.generate"):
+                    candidates = await self.agenerate_candidates(engine, task["messages"])
+            except Exception as e:
+                record_event("generation.failed", "Query generation failed for %s: %s", key, e)
+                raise TaskFailedError(key)
+
+            if not candidates:
+                record_event("generation.no_candidates", "No candidates generated for %s", key)
+                raise TaskFailedError(key)
+
+            try:
+                with timed("stage.score"):
+                    scored_candidates = await self.arejection_sampling(engine, candidates, target, context)
+            except Exception as e:
+                record_event("scoring.rejection_failed", "Rejection sampling failed for %s: %s", key, e)
+                raise TaskFailedError(key)
+
+        if not scored_candidates:
+            record_event("scoring.none_accepted", "No scored candidates for %s", key, level=logging.INFO)
+            return None
+
+        return self._build_result(task, scored_candidates, sheet_str)
+
+    async def aprocess_sheet(self, engine, data):
+        """Async counterpart of process_sheet."""
+        results, _ = await self._arun_sheet_tasks(engine, self.prepare_tasks(data), data['SheetString'])
+        return results
+
+    async def _arun_sheet_tasks(self, engine, tasks, sheet_str):
+        """Async counterpart of _run_sheet_tasks."""
+        results = []
+        finished = []
+        for task in tasks:
+            try:
+                result = await self.arun_task(engine, task, sheet_str)
+            except TaskFailedError:
+                continue
+            except Exception as e:
+                record_event("pipeline.task_failed", "Task %s failed: %s", task[self.task_key], e)
+                continue
+            finished.append(task[self.task_key])
+            if result:
+                results.append(result)
+        return results, finished
+
+    def generate_dataset(self, num_workers=1, queue_depth=8):
+        """
+        Main generation workflow.
+
+        Runs as a bounded pipeline across sheets: a loader stage reads sheet files and builds prompts
+        ahead of time, `num_workers` stages generate and score candidates, and a single writer stage
+        saves the results.
+
+        Args:
+            num_workers (int): Number of sheets generated and scored concurrently. Default is 1.
+            queue_depth (int): Maximum number of sheets waiting between two stages. Default is 8.
+        """
+        processed_count = 0
+        files = self._select_sheet_files()
+
+        def _prepare_sheet(file_path):
+            # Skip processed sheets
+            data = self._load_sheet(file_path)
+            if data is None:
+                return None
+
+            return {
+                "filename": data['filename'],
+                "sheetname": data['sheetname'],
+                "sheet_string": data['SheetString'],
+                "tasks": self.prepare_tasks(data)
+            }
+
+        def _process_sheet(sheet):
+            results, finished = self._run_sheet_tasks(sheet["tasks"], sheet["sheet_string"])
+            return sheet, results, finished
+
+        get_metrics().start_snapshots(self.metrics_path, self.metrics_snapshot_interval)
+        try:
+            with tqdm(total=min(self.api_request_limit, len(files) * 4), desc="Generating") as pbar:
+                def _write_results(item):
+                    nonlocal processed_count
+                    sheet, results, finished = item
+                    processed_count += len(results)
+                    pbar.update(len(results))
+
+                    # Save results
+                    self._save_results(sheet['filename'], sheet['sheetname'], results, finished,
+                                       sheet_done=len(finished) == len(sheet['tasks']))
+                    return processed_count < self.api_request_limit
+
+                run_pipeline(files, _prepare_sheet, _process_sheet, _write_results,
+                             num_workers=num_workers, queue_depth=queue_depth)
+        finally:
+            get_metrics().stop_snapshots()
+
+        self.checkpoint.sync()
+        self._write_summary()
+        jsonl_to_csv(self.result_file_path)
+
+    def generate_dataset_async(self, max_in_flight=32, max_sheets_in_flight=None):
+        """
+        Asyncio generation workflow.
+
+        Sheets are processed concurrently and every generation and scoring request goes through one
+        shared engine, so up to `max_in_flight` requests are pending at any time across all sheets.
+
+        Args:
+            max_in_flight (int): Global limit on concurrent API requests. Default is 32.
+            max_sheets_in_flight (int, optional): Limit on sheets processed concurrently.
+                Defaults to `max_in_flight`.
+        """
+        get_metrics().start_snapshots(self.metrics_path, self.metrics_snapshot_interval)
+        try:
+            asyncio.run(self._agenerate_dataset(max_in_flight, max_sheets_in_flight or max_in_flight))
+        finally:
+            get_metrics().stop_snapshots()
+        self._write_summary()
+        jsonl_to_csv(self.result_file_path)
+
+    async def _agenerate_dataset(self, max_in_flight, max_sheets_in_flight):
+        engine = AsyncRequestEngine(max_in_flight=max_in_flight, cache=self.response_cache)
+        sheet_semaphore = asyncio.Semaphore(max_sheets_in_flight)
+        files = self._select_sheet_files()
+        processed_count = 0
+
+        async def _process_sheet(data, pbar):
+            nonlocal processed_count
+            try:
+                tasks = self.prepare_tasks(data)
+                results, finished = await self._arun_sheet_tasks(engine, tasks, data['SheetString'])
+                processed_count += len(results)
+                pbar.update(len(results))
+                self._save_results(data['filename'], data['sheetname'], results, finished,
+                                   sheet_done=len(finished) == len(tasks))
+            except Exception as e:
+                record_event("pipeline.sheet_failed", "Processing failed for sheet %s in %s: %s", data['sheetname'],
+                             data['filename'], e, level=logging.ERROR)
+            finally:
+                sheet_semaphore.release()
+
+        try:
+            with tqdm(total=min(self.api_request_limit, len(files) * 4), desc="Generating") as pbar:
+                tasks = set()
+                for file_path in files:
+                    await sheet_semaphore.acquire()
+                    if processed_count >= self.api_request_limit:
+                        sheet_semaphore.release()
+                        break
+
+                    # Skip processed sheets
+                    data = self._load_sheet(file_path)
+                    if data is None:
+                        sheet_semaphore.release()
+                        continue
+
+                    task = asyncio.create_task(_process_sheet(data, pbar))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                await asyncio.gather(*tasks)
+        finally:
+            await engine.aclose()
+            self.checkpoint.sync()
+
+    def _write_summary(self):
+        """Write the run's latency, token usage and failure summary next to the result file."""
+        get_metrics().write_snapshot(self.summary_path, extra={
+            "result_file": self.result_file_path,
+            "generation_model": self.generation_model,
+            "scoring_model": self.scoring_model,
+            "candidate_num": self.candidate_num
+        })
+
+    @timed("stage.save")
+    def _save_results(self, filename, sheetname, results, finished, sheet_done):
+        """
+        Save simplified results to JSONL and record the finished work in the checkpoint manifest.
+
+        Args:
+            filename (str): File name of the sheet.
+            sheetname (str): Name of the sheet.
+            results (list): Result records of the sheet.
+            finished (list): Keys (see task_key) of the tasks that finished, with or without a result.
+            sheet_done (bool): Whether every task of the sheet finished. A sheet with failed tasks is not
+                recorded, so that the next run retries them.
+        """
+        with open(self.result_file_path, 'a') as f:
+            for result in results:
+                record = {"fileName": filename, "sheetName": sheetname}
+                record.update((field, result[field]) for field in self.record_fields)
+                f.write(json.dumps(record) + '\n')
+
+        increment("results.saved", len(results))
+        increment("sheets.processed")
+
+        # Record the finished items, and the sheet if it is complete, once their results are written.
+        # A crash between the two writes leaves results without their keys: those tasks are processed
+        # again on resume and their records appear twice in the result file.
+        keys = [(filename, sheetname, key) for key in finished]
+        if sheet_done:
+            keys.append((filename, sheetname))
+        self.checkpoint.add(*keys)
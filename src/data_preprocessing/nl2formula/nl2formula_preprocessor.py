@@ -91,41 +91,47 @@ class NL2FormulaPreprocessor:
 
         return messages
 
-    def preprocess_and_split_data(self):
-        """预处理数据并拆分数据集"""
-        data = []
-
-        # 读取输入文件
+    def read_records(self):
+        """逐行读取输入文件，每次只解析一条记录"""
         with open(self.input_file_path, 'r', encoding='utf-8') as file:
             for line in file:
-                data.append(json.loads(line))
+                yield json.loads(line)
+
+    def preprocess_and_split_data(self, buffer_size=1 << 20):
+        """
+        预处理数据并拆分数据集
+
+        记录被流式读取和处理，并通过同一个带缓冲的文件对象写出，内存占用与输入大小无关。
 
+        Args:
+            buffer_size (int): 输出文件的写缓冲大小（字节）。默认 1 MiB。
+        """
         # 确保输出文件的目录存在
         output_dir = os.path.dirname(self.output_file_path)
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
         # 处理每条数据
-        for item in data:
-            file_path = item.get('FileName', item.get('fileName'))
-            sheet_name = item.get('SheetName', item.get('sheetName'))
-            formula = item.get('Formula', item.get('formula'))
-            address = item.get('Address', item.get('address'))
-            query = item.get('Query', item.get('best_query'))
-            sheet_string = item.get('sheet_string')
-            sheet_string_without_address = item.get('sheet_string_without_address')
-
-            if not query:
-                continue
-
-            # 生成消息列表并保存结果
-            message_list = self.generate_json(sheet_string_without_address, query, address=address, formula=formula)
-            result = {
-                "messages": message_list,
-                "fileName": file_path,
-                "sheetName": sheet_name
-            }
-            with open(self.output_file_path, 'a') as outfile:
+        with open(self.output_file_path, 'w', buffering=buffer_size) as outfile:
+            for item in self.read_records():
+                file_path = item.get('FileName', item.get('fileName'))
+                sheet_name = item.get('SheetName', item.get('sheetName'))
+                formula = item.get('Formula', item.get('formula'))
+                address = item.get('Address', item.get('address'))
+                query = item.get('Query', item.get('best_query'))
+                sheet_string_without_address = item.get('sheet_string_without_address')
+
+                if not query:
+                    continue
+
+                # 生成消息列表并保存结果
+                message_list = self.generate_json(sheet_string_without_address, query, address=address,
+                                                  formula=formula)
+                result = {
+                    "messages": message_list,
+                    "fileName": file_path,
+                    "sheetName": sheet_name
+                }
                 outfile.write(json.dumps(result) + '\n')
 
         # 拆分数据集
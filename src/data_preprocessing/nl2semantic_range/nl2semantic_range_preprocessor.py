@@ -7,6 +7,7 @@ project_root_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirn
 sys.path.append(project_root_path)
 
 from src.data_preprocessing.split_dataset import split_data_keep_test_info
+from src.utils.metrics_util import configure_logging, record_event
 
 
 class NL2SemanticRangePreprocessor:
@@ -85,38 +86,48 @@ class NL2SemanticRangePreprocessor:
 
         return messages
 
-    def preprocess_and_split_data(self):
-        data = []
-
+    def read_records(self):
+        """Yield the records of the input file one at a time."""
         with open(self.input_file_path, 'r') as file:
             for line in file:
-                data.append(json.loads(line))
-
-        for item in data:
-            file_path = item['fileName']
-            sheet_name = item['sheetName']
-            query = item['best_query']
-            range_info = item['range']
-            sheet_string = item['sheet_string']
-
-            if not sheet_string:
-                print(f'Empty SheetString in file {file_path}, sheet {sheet_name}')
-                continue
-
-            if not query:
-                continue
-
-            message_list = self.generate_json(sheet_string, query, range_info)
-
-            result = {
-                "messages": message_list,
-                "fileName": file_path,
-                "sheetName": sheet_name,
-                'query': query,
-                'rangeInfo': range_info,
-            }
+                yield json.loads(line)
+
+    def preprocess_and_split_data(self, buffer_size=1 << 20):
+        """
+        Build the message records of the input file and split them into train and test sets.
+
+        Records are streamed from the input and written through one buffered file object, so memory
+        use does not grow with the input size.
+
+        Args:
+            buffer_size (int): Write buffer size of the output file in bytes. Default is 1 MiB.
+        """
+        with open(self.output_file_path, 'w', buffering=buffer_size) as outfile:
+            for item in self.read_records():
+                file_path = item['fileName']
+                sheet_name = item['sheetName']
+                query = item['best_query']
+                range_info = item['range']
+                sheet_string = item['sheet_string']
+
+                if not sheet_string:
+                    record_event("preprocess.empty_sheet_string", "Empty SheetString in file %s, sheet %s", file_path,
+                                 sheet_name)
+                    continue
+
+                if not query:
+                    continue
+
+                message_list = self.generate_json(sheet_string, query, range_info)
+
+                result = {
+                    "messages": message_list,
+                    "fileName": file_path,
+                    "sheetName": sheet_name,
+                    'query': query,
+                    'rangeInfo': range_info,
+                }
 
-            with open(self.output_file_path, 'a') as outfile:
                 outfile.write(json.dumps(result) + '\n')
 
         # Split the data (90% train, 10% test)
@@ -124,6 +135,7 @@ class NL2SemanticRangePreprocessor:
 
 
 if __name__ == "__main__":
+    configure_logging()
     input_file_path = 'data/interim/task_specific/nl2semantic_range/nl2semantic_range_rs_2025-03-23_20-18.jsonl'
 
     config_list = [
@@ -1,32 +1,548 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+
+from openai import DEFAULT_CONNECTION_LIMITS, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from src.utils.metrics_util import add_usage, increment, observe, record_event
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_API_KEY = "your_api_key"  # Replace with your OpenRouter API key
+
+# Process-wide registry of OpenAI clients keyed by (base_url, api_key), so that every
+# request (including those issued from ThreadPoolExecutor workers) reuses warm connections.
+_client_registry = {}
+_client_registry_lock = threading.Lock()
+
 
-def request_and_log_api_openrouter(messages, model, max_tokens, temperature=0.0, max_retries=1, retry_delay=5):
+def _connection_limits(max_connections, max_keepalive_connections, keepalive_expiry=None):
+    # Built with the Limits class of the HTTP library the installed openai package runs on
+    limits_type = type(DEFAULT_CONNECTION_LIMITS)
+    if keepalive_expiry is None:
+        keepalive_expiry = DEFAULT_CONNECTION_LIMITS.keepalive_expiry
+    return limits_type(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                       keepalive_expiry=keepalive_expiry)
+
+
+def get_openrouter_client(base_url=OPENROUTER_BASE_URL, api_key=OPENROUTER_API_KEY, max_connections=64,
+                          max_keepalive_connections=32, keepalive_expiry=60.0, timeout=120.0):
     """
-    New OpenRouter-based implementation for requesting and logging API.
+    Get the shared OpenAI client for the given base URL and API key, creating it on first use.
+
+    The underlying HTTP client (openai's DefaultHttpxClient) keeps connections alive and is safe to share
+    between threads.
+    The pool limits only take effect when the client is first created.
 
     Args:
-    messages (list): The list of messages.
-    model (str): The model name.
-    max_tokens (int): The maximum number of output tokens limit.
-    temperature (float): Sampling temperature (0.0 to 1.0). Default is 0.0 (deterministic).
-    max_retries (int): Maximum number of retries in case of failure.
-    retry_delay (int): Delay in seconds between retries.
+    base_url (str): The API base URL. Default is the OpenRouter endpoint.
+    api_key (str): The API key.
+    max_connections (int): Maximum number of concurrent connections in the pool.
+    max_keepalive_connections (int): Maximum number of idle connections kept alive.
+    keepalive_expiry (float): Seconds an idle connection is kept alive.
+    timeout (float): Request timeout in seconds.
 
     Returns:
-    str: The response content.
+    OpenAI: The shared client.
+    """
+    key = (base_url, api_key)
+    client = _client_registry.get(key)
+    if client is not None:
+        return client
+
+    with _client_registry_lock:
+        client = _client_registry.get(key)
+        if client is None:
+            http_client = DefaultHttpxClient(
+                limits=_connection_limits(max_connections, max_keepalive_connections, keepalive_expiry),
+                timeout=timeout
+            )
+            client = OpenAI(base_url=base_url, api_key=api_key, http_client=http_client)
+            _client_registry[key] = client
+    return client
+
+
+def close_openrouter_clients():
+    """Close all pooled clients and clear the registry."""
+    with _client_registry_lock:
+        for client in _client_registry.values():
+            client.close()
+        _client_registry.clear()
+
+
+class LLMBackend:
+    """
+    Interface of the chat completion backends the request helpers send their requests to.
+
+    A backend takes the keyword arguments of the OpenAI `chat.completions.create` call and returns a
+    ChatCompletion-like object (`choices[i].message.content` and `usage`). Errors are raised as
+    exceptions; an HTTP status is read from their `status_code` or `response.status_code` and the
+    Retry-After delay from `response.headers`, as for the OpenAI client errors.
+    """
+
+    def create_completion(self, **params):
+        """Send one chat completion request and return the completion."""
+        raise NotImplementedError
+
+    async def acreate_completion(self, **params):
+        """Async counterpart of create_completion."""
+        raise NotImplementedError
+
+    async def aclose(self):
+        """Release the resources held by acreate_completion."""
+
+
+class OpenRouterBackend(LLMBackend):
+    """Backend sending the requests to an OpenAI-compatible endpoint, OpenRouter by default."""
+
+    def __init__(self, base_url=OPENROUTER_BASE_URL, api_key=OPENROUTER_API_KEY, max_connections=64, timeout=120.0):
+        """
+        Args:
+        base_url (str): The API base URL. Default is the OpenRouter endpoint.
+        api_key (str): The API key.
+        max_connections (int): Maximum number of concurrent connections of the async client.
+        timeout (float): Request timeout in seconds.
+        """
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        # Created lazily so that it is bound to the running event loop
+        self._async_client = None
+
+    def create_completion(self, **params):
+        client = get_openrouter_client(self.base_url, self.api_key)
+        return client.chat.completions.create(**params)
+
+    async def acreate_completion(self, **params):
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=_connection_limits(self.max_connections, self.max_connections),
+                    timeout=self.timeout
+                )
+            )
+        return await self._async_client.chat.completions.create(**params)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+
+class MockAPIError(Exception):
+    """Error raised by MockBackend, shaped like an OpenAI API error (status code and response headers)."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Mock API error with status {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def default_mock_response(messages, rng):
+    """
+    Mock response content accepted by both generators' generation and scoring parsers.
+
+    Batch scoring responses must be JSON arrays, so with this responder the generators fall back
+    to scoring the candidates one by one.
+    """
+    score = rng.randint(5, 10)
+    return json.dumps({
+        "query": f"Mock query {rng.getrandbits(32):08x}",
+        "score": score,
+        "details": {"clarity": score, "accuracy": score, "conciseness": score, "completeness": score},
+        "rationale": "Mock response"
+    })
+
+
+class MockBackend(LLMBackend):
+    """
+    In-process backend simulating an LLM API without network access, for tests and benchmarks.
+
+    Every request sleeps for a latency drawn from a log-normal distribution, then fails with a 429
+    (with a Retry-After header) or a 500 at the configured rates, or returns `n` choices produced by
+    `responder`. Token counts are estimated from the prompt (about 4 characters per token) and drawn
+    around `completion_tokens` for each choice. A `requests_per_second` limit makes the mock answer
+    429 to the requests above it, like a server-side rate limit.
+    """
+
+    def __init__(self, latency_median=0.5, latency_sigma=0.5, max_latency=30.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1.0, requests_per_second=None, completion_tokens=64, responder=None, seed=None):
+        """
+        Args:
+        latency_median (float): Median request latency in seconds. Default is 0.5.
+        latency_sigma (float): Sigma of the log-normal latency; larger values give longer tails. Default is 0.5.
+        max_latency (float): Upper bound of a request latency in seconds. Default is 30.
+        error_rate (float): Probability of a request failing with a 500. Default is 0.
+        throttle_rate (float): Probability of a request failing with a 429. Default is 0.
+        retry_after (float, optional): Retry-After header (seconds) of the 429 responses. None sends none.
+        requests_per_second (float, optional): Server-side rate limit; requests above it get a 429.
+        completion_tokens (int): Mean number of completion tokens per choice. Default is 64.
+        responder (callable, optional): Function (messages, rng) -> content of one choice.
+            Default is default_mock_response.
+        seed (int, optional): Seed of the random generator, for reproducible runs.
+        """
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.max_latency = max_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests_per_second = requests_per_second
+        self.completion_tokens = completion_tokens
+        self.responder = responder or default_mock_response
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+
+    def _sample_latency(self):
+        if self.latency_median <= 0:
+            return 0.0
+        with self._lock:
+            latency = self._rng.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+        return min(latency, self.max_latency)
+
+    def _over_rate_limit(self):
+        if self.requests_per_second is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_requests = 0
+            self._window_requests += 1
+            return self._window_requests > self.requests_per_second
+
+    def _respond(self, params):
+        """Return the completion of a request, or raise its simulated error."""
+        if self._over_rate_limit():
+            raise MockAPIError(429, self.retry_after)
+        with self._lock:
+            roll = self._rng.random()
+            if roll < self.throttle_rate:
+                raise MockAPIError(429, self.retry_after)
+            if roll < self.throttle_rate + self.error_rate:
+                raise MockAPIError(500)
+
+            messages = params.get("messages") or []
+            n = params.get("n") or 1
+            choices = [SimpleNamespace(index=i, finish_reason="stop",
+                                       message=SimpleNamespace(role="assistant",
+                                                               content=self.responder(messages, self._rng)))
+                       for i in range(n)]
+            completion_tokens = sum(max(1, int(self._rng.gauss(self.completion_tokens, self.completion_tokens / 4)))
+                                    for _ in range(n))
+
+        prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+        return SimpleNamespace(id="mock", model=params.get("model"), choices=choices, usage=usage)
+
+    def create_completion(self, **params):
+        time.sleep(self._sample_latency())
+        return self._respond(params)
+
+    async def acreate_completion(self, **params):
+        await asyncio.sleep(self._sample_latency())
+        return self._respond(params)
+
+
+# Process-wide backend of the request helpers; None means OpenRouter through the pooled clients
+_backend = None
+
+
+def get_backend():
+    """Get the process-wide backend, an OpenRouterBackend unless set_backend installed another one."""
+    global _backend
+    if _backend is None:
+        _backend = OpenRouterBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Replace the process-wide backend, e.g. with a MockBackend to run the generators offline.
+
+    Args:
+    backend (LLMBackend, optional): The new backend. None restores the default OpenRouter backend.
+
+    Returns:
+    LLMBackend: The previous backend (None if the default was never created).
+    """
+    global _backend
+    previous = _backend
+    _backend = backend
+    return previous
+
+
+class RateLimiter:
+    """
+    Shared client-side rate limiter for API calls.
+
+    Each model gets its own requests-per-minute and tokens-per-minute token buckets and an adaptive
+    concurrency limit. The concurrency limit grows additively on successful requests and shrinks
+    multiplicatively on 429/5xx responses (AIMD). A Retry-After header pauses all requests for the
+    model until it expires. The limiter is thread-safe and can also be awaited from asyncio code.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, model_limits=None,
+                 initial_concurrency=32, min_concurrency=1, max_concurrency=128,
+                 increase_step=1.0, decrease_factor=0.5, decrease_cooldown=2.0):
+        """
+        Args:
+        requests_per_minute (int, optional): Default request budget per model. None means unlimited.
+        tokens_per_minute (int, optional): Default token budget (prompt + max output) per model. None means unlimited.
+        model_limits (dict, optional): Per-model overrides, e.g.
+            {"anthropic/claude-3.7-sonnet": {"requests_per_minute": 500, "tokens_per_minute": 400000}}.
+        initial_concurrency (int): Starting concurrency limit per model.
+        min_concurrency (int): Lower bound of the concurrency limit.
+        max_concurrency (int): Upper bound of the concurrency limit.
+        increase_step (float): Additive increase of the limit per window of successful requests.
+        decrease_factor (float): Multiplicative decrease of the limit on a throttling response.
+        decrease_cooldown (float): Minimum seconds between two decreases, so that one burst of 429s
+            only halves the limit once.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.model_limits = model_limits or {}
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self._condition = threading.Condition()
+        self._models = {}
+
+    def _state(self, model):
+        """Get the limiter state of a model, creating it on first use. Must be called with the lock held."""
+        state = self._models.get(model)
+        if state is None:
+            limits = self.model_limits.get(model, {})
+            rpm = limits.get("requests_per_minute", self.requests_per_minute)
+            tpm = limits.get("tokens_per_minute", self.tokens_per_minute)
+            now = time.monotonic()
+            state = {
+                "rpm": rpm, "requests": float(rpm) if rpm else 0.0,
+                "tpm": tpm, "tokens": float(tpm) if tpm else 0.0,
+                "refilled_at": now,
+                "limit": float(self.initial_concurrency),
+                "in_flight": 0,
+                "paused_until": 0.0,
+                "decreased_at": 0.0,
+            }
+            self._models[model] = state
+        return state
+
+    def _refill(self, state, now):
+        elapsed = now - state["refilled_at"]
+        state["refilled_at"] = now
+        if state["rpm"]:
+            state["requests"] = min(float(state["rpm"]), state["requests"] + elapsed * state["rpm"] / 60.0)
+        if state["tpm"]:
+            state["tokens"] = min(float(state["tpm"]), state["tokens"] + elapsed * state["tpm"] / 60.0)
+
+    def _try_acquire(self, model, tokens):
+        """
+        Try to take a concurrency slot and the request/token budget for one request.
+
+        Returns:
+        float: 0 if the request may start now, otherwise the number of seconds to wait before retrying.
+        """
+        with self._condition:
+            state = self._state(model)
+            now = time.monotonic()
+            if state["paused_until"] > now:
+                return state["paused_until"] - now
+            if state["in_flight"] >= int(state["limit"]):
+                return None  # Wait for a slot to be released
+            self._refill(state, now)
+            wait = 0.0
+            if state["rpm"] and state["requests"] < 1:
+                wait = max(wait, (1 - state["requests"]) * 60.0 / state["rpm"])
+            if state["tpm"]:
+                # A request larger than the whole budget is let through once the bucket is full
+                needed = min(tokens, state["tpm"])
+                if state["tokens"] < needed:
+                    wait = max(wait, (needed - state["tokens"]) * 60.0 / state["tpm"])
+            if wait > 0:
+                return wait
+            if state["rpm"]:
+                state["requests"] -= 1
+            if state["tpm"]:
+                state["tokens"] -= tokens
+            state["in_flight"] += 1
+            return 0.0
+
+    def acquire(self, model, tokens=0):
+        """Block until a request of `tokens` estimated tokens may be sent to `model`."""
+        while True:
+            wait = self._try_acquire(model, tokens)
+            if wait == 0.0:
+                return
+            with self._condition:
+                self._condition.wait(timeout=wait if wait is not None else 1.0)
+
+    async def acquire_async(self, model, tokens=0):
+        """Asyncio counterpart of acquire."""
+        while True:
+            wait = self._try_acquire(model, tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(min(wait, 1.0) if wait is not None else 0.05)
+
+    def release(self, model, succeeded=True, status_code=None, retry_after=None, token_adjustment=0):
+        """
+        Release the slot of a finished request and adapt the concurrency limit.
+
+        Args:
+        model (str): The model name.
+        succeeded (bool): Whether the request succeeded.
+        status_code (int, optional): HTTP status of a failed request, if any.
+        retry_after (float, optional): Seconds from a Retry-After header to pause the model for.
+        token_adjustment (int): Difference between the actual and the estimated token usage,
+            charged to (or refunded from) the token bucket.
+        """
+        with self._condition:
+            state = self._state(model)
+            state["in_flight"] = max(0, state["in_flight"] - 1)
+            now = time.monotonic()
+            if state["tpm"] and token_adjustment:
+                state["tokens"] = min(float(state["tpm"]), state["tokens"] - token_adjustment)
+            if succeeded:
+                # Additive increase: roughly one step per window of `limit` successful requests
+                state["limit"] = min(float(self.max_concurrency),
+                                     state["limit"] + self.increase_step / max(state["limit"], 1.0))
+            elif is_throttling_status(status_code):
+                if now - state["decreased_at"] >= self.decrease_cooldown:
+                    state["limit"] = max(float(self.min_concurrency), state["limit"] * self.decrease_factor)
+                    state["decreased_at"] = now
+                if retry_after:
+                    state["paused_until"] = max(state["paused_until"], now + retry_after)
+            self._condition.notify_all()
+
+    def concurrency_limit(self, model):
+        """Return the current adaptive concurrency limit of a model."""
+        with self._condition:
+            return int(self._state(model)["limit"])
+
+
+_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter():
+    """Get the process-wide rate limiter shared by all request helpers."""
+    return _rate_limiter
+
+
+def configure_rate_limiter(**kwargs):
+    """
+    Replace the process-wide rate limiter.
+
+    Args:
+    **kwargs: Keyword arguments of RateLimiter, e.g. requests_per_minute, tokens_per_minute or model_limits.
+
+    Returns:
+    RateLimiter: The new shared rate limiter.
+    """
+    global _rate_limiter
+    _rate_limiter = RateLimiter(**kwargs)
+    return _rate_limiter
+
+
+def is_throttling_status(status_code):
+    """Whether an HTTP status means the server is overloaded or rate limiting (429 or 5xx)."""
+    return status_code == 429 or (status_code is not None and 500 <= status_code < 600)
+
+
+def get_error_status(error):
+    """Get the HTTP status code of an API error, or None if it has none."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+
+def get_retry_after(error):
+    """Get the Retry-After delay in seconds of an API error, or None if it has none."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def compute_backoff(attempt, base_delay=1.0, max_delay=60.0):
+    """Exponential backoff with full jitter for the given (1-based) attempt number."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+def estimate_request_tokens(messages, max_tokens, n=1):
+    """Roughly estimate the tokens a request consumes (about 4 characters per prompt token)."""
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // 4 + max_tokens * n
+
+
+def _usage_adjustment(completion, estimated_tokens):
+    """Difference between the reported token usage of a completion and its estimate."""
+    usage = getattr(completion, "usage", None)
+    total_tokens = getattr(usage, "total_tokens", None)
+    return total_tokens - estimated_tokens if total_tokens else 0
+
+
+def _record_usage(model, completion, retries):
+    """Record the request, its retries and the prompt/completion tokens reported by the backend."""
+    usage = getattr(completion, "usage", None)
+    add_usage(model, getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0), retries=retries)
+
+
+def _create_chat_completion(messages, model, max_tokens, temperature, n=1, max_retries=1, retry_delay=5,
+                            max_throttle_retries=6, rate_limiter=None):
     """
-    # Create a client for OpenRouter
-    api_key = "your_api_key"
+    Send one chat completion request through the process-wide backend and the shared rate limiter.
+
+    Throttling responses (429/5xx) are retried up to `max_throttle_retries` times, waiting for the
+    Retry-After header or a jittered exponential backoff. Other errors are retried up to `max_retries`
+    times with a fixed `retry_delay`.
 
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,  # Replace with your OpenRouter API key
-    )
+    Returns:
+    ChatCompletion: The completion.
+
+    Raises:
+    Exception: The last error once the retries are exhausted.
+    """
+    backend = get_backend()
+    rate_limiter = rate_limiter or get_rate_limiter()
+    estimated_tokens = estimate_request_tokens(messages, max_tokens, n)
 
     retries = 0
-    while retries < max_retries:
+    throttle_retries = 0
+    while True:
+        rate_limiter.acquire(model, estimated_tokens)
+        attempt_started = time.perf_counter()
         try:
-            # Create a completion with the client
-            completion = client.chat.completions.create(
+            # Create a completion with the backend
+            completion = backend.create_completion(
                 extra_body={},
                 model=model,
                 messages=messages,
@@ -35,32 +551,160 @@ def request_and_log_api_openrouter(messages, model, max_tokens, temperature=0.0,
                 top_p=1.0,
                 frequency_penalty=0,
                 presence_penalty=0,
+                n=n,
                 stop=None,
                 stream=False
             )
-
-            # Get the content of the first choice
-            response = completion.choices[0].message.content
-
-            # Return the response
-            return response
-
         except Exception as e:
+            observe(f"api.{model}", time.perf_counter() - attempt_started)
+            status_code = get_error_status(e)
+            retry_after = get_retry_after(e)
+            rate_limiter.release(model, succeeded=False, status_code=status_code, retry_after=retry_after)
+            if is_throttling_status(status_code) and throttle_retries < max_throttle_retries:
+                throttle_retries += 1
+                delay = retry_after if retry_after is not None else compute_backoff(throttle_retries)
+                record_event("api.throttled", "Throttled with status %s, retrying in %.1fs (%d/%d)",
+                             status_code, delay, throttle_retries, max_throttle_retries)
+                time.sleep(delay)
+                continue
+
             retries += 1
-            print(f"Attempt {retries} failed: {e}")
+            record_event("api.retry", "Attempt %d failed: %s", retries, e)
             if retries < max_retries:
                 time.sleep(retry_delay)  # Wait before retrying
-            else:
-                print("Max retries reached. Unable to complete the request.")
-                raise  # Re-raise the exception if max retries are reached
+                continue
+            record_event("api.failed", "Max retries reached. Unable to complete the request.", level=logging.ERROR)
+            add_usage(model, retries=retries + throttle_retries - 1)
+            raise  # Re-raise the exception if max retries are reached
 
-    return None  # Return None if all retries fail
+        observe(f"api.{model}", time.perf_counter() - attempt_started)
+        rate_limiter.release(model, token_adjustment=_usage_adjustment(completion, estimated_tokens))
+        increment("api.success")
+        _record_usage(model, completion, retries + throttle_retries)
+        return completion
 
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from openai import OpenAI
 
-def request_and_log_api_openrouter_parallel(messages, model, max_tokens, temperature=0.0, max_retries=1, retry_delay=5, concurrency=1):
+class ResponseCache:
+    """
+    Content-addressed persistent cache of API responses, stored in SQLite.
+
+    Entries are keyed by a hash of the request (model, messages, temperature, max_tokens, n) and
+    hold the list of response contents. When the total stored size exceeds `max_size_bytes`, the
+    least recently used entries are evicted. A single instance can be shared between threads.
+    """
+
+    def __init__(self, db_path, max_size_bytes=1 << 30):
+        """
+        Args:
+        db_path (str): Path of the SQLite database file. Parent directories are created if needed.
+        max_size_bytes (int): Maximum total size of the cached responses. Default is 1 GiB.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens, n=1):
+        """Hash the request parameters that determine the response into a cache key."""
+        payload = json.dumps([model, messages, temperature, max_tokens, n], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached list of responses for `key`, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                increment("cache.miss")
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        increment("cache.hit")
+        return json.loads(row[0])
+
+    def put(self, key, responses):
+        """Store the list of responses for `key`, evicting old entries if the size budget is exceeded."""
+        value = json.dumps(responses, ensure_ascii=False)
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self._size += size - (row[0] if row else 0)
+            if self._size > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache is back under 90% of its budget."""
+        target_size = int(self.max_size_bytes * 0.9)
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted_keys = []
+        for key, size in rows:
+            if self._size <= target_size:
+                break
+            evicted_keys.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def request_and_log_api_openrouter(messages, model, max_tokens, temperature=0.0, max_retries=1, retry_delay=5,
+                                   cache=None, max_throttle_retries=6, rate_limiter=None):
+    """
+    New OpenRouter-based implementation for requesting and logging API.
+
+    Args:
+    messages (list): The list of messages.
+    model (str): The model name.
+    max_tokens (int): The maximum number of output tokens limit.
+    temperature (float): Sampling temperature (0.0 to 1.0). Default is 0.0 (deterministic).
+    max_retries (int): Maximum number of retries in case of failure.
+    retry_delay (int): Delay in seconds between retries.
+    cache (ResponseCache, optional): Persistent response cache to serve and store the response.
+    max_throttle_retries (int): Maximum number of retries of 429/5xx responses, with backoff.
+    rate_limiter (RateLimiter, optional): Rate limiter to use. Defaults to the shared one.
+
+    Returns:
+    str: The response content.
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = ResponseCache.make_key(model, messages, temperature, max_tokens)
+        cached = cache.get(cache_key)
+        if cached:
+            return cached[0]
+
+    # Create a completion through the shared pooled client and rate limiter
+    completion = _create_chat_completion(messages, model, max_tokens, temperature, max_retries=max_retries,
+                                         retry_delay=retry_delay, max_throttle_retries=max_throttle_retries,
+                                         rate_limiter=rate_limiter)
+
+    # Get the content of the first choice
+    response = completion.choices[0].message.content
+
+    if cache_key is not None and response is not None:
+        cache.put(cache_key, [response])
+
+    # Return the response
+    return response
+
+
+def request_and_log_api_openrouter_parallel(messages, model, max_tokens, temperature=0.0, max_retries=1, retry_delay=5,
+                                            concurrency=1, use_n=False, cache=None, max_throttle_retries=6,
+                                            rate_limiter=None):
     """
     Parallel version of OpenRouter-based implementation for requesting and logging API.
 
@@ -72,57 +716,40 @@ def request_and_log_api_openrouter_parallel(messages, model, max_tokens, tempera
     max_retries (int): Maximum number of retries in case of failure.
     retry_delay (int): Delay in seconds between retries.
     concurrency (int): Number of concurrent requests. Default is 1 (no concurrency).
+    use_n (bool): If True, request all `concurrency` choices in a single call with the `n` parameter,
+        falling back to parallel requests for the choices the backend did not return. Default is False.
+    cache (ResponseCache, optional): Persistent response cache. A replayed request returns the same
+        set of responses; only complete sets of `concurrency` responses are stored.
+    max_throttle_retries (int): Maximum number of retries of 429/5xx responses, with backoff.
+    rate_limiter (RateLimiter, optional): Rate limiter to use. Defaults to the shared one.
 
     Returns:
     list: A list of response contents. If concurrency=1, returns a single response as a string.
     """
-    # Create a client for OpenRouter
-    api_key = "xxxx"
+    cache_key = None
+    if cache is not None:
+        cache_key = ResponseCache.make_key(model, messages, temperature, max_tokens, n=concurrency)
+        cached = cache.get(cache_key)
+        if cached:
+            return cached[0] if concurrency == 1 else cached
 
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,  # Replace with your OpenRouter API key
-    )
-
-    def _make_request():
+    def _create_completion(n=1):
         """Helper function to make a single API request with retries."""
-        retries = 0
-        while retries < max_retries:
-            try:
-                # Create a completion with the client
-                completion = client.chat.completions.create(
-                    extra_body={},
-                    model=model,
-                    messages=messages,
-                    max_tokens=max_tokens,
-                    temperature=temperature,  # Use the provided temperature
-                    top_p=1.0,
-                    frequency_penalty=0,
-                    presence_penalty=0,
-                    stop=None,
-                    stream=False
-                )
-
-                # Get the content of the first choice
-                response = completion.choices[0].message.content
-                return response
+        try:
+            return _create_chat_completion(messages, model, max_tokens, temperature, n=n, max_retries=max_retries,
+                                           retry_delay=retry_delay, max_throttle_retries=max_throttle_retries,
+                                           rate_limiter=rate_limiter)
+        except Exception:
+            return None  # Return None if max retries are reached
 
-            except Exception as e:
-                retries += 1
-                print(f"Attempt {retries} failed: {e}")
-                if retries < max_retries:
-                    time.sleep(retry_delay)  # Wait before retrying
-                else:
-                    print("Max retries reached. Unable to complete the request.")
-                    return None  # Return None if max retries are reached
+    def _make_request():
+        completion = _create_completion()
+        # Get the content of the first choice
+        return completion.choices[0].message.content if completion else None
 
-    if concurrency == 1:
-        # Single request (no concurrency)
-        return _make_request()
-    else:
-        # Concurrent requests
-        with ThreadPoolExecutor(max_workers=concurrency) as executor:
-            futures = [executor.submit(_make_request) for _ in range(concurrency)]
+    def _make_parallel_requests(num_requests):
+        with ThreadPoolExecutor(max_workers=num_requests) as executor:
+            futures = [executor.submit(_make_request) for _ in range(num_requests)]
             results = []
             for future in as_completed(futures):
                 try:
@@ -130,5 +757,224 @@ def request_and_log_api_openrouter_parallel(messages, model, max_tokens, tempera
                     if result is not None:
                         results.append(result)
                 except Exception as e:
-                    print(f"Concurrent request failed: {e}")
-            return results
\ No newline at end of file
+                    record_event("api.concurrent_failed", "Concurrent request failed: %s", e)
+            return results
+
+    if concurrency == 1:
+        # Single request (no concurrency)
+        result = _make_request()
+        if cache_key is not None and result is not None:
+            cache.put(cache_key, [result])
+        return result
+    elif use_n:
+        # Batched sampling: one request carrying the prompt once and returning `concurrency` choices
+        completion = _create_completion(n=concurrency)
+        results = [choice.message.content for choice in completion.choices
+                   if choice.message.content is not None] if completion else []
+        if len(results) < concurrency:
+            missing = concurrency - len(results)
+            record_event("api.partial_n", "Backend returned %d/%d choices for n=%d, requesting the remaining %d "
+                         "in parallel.", len(results), concurrency, concurrency, missing)
+            results.extend(_make_parallel_requests(missing))
+    else:
+        # Concurrent requests
+        results = _make_parallel_requests(concurrency)
+
+    if cache_key is not None and len(results) == concurrency:
+        cache.put(cache_key, results)
+    return results
+
+
+class AsyncRequestEngine:
+    """
+    Asyncio-based request engine that bounds the number of OpenRouter requests in flight globally.
+
+    A single engine is meant to be shared by every sheet of a run, so that generation and scoring
+    requests from many sheets are interleaved while at most `max_in_flight` requests are pending.
+    """
+
+    def __init__(self, max_in_flight=32, base_url=OPENROUTER_BASE_URL, api_key=OPENROUTER_API_KEY,
+                 max_retries=1, retry_delay=5, timeout=120.0, cache=None, max_throttle_retries=6,
+                 rate_limiter=None, backend=None):
+        """
+        Args:
+        max_in_flight (int): Maximum number of concurrent requests across all callers.
+        base_url (str): The API base URL. Default is the OpenRouter endpoint.
+        api_key (str): The API key.
+        max_retries (int): Maximum number of retries in case of failure.
+        retry_delay (int): Delay in seconds between retries.
+        timeout (float): Request timeout in seconds.
+        cache (ResponseCache, optional): Persistent response cache consulted before every request.
+        max_throttle_retries (int): Maximum number of retries of 429/5xx responses, with backoff.
+        rate_limiter (RateLimiter, optional): Rate limiter to use. Defaults to the shared one.
+        backend (LLMBackend, optional): Backend to send the requests to. Defaults to the backend installed
+            with set_backend, or else an OpenRouterBackend owned (and closed) by the engine.
+        """
+        self.max_in_flight = max_in_flight
+        self.cache = cache
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_throttle_retries = max_throttle_retries
+        self.rate_limiter = rate_limiter
+        if backend is None and _backend is not None:
+            backend = _backend
+        self._owns_backend = backend is None
+        self.backend = backend or OpenRouterBackend(base_url, api_key, max_connections=max_in_flight, timeout=timeout)
+        # Created lazily so that it is bound to the running event loop
+        self._semaphore = None
+
+    async def request(self, messages, model, max_tokens, temperature=0.0, use_cache=True):
+        """
+        Send a single chat completion request, waiting for a free in-flight slot first.
+
+        Args:
+        messages (list): The list of messages.
+        model (str): The model name.
+        max_tokens (int): The maximum number of output tokens limit.
+        temperature (float): Sampling temperature (0.0 to 1.0). Default is 0.0 (deterministic).
+        use_cache (bool): Whether to consult the response cache. Disable it for sampling requests that
+            must yield independent responses. Default is True.
+
+        Returns:
+        str: The response content.
+        """
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = ResponseCache.make_key(model, messages, temperature, max_tokens)
+            cached = self.cache.get(cache_key)
+            if cached:
+                return cached[0]
+
+        response = await self._request(messages, model, max_tokens, temperature)
+        if cache_key is not None and response is not None:
+            self.cache.put(cache_key, [response])
+        return response
+
+    async def _request(self, messages, model, max_tokens, temperature):
+        completion = await self._create_completion(messages, model, max_tokens, temperature)
+        return completion.choices[0].message.content
+
+    async def _create_completion(self, messages, model, max_tokens, temperature, n=1):
+        """Send one chat completion request with retries, holding an in-flight slot while it is pending."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        rate_limiter = self.rate_limiter or get_rate_limiter()
+        estimated_tokens = estimate_request_tokens(messages, max_tokens, n)
+
+        retries = 0
+        throttle_retries = 0
+        while True:
+            async with self._semaphore:
+                await rate_limiter.acquire_async(model, estimated_tokens)
+                attempt_started = time.perf_counter()
+                try:
+                    completion = await self.backend.acreate_completion(
+                        extra_body={},
+                        model=model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        top_p=1.0,
+                        frequency_penalty=0,
+                        presence_penalty=0,
+                        n=n,
+                        stop=None,
+                        stream=False
+                    )
+                except Exception as e:
+                    observe(f"api.{model}", time.perf_counter() - attempt_started)
+                    error = e
+                    status_code = get_error_status(e)
+                    retry_after = get_retry_after(e)
+                    rate_limiter.release(model, succeeded=False, status_code=status_code, retry_after=retry_after)
+                except BaseException:
+                    # Cancelled, e.g. by an early exit of astream_rejection_sampling: free the slot without
+                    # counting the request as a failure of the model
+                    rate_limiter.release(model, succeeded=False)
+                    raise
+                else:
+                    observe(f"api.{model}", time.perf_counter() - attempt_started)
+                    rate_limiter.release(model, token_adjustment=_usage_adjustment(completion, estimated_tokens))
+                    increment("api.success")
+                    _record_usage(model, completion, retries + throttle_retries)
+                    return completion
+
+            # Wait outside the semaphore before retrying
+            if is_throttling_status(status_code) and throttle_retries < self.max_throttle_retries:
+                throttle_retries += 1
+                delay = retry_after if retry_after is not None else compute_backoff(throttle_retries)
+                record_event("api.throttled", "Throttled with status %s, retrying in %.1fs (%d/%d)",
+                             status_code, delay, throttle_retries, self.max_throttle_retries)
+                await asyncio.sleep(delay)
+                continue
+
+            retries += 1
+            record_event("api.retry", "Attempt %d failed: %s", retries, error)
+            if retries < self.max_retries:
+                await asyncio.sleep(self.retry_delay)
+                continue
+            record_event("api.failed", "Max retries reached. Unable to complete the request.", level=logging.ERROR)
+            add_usage(model, retries=retries + throttle_retries - 1)
+            raise error
+
+    async def request_parallel(self, messages, model, max_tokens, temperature=0.0, concurrency=1, use_n=False):
+        """
+        Send `concurrency` identical requests and gather the successful responses.
+
+        Args:
+        messages (list): The list of messages.
+        model (str): The model name.
+        max_tokens (int): The maximum number of output tokens limit.
+        temperature (float): Sampling temperature (0.0 to 1.0).
+        concurrency (int): Number of requests to send.
+        use_n (bool): If True, request all choices in a single call with the `n` parameter,
+            falling back to separate requests for the choices the backend did not return.
+
+        Returns:
+        list: A list of response contents. Failed requests are left out.
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.make_key(model, messages, temperature, max_tokens, n=concurrency)
+            cached = self.cache.get(cache_key)
+            if cached:
+                return cached
+
+        responses = await self._request_parallel(messages, model, max_tokens, temperature, concurrency, use_n)
+        if cache_key is not None and len(responses) == concurrency:
+            self.cache.put(cache_key, responses)
+        return responses
+
+    async def _request_parallel(self, messages, model, max_tokens, temperature, concurrency, use_n):
+        if use_n and concurrency > 1:
+            try:
+                completion = await self._create_completion(messages, model, max_tokens, temperature, n=concurrency)
+                responses = [choice.message.content for choice in completion.choices
+                             if choice.message.content is not None]
+            except Exception as e:
+                record_event("api.batch_failed", "Batched request failed: %s", e)
+                responses = []
+            if len(responses) < concurrency:
+                missing = concurrency - len(responses)
+                record_event("api.partial_n", "Backend returned %d/%d choices for n=%d, requesting the remaining "
+                             "%d separately.", len(responses), concurrency, concurrency, missing)
+                responses.extend(await self._request_parallel(messages, model, max_tokens, temperature, missing,
+                                                              use_n=False))
+            return responses
+
+        results = await asyncio.gather(
+            *[self._request(messages, model, max_tokens, temperature) for _ in range(concurrency)],
+            return_exceptions=True
+        )
+        responses = []
+        for result in results:
+            if isinstance(result, Exception):
+                record_event("api.concurrent_failed", "Concurrent request failed: %s", result)
+            elif result is not None:
+                responses.append(result)
+        return responses
+
+    async def aclose(self):
+        """Close the HTTP client of the engine's own backend."""
+        if self._owns_backend:
+            await self.backend.aclose()
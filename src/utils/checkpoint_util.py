@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+
+
+class CheckpointManifest:
+    """
+    Append-only manifest of completed work keys, kept next to a result file.
+
+    Each line is a compact JSON array such as ["book.xlsx", "Sheet1"] for a finished sheet or
+    ["book.xlsx", "Sheet1", "B7"] for a finished formula/range. Loading the manifest on restart gives
+    O(1) membership tests without re-reading the (much larger) result file. Appends are flushed
+    immediately and fsync'ed in batches of `fsync_every` keys.
+
+    Keys are added after the results they cover are appended to the result file, so a crash in between
+    makes the next run redo that work and write its records a second time. Consumers of the result
+    file should keep the last record per key.
+    """
+
+    def __init__(self, manifest_path, fsync_every=32):
+        """
+        Args:
+            manifest_path (str): Path of the manifest file. It is created if it does not exist.
+            fsync_every (int): Number of appended keys between two fsync calls. Default is 32.
+        """
+        self.manifest_path = manifest_path
+        self.fsync_every = fsync_every
+        self.completed = set()
+        self._lock = threading.Lock()
+        self._unsynced = 0
+
+        torn = os.path.exists(manifest_path) and self._load()
+        self._file = open(manifest_path, 'a', encoding='utf-8')
+        if torn:
+            # Terminate the torn line, so that the next key starts on a line of its own
+            self._file.write('\n')
+            self._file.flush()
+
+    def _load(self):
+        """Load the keys of the manifest and return whether its last line is unterminated."""
+        line = ''
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    self.completed.add(tuple(json.loads(line)))
+                except json.JSONDecodeError:
+                    # A torn last line from a crash mid-write
+                    continue
+        return bool(line) and not line.endswith('\n')
+
+    def __contains__(self, key):
+        return tuple(key) in self.completed
+
+    def __len__(self):
+        return len(self.completed)
+
+    def add(self, *keys):
+        """Record the given keys as completed."""
+        with self._lock:
+            lines = []
+            for key in keys:
+                key = tuple(key)
+                if key not in self.completed:
+                    self.completed.add(key)
+                    lines.append(json.dumps(key, ensure_ascii=False, separators=(',', ':')) + '\n')
+            if not lines:
+                return
+            self._file.writelines(lines)
+            self._file.flush()
+            self._unsynced += len(lines)
+            if self._unsynced >= self.fsync_every:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def sync(self):
+        """Force the pending appends to disk."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._file.close()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+from collections import namedtuple
+
+from src.utils.formula_util import extract_ranges_from_formulas
+from src.utils.metrics_util import configure_logging, record_event
+from src.utils.sheet_util import LazySheet
+
+# Default file name of the corpus index, inside the indexed directory.
+# Not ".json", so that it is not globbed as a sheet.
+CORPUS_INDEX_NAME = '.corpus_index'
+
+# file_size, mtime_ns: stat of the sheet file when it was indexed, to detect changed files
+# sheet_chars: length of the SheetString
+# has_usable_ranges: whether any formula yields a valid range for the nl2semantic_range generator
+CorpusIndexEntry = namedtuple('CorpusIndexEntry', ['filename', 'sheetname', 'formula_count', 'file_size', 'mtime_ns',
+                                                   'sheet_chars', 'has_usable_ranges'])
+
+
+def index_sheet_file(file_path, stat=None):
+    """
+    Build the corpus index entry of one sheet JSON file.
+
+    Only the names, sheet string and formulas are parsed; the cell grid is skipped.
+
+    Parameters:
+    file_path (str): Path of a preprocessed sheet JSON file.
+    stat (os.stat_result, optional): Stat of the file, if already known.
+
+    Returns:
+    CorpusIndexEntry: The entry of the sheet.
+    """
+    stat = stat or os.stat(file_path)
+    with LazySheet(file_path) as sheet:
+        filename = sheet['filename']
+        sheetname = sheet['sheetname']
+        sheet_string = sheet.get('SheetString') or ''
+        formulas = sheet.get('FilteredFormulas', [])
+
+    extraction = extract_ranges_from_formulas([formula_info["Value"] for formula_info in formulas], sheetname,
+                                              addresses=[formula_info.get("Address") for formula_info in formulas],
+                                              max_ranges=1)
+    return CorpusIndexEntry(filename, sheetname, len(formulas), stat.st_size, stat.st_mtime_ns, len(sheet_string),
+                            bool(extraction.ranges))
+
+
+def load_corpus_index(index_path):
+    """
+    Load a corpus index written by update_corpus_index.
+
+    Parameters:
+    index_path (str): Path of the index.
+
+    Returns:
+    dict: Sheet file name (relative to the indexed directory) -> CorpusIndexEntry. Empty if the index is
+        missing or unreadable.
+    """
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            files = json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {name: CorpusIndexEntry(*fields) for name, fields in files.items()}
+
+
+def _write_corpus_index(index_path, index):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"files": {name: list(entry) for name, entry in sorted(index.items())}}, f, ensure_ascii=False,
+                  separators=(',', ':'))
+    os.replace(tmp_path, index_path)
+
+
+def update_corpus_index(json_directory, index_path=None):
+    """
+    Bring the corpus index of a directory of sheet JSON files up to date and return it.
+
+    Files whose size and mtime match their entry are not opened. New and changed files are indexed,
+    entries of deleted files are dropped, and the index is only rewritten if something changed.
+    Unreadable files are left out of the index.
+
+    Parameters:
+    json_directory (str): Directory holding the sheet JSON files.
+    index_path (str, optional): Path of the index. Default is CORPUS_INDEX_NAME inside `json_directory`.
+
+    Returns:
+    dict: Sheet file name -> CorpusIndexEntry, sorted by file name.
+    """
+    index_path = index_path or os.path.join(json_directory, CORPUS_INDEX_NAME)
+    previous = load_corpus_index(index_path)
+
+    index = {}
+    changed = False
+    with os.scandir(json_directory) as entries:
+        sheet_files = sorted((entry.name, entry.stat()) for entry in entries
+                             if entry.name.endswith('.json') and entry.is_file())
+    for name, stat in sheet_files:
+        entry = previous.get(name)
+        if entry is not None and entry.file_size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+            index[name] = entry
+            continue
+        try:
+            index[name] = index_sheet_file(os.path.join(json_directory, name), stat)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            record_event("index.sheet_failed", "Error indexing %s: %s", name, e)
+            continue
+        changed = True
+
+    if changed or len(index) != len(previous):
+        try:
+            index_dir = os.path.dirname(index_path)
+            if index_dir:
+                os.makedirs(index_dir, exist_ok=True)
+            _write_corpus_index(index_path, index)
+        except OSError as e:
+            # A read-only corpus is still usable, it is just indexed again on the next run
+            record_event("index.write_failed", "Error writing corpus index %s: %s", index_path, e)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or update the corpus index of a directory of sheet JSON files.")
+    parser.add_argument("json_directory", help="Directory of sheet JSON files.")
+    parser.add_argument("--output", default=None,
+                        help=f"Path of the index. Default is <json_directory>/{CORPUS_INDEX_NAME}.")
+    args = parser.parse_args()
+
+    configure_logging()
+    corpus = update_corpus_index(args.json_directory, args.output)
+    print(f"Indexed {len(corpus)} sheets, {sum(entry.formula_count for entry in corpus.values())} formulas, "
+          f"{sum(entry.has_usable_ranges for entry in corpus.values())} sheets with usable ranges")
@@ -0,0 +1,139 @@
+import argparse
+import glob
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from src.utils.formula_util import analyze_formula, check_formula_validity
+from src.utils.metrics_util import configure_logging, record_event
+
+# valid: the formula tokenizes and all tokens pass validate_token
+# pattern: get_formula_pattern of the formula (None if not valid)
+# error: the first token error, or the check_formula_validity error of a valid formula (None if it passed)
+FormulaIndexEntry = namedtuple('FormulaIndexEntry', ['valid', 'pattern', 'error'])
+
+
+def validate_sheet_file(file_path):
+    """
+    Validate all FilteredFormulas of one sheet JSON file.
+
+    Parameters:
+    file_path (str): Path of a preprocessed sheet JSON file.
+
+    Returns:
+    list: A compact index record [filename, sheetname, [[address, valid, pattern, error], ...]].
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    sheet_name = data['sheetname']
+    entries = []
+    for formula_info in data.get('FilteredFormulas', []):
+        formula = formula_info["Value"]
+        address = formula_info.get("Address")
+        try:
+            analysis = analyze_formula(formula, address=address)
+        except Exception as e:
+            # openpyxl could not tokenize the formula at all
+            entries.append([address, 0, None, str(e)])
+            continue
+
+        if not analysis.is_valid:
+            entries.append([address, 0, None, analysis.errors[0]])
+            continue
+
+        try:
+            check_formula_validity(formula, sheet_name, address)
+            error = None
+        except ValueError as e:
+            error = str(e)
+        entries.append([address, 1, analysis.pattern, error])
+
+    return [data['filename'], sheet_name, entries]
+
+
+def _validate_sheet_files(file_paths):
+    records = []
+    for file_path in file_paths:
+        try:
+            records.append(validate_sheet_file(file_path))
+        except Exception as e:
+            record_event("index.validation_failed", "Error validating formulas of %s: %s", file_path, e)
+    return records
+
+
+def _chunks(items, chunk_size):
+    for i in range(0, len(items), chunk_size):
+        yield items[i:i + chunk_size]
+
+
+def build_formula_index(json_directories, output_path, num_workers=None, chunk_size=32):
+    """
+    Validate every formula of every sheet JSON in the given directories over a process pool.
+
+    Each line of the output is the compact record of one sheet (see validate_sheet_file).
+
+    Parameters:
+    json_directories (list): Directories, or glob patterns of directories, holding the sheet JSON files.
+    output_path (str): Path of the JSONL index to write.
+    num_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+    chunk_size (int): Number of sheet files validated per task. Default is 32.
+
+    Returns:
+    dict: Number of sheets, formulas and valid formulas indexed.
+    """
+    file_paths = []
+    for pattern in json_directories:
+        for directory in sorted(glob.glob(pattern)):
+            file_paths.extend(sorted(glob.glob(os.path.join(directory, "*.json"))))
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    stats = {"sheets": 0, "formulas": 0, "valid": 0}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor, \
+            open(output_path, 'w', encoding='utf-8') as output_file:
+        for records in executor.map(_validate_sheet_files, _chunks(file_paths, chunk_size)):
+            for record in records:
+                output_file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+                stats["sheets"] += 1
+                stats["formulas"] += len(record[2])
+                stats["valid"] += sum(entry[1] for entry in record[2])
+
+    return stats
+
+
+def load_formula_index(index_path):
+    """
+    Load a formula index written by build_formula_index.
+
+    Parameters:
+    index_path (str): Path of the JSONL index.
+
+    Returns:
+    dict: (filename, sheetname, address) -> FormulaIndexEntry.
+    """
+    index = {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            filename, sheet_name, entries = json.loads(line)
+            for address, valid, pattern, error in entries:
+                index[(filename, sheet_name, address)] = FormulaIndexEntry(bool(valid), pattern, error)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate all sheet formulas and write a validity/pattern index.")
+    parser.add_argument("json_directories", nargs='+',
+                        help="Directories (or glob patterns, e.g. 'data/raw/raw_data_json_*') of sheet JSON files.")
+    parser.add_argument("--output", default="data/interim/formula_index.jsonl", help="Path of the index to write.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--chunk-size", type=int, default=32, help="Number of sheet files per task.")
+    args = parser.parse_args()
+
+    configure_logging()
+    stats = build_formula_index(args.json_directories, args.output, args.workers, args.chunk_size)
+    print(f"Indexed {stats['formulas']} formulas ({stats['valid']} valid) from {stats['sheets']} sheets "
+          f"into {args.output}")
@@ -1,7 +1,12 @@
 import re
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
 
 from openpyxl.formula import Tokenizer
 
+from src.utils.metrics_util import increment
+
 text_functions = [
     "CONCATENATE",
     "CONCAT",
@@ -82,19 +87,348 @@ official_functions = ['ABS', 'ACCRINT', 'ACCRINTM', 'ACOS', 'ACOSH', 'ACOT', 'AC
                       'WEEKDAY', 'WEEKNUM', 'WEIBULL', 'WEIBULL.DIST', 'WORKDAY', 'WORKDAY.INTL', 'XIRR', 'XNPV', 'XOR',
                       'YEAR', 'YEARFRAC', 'YIELD', 'YIELDDISC', 'YIELDMAT', 'Z.TEST', 'ZTEST', 'FALSE', 'TRUE']
 
+# Precompiled whitelists, so that membership tests are O(1) and not rebuilt per token or per call
+valid_functions = frozenset(['ACOS', 'ACOSH', 'AND', 'ASIN', 'ATAN', 'AVERAGE', 'AVERAGEA', 'BINOMDIST', 'CEILING',
+                             'CELL', 'CHAR', 'CHIDIST', 'CHIINV', 'CHOOSE', 'COLUMN', 'COMBIN', 'CONCATENATE',
+                             'CONFIDENCE', 'CORREL', 'COS', 'COSH', 'COUNT', 'COUNTA', 'COUNTBLANK', 'COUNTIF',
+                             'COUNTIFS', 'COVAR', 'DATE', 'DATEDIF', 'DATEVALUE', 'DAY', 'DEGREES', 'DOLLAR', 'EDATE',
+                             'EOMONTH', 'ERFC', 'EVEN', 'EXACT', 'EXP', 'FACT', 'FIND', 'FIXED', 'FLOOR', 'FORECAST',
+                             'FREQUENCY', 'FV', 'GAMMADIST', 'GEOMEAN', 'HLOOKUP', 'HOUR', 'HYPERLINK', 'IF',
+                             'IFERROR', 'INDEX', 'INDIRECT', 'INT', 'INTERCEPT', 'IRR', 'ISBLANK', 'ISERR', 'ISERROR',
+                             'ISNA', 'ISNUMBER', 'ISTEXT', 'LARGE', 'LEFT', 'LEN', 'LINEST', 'LN', 'LOG', 'LOG10',
+                             'LOGEST', 'LOOKUP', 'LOWER', 'MATCH', 'MAX', 'MAXA', 'MDETERM', 'MEDIAN', 'MID', 'MIN',
+                             'MINA', 'MINUTE', 'MINVERSE', 'MMULT', 'MOD', 'MODE', 'MONTH', 'MROUND', 'N',
+                             'NETWORKDAYS', 'NORMDIST', 'NORMINV', 'NORMSDIST', 'NORMSINV', 'NOT', 'NOW', 'NPV',
+                             'OFFSET', 'OR', 'PI', 'PMT', 'POWER', 'PRODUCT', 'PROPER', 'PV', 'QUARTILE', 'QUOTIENT',
+                             'RADIANS', 'RAND', 'RANK', 'REPT', 'RIGHT', 'ROUND', 'ROUNDDOWN', 'ROUNDUP', 'ROW',
+                             'ROWS', 'SEARCH', 'SIGN', 'SIN', 'SLOPE', 'SMALL', 'SQRT', 'STDEV', 'STDEVA', 'STDEVP',
+                             'SUBNM', 'SUBSTITUTE', 'SUBTOTAL', 'SUM', 'SUMIF', 'SUMPRODUCT', 'SUMSQ', 'TANH',
+                             'TDIST', 'TEXT', 'TIME', 'TINV', 'TODAY', 'TRANSPOSE', 'TRIM', 'TRUE', 'TRUNC', 'TTEST',
+                             'UPPER', 'VAR', 'VARA', 'VARP', 'VLOOKUP', 'WEEKDAY', 'XIRR', 'XNPV', 'YEAR'])
+text_function_set = frozenset(text_functions)
+
+
+# A1 references outside of string literals, quoted sheet names and brackets. Function names such as
+# LOG10( and unquoted sheet names such as Q1! are not references.
+_A1_REF_RE = re.compile(r"(\"(?:[^\"]|\"\")*\"|'(?:[^']|'')*'|\[[^\]]*\])"
+                        r"|(?<![A-Za-z0-9_.$])(\$?)([A-Z]{1,3})(\$?)([1-9][0-9]*)(?![A-Za-z0-9_.(!\[])")
+_R1C1_REF_RE = re.compile("\x00R([ar])(n?)([0-9]+)C([ar])(n?)([0-9]+)\x00")
+_ADDRESS_RE = re.compile(r"^\$?([A-Z]{1,3})\$?([1-9][0-9]*)$")
+
+
+def _column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - 64
+    return index
+
+
+def column_letters(index):
+    """Return the letters of the 1-based column `index`, e.g. 1 -> "A", 28 -> "AB"."""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _encode_offset(kind, value, origin):
+    if kind == 'a':
+        return 'a' + str(value)
+    offset = value - origin
+    return 'r' + ('n' + str(-offset) if offset < 0 else str(offset))
+
+
+def to_r1c1_skeleton(formula, address):
+    """
+    Rewrite the A1 references of a formula relative to the cell holding it.
+
+    Fill-down variants such as =SUM(B2:B3) in C3 and =SUM(B3:B4) in C4 share one skeleton. Absolute
+    ($-prefixed) parts keep their value, relative parts become offsets from `address`. The references
+    are encoded as NUL-delimited placeholders that openpyxl tokenizes as plain RANGE operands.
+
+    Parameters:
+    formula (str): The formula to normalize.
+    address (str): The A1 address of the cell holding the formula, e.g. "C3".
+
+    Returns:
+    str: The skeleton, or None if `address` is not a valid A1 cell address.
+    """
+    match = _ADDRESS_RE.match(address)
+    if match is None:
+        return None
+    origin_row = int(match.group(2))
+    origin_col = _column_index(match.group(1))
+
+    def _encode(ref):
+        if ref.group(1) is not None:
+            return ref.group(1)
+        col_abs, col, row_abs, row = ref.group(2, 3, 4, 5)
+        row_part = _encode_offset('a' if row_abs else 'r', int(row), origin_row)
+        col_part = _encode_offset('a' if col_abs else 'r', _column_index(col), origin_col)
+        return f"\x00R{row_part}C{col_part}\x00"
+
+    return _A1_REF_RE.sub(_encode, formula)
+
+
+def from_r1c1_skeleton(text, address):
+    """
+    Inverse of to_r1c1_skeleton: resolve the placeholders in `text` against the cell `address`.
+
+    Parameters:
+    text (str): A skeleton, or a token value taken from a tokenized skeleton.
+    address (str): The A1 address of the cell the references are resolved against.
+
+    Returns:
+    str: The text with A1 references.
+    """
+    match = _ADDRESS_RE.match(address)
+    origin_row = int(match.group(2))
+    origin_col = _column_index(match.group(1))
+
+    def _decode(ref):
+        row_kind, row_neg, row, col_kind, col_neg, col = ref.groups()
+        row = int(row) * (-1 if row_neg else 1) + (origin_row if row_kind == 'r' else 0)
+        col = int(col) * (-1 if col_neg else 1) + (origin_col if col_kind == 'r' else 0)
+        return f"{'$' if col_kind == 'a' else ''}{column_letters(col)}{'$' if row_kind == 'a' else ''}{row}"
+
+    return _R1C1_REF_RE.sub(_decode, text)
+
+
+class _TokenCache:
+    """Thread-safe bounded LRU cache of token tuples with hit/miss counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            tokens = self._entries.get(key)
+            if tokens is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return tokens
+
+    def put(self, key, tokens):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = tokens
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "maxsize": self.maxsize,
+                    "currsize": len(self._entries)}
+
+
+_token_cache = _TokenCache(maxsize=65536)
+
+
+def configure_tokenization_cache(maxsize):
+    """
+    Resize the tokenization cache and drop its entries and statistics.
+
+    Parameters:
+    maxsize (int): Maximum number of cached formulas/skeletons. 0 disables caching.
+    """
+    _token_cache.clear()
+    _token_cache.maxsize = maxsize
+
+
+def tokenization_cache_info():
+    """Return the hits, misses, maxsize and currsize of the tokenization cache as a dict."""
+    return _token_cache.info()
+
+
+# One scanner for the common subset of formulas. Operands are the runs openpyxl accumulates char by char;
+# anything that is not matched here ({ } ' [ # newlines) makes fast_tokenize_formula defer to openpyxl.
+_FAST_TOKEN_RE = re.compile(r"""
+    (?P<string>"(?:[^"]*"")*[^"]*"(?!"))
+    |(?P<operand>[^,;{}() \n+\-*/^&=><%"'\[\#]+)(?P<call>\()?
+    |(?P<space>[ ]+)
+    |(?P<compare>>=|<=|<>)
+    |(?P<operator>[-+*/^&=><%])
+    |(?P<open>\()
+    |(?P<close>\))
+    |(?P<separator>[,;])
+""", re.VERBOSE)
+_SCIENTIFIC_RE = re.compile(r"^[1-9](\.[0-9]+)?[Ee]$")
+
+
+class _DeferToOpenpyxl(Exception):
+    pass
+
+
+def _make_operand(value):
+    # Same classification as openpyxl's Token.make_operand
+    if value in ('TRUE', 'FALSE'):
+        return value, 'OPERAND', 'LOGICAL'
+    try:
+        float(value)
+        return value, 'OPERAND', 'NUMBER'
+    except ValueError:
+        return value, 'OPERAND', 'RANGE'
+
+
+def _fast_tokenize(formula):
+    items = []
+    stack = []  # 'FUNC' or 'PAREN' for each open parenthesis
+    match_at = _FAST_TOKEN_RE.match
+    pos = 1
+    operand_end = -1
+    end = len(formula)
+
+    while pos < end:
+        m = match_at(formula, pos)
+        if m is None:
+            raise _DeferToOpenpyxl
+        kind = m.lastgroup
+        value = m.group()
+
+        if kind == 'operand' or kind == 'call':
+            operand = m.group('operand')
+            if m.group('call'):
+                items.append((operand + '(', 'FUNC', 'OPEN'))
+                stack.append('FUNC')
+            else:
+                if _SCIENTIFIC_RE.match(operand) and m.end() < end and formula[m.end()] in '+-':
+                    raise _DeferToOpenpyxl
+                items.append(_make_operand(operand))
+                operand_end = m.end()
+        elif kind == 'string':
+            # openpyxl rejects or merges a string glued to an operand
+            if pos == operand_end:
+                raise _DeferToOpenpyxl
+            items.append((value, 'OPERAND', 'TEXT'))
+        elif kind == 'space':
+            items.append((' ', 'WHITE-SPACE', ''))
+        elif kind == 'compare':
+            items.append((value, 'OPERATOR-INFIX', ''))
+        elif kind == 'operator':
+            if value == '%':
+                items.append(('%', 'OPERATOR-POSTFIX', ''))
+            elif value not in '+-':
+                items.append((value, 'OPERATOR-INFIX', ''))
+            elif not items:
+                items.append((value, 'OPERATOR-PREFIX', ''))
+            else:
+                prev = next((item for item in reversed(items) if item[1] != 'WHITE-SPACE'), None)
+                is_infix = prev is not None and (
+                    prev[2] == 'CLOSE' or prev[1] == 'OPERATOR-POSTFIX' or prev[1] == 'OPERAND'
+                )
+                items.append((value, 'OPERATOR-INFIX' if is_infix else 'OPERATOR-PREFIX', ''))
+        elif kind == 'open':
+            items.append(('(', 'PAREN', 'OPEN'))
+            stack.append('PAREN')
+        elif kind == 'close':
+            if not stack:
+                raise _DeferToOpenpyxl
+            items.append((')', stack.pop(), 'CLOSE'))
+        else:  # separator
+            if value == ';':
+                items.append((';', 'SEP', 'ROW'))
+            elif not stack or stack[-1] == 'PAREN':
+                items.append((',', 'OPERATOR-INFIX', ''))  # Range union operator
+            else:
+                items.append((',', 'SEP', 'ARG'))
+        pos = m.end()
+
+    return items
+
+
+def openpyxl_tokenize_formula(formula):
+    """
+    Tokenize a formula with openpyxl's Tokenizer, bypassing the fast path and the cache.
+
+    Parameters:
+    formula (str): The formula to tokenize.
+
+    Returns:
+    tuple: Tuples, each containing the token value, type, and subtype.
+    """
+    tok = Tokenizer(formula)
+    return tuple((t.value, t.type, t.subtype) for t in tok.items)
+
+
+def fast_tokenize_formula(formula):
+    """
+    Tokenize a formula into the same (value, type, subtype) tuples as openpyxl's Tokenizer.
+
+    Functions, A1 ranges, numbers, strings, operators and separators are scanned with one compiled
+    regex. Formulas with constructs outside of that subset, such as external workbook references,
+    quoted sheet names, array constants, error literals or scientific notation, are handed to openpyxl,
+    so the result (including any exception raised) is always the one openpyxl would give.
 
-def tokenize_formula(formula):
+    Parameters:
+    formula (str): The formula to tokenize.
+
+    Returns:
+    tuple: Tuples, each containing the token value, type, and subtype.
+    """
+    if not formula:
+        return ()
+    if formula[0] != '=':
+        return ((formula, 'LITERAL', ''),)
+    try:
+        return tuple(_fast_tokenize(formula))
+    except _DeferToOpenpyxl:
+        increment("formula.tokenizer_fallback")
+        return openpyxl_tokenize_formula(formula)
+
+
+def _tokenize_uncached(formula):
+    return fast_tokenize_formula(formula)
+
+
+def tokenize_formula(formula, address=None):
     """
     Tokenize a formula and return a list of tuples, each containing the token value, type, and subtype.
 
+    Results are kept in a bounded LRU cache keyed by the formula text. If the address of the cell holding
+    the formula is given, the cache is keyed by its R1C1 skeleton instead (see to_r1c1_skeleton), so
+    that relative fill-down variants of a formula are tokenized only once.
+
     Parameters:
     formula (str): The formula to tokenize.
+    address (str): Optional A1 address of the cell holding the formula.
 
     Returns:
     list: A list of tuples, each containing the token value, type, and subtype.
     """
-    tok = Tokenizer(formula)
-    return [(t.value, t.type, t.subtype) for t in tok.items]
+    skeleton = to_r1c1_skeleton(formula, address) if address else None
+    if skeleton is None or skeleton == formula:
+        key = formula
+        skeleton = None
+    else:
+        key = skeleton
+
+    tokens = _token_cache.get(key)
+    if tokens is None:
+        tokens = _tokenize_uncached(key)
+        _token_cache.put(key, tokens)
+
+    if skeleton is None:
+        return list(tokens)
+    return [(from_r1c1_skeleton(t_value, address) if '\x00' in t_value else t_value, t_type, t_subtype)
+            for t_value, t_type, t_subtype in tokens]
+
+
+_RANGE_FORMAT_RE = re.compile(r"[A-Z]+[0-9]+(:[A-Z]+[0-9]+)?")
 
 
 def validate_token(token):
@@ -109,23 +443,6 @@ def validate_token(token):
     """
     t_value, t_type, t_subtype = token
 
-    valid_functions = ['ACOS', 'ACOSH', 'AND', 'ASIN', 'ATAN', 'AVERAGE', 'AVERAGEA', 'BINOMDIST', 'CEILING', 'CELL',
-                       'CHAR', 'CHIDIST', 'CHIINV', 'CHOOSE', 'COLUMN', 'COMBIN', 'CONCATENATE', 'CONFIDENCE', 'CORREL',
-                       'COS', 'COSH', 'COUNT', 'COUNTA', 'COUNTBLANK', 'COUNTIF', 'COUNTIFS', 'COVAR', 'DATE',
-                       'DATEDIF', 'DATEVALUE', 'DAY', 'DEGREES', 'DOLLAR', 'EDATE', 'EOMONTH', 'ERFC', 'EVEN', 'EXACT',
-                       'EXP', 'FACT', 'FIND', 'FIXED', 'FLOOR', 'FORECAST', 'FREQUENCY', 'FV', 'GAMMADIST', 'GEOMEAN',
-                       'HLOOKUP', 'HOUR', 'HYPERLINK', 'IF', 'IFERROR', 'INDEX', 'INDIRECT', 'INT', 'INTERCEPT', 'IRR',
-                       'ISBLANK', 'ISERR', 'ISERROR', 'ISNA', 'ISNUMBER', 'ISTEXT', 'LARGE', 'LEFT', 'LEN', 'LINEST',
-                       'LN', 'LOG', 'LOG10', 'LOGEST', 'LOOKUP', 'LOWER', 'MATCH', 'MAX', 'MAXA', 'MDETERM', 'MEDIAN',
-                       'MID', 'MIN', 'MINA', 'MINUTE', 'MINVERSE', 'MMULT', 'MOD', 'MODE', 'MONTH', 'MROUND', 'N',
-                       'NETWORKDAYS', 'NORMDIST', 'NORMINV', 'NORMSDIST', 'NORMSINV', 'NOT', 'NOW', 'NPV', 'OFFSET',
-                       'OR', 'PI', 'PMT', 'POWER', 'PRODUCT', 'PROPER', 'PV', 'QUARTILE', 'QUOTIENT', 'RADIANS', 'RAND',
-                       'RANK', 'REPT', 'RIGHT', 'ROUND', 'ROUNDDOWN', 'ROUNDUP', 'ROW', 'ROWS', 'SEARCH', 'SIGN', 'SIN',
-                       'SLOPE', 'SMALL', 'SQRT', 'STDEV', 'STDEVA', 'STDEVP', 'SUBNM', 'SUBSTITUTE', 'SUBTOTAL', 'SUM',
-                       'SUMIF', 'SUMPRODUCT', 'SUMSQ', 'TANH', 'TDIST', 'TEXT', 'TIME', 'TINV', 'TODAY', 'TRANSPOSE',
-                       'TRIM', 'TRUE', 'TRUNC', 'TTEST', 'UPPER', 'VAR', 'VARA', 'VARP', 'VLOOKUP', 'WEEKDAY', 'XIRR',
-                       'XNPV', 'YEAR']
-
     if t_type == 'OPERAND' and t_subtype == 'ERROR':
         raise ValueError(f"Invalid token value: {t_value}")
 
@@ -133,15 +450,94 @@ def validate_token(token):
         if not t_value.endswith('('):
             raise ValueError(f"Invalid function syntax: {t_value}")
         func_name = t_value[:-1]  # Remove the trailing '('
-        if not func_name in valid_functions:
+        if func_name not in valid_functions:
             raise ValueError(f"Function name is not in valid formulas: {func_name}")
 
     if t_type == 'OPERAND' and t_subtype == 'RANGE':
         clean_range = t_value.split('!')[-1].replace('$', '')
-        if not re.match(r"[A-Z]+[0-9]+(:[A-Z]+[0-9]+)?", clean_range):
+        if not _RANGE_FORMAT_RE.match(clean_range):
             raise ValueError(f"Invalid range format: {t_value}")
 
 
+class FormulaAnalysis:
+    """
+    Everything the filters need to know about one formula, computed from a single tokenization.
+
+    Attributes:
+    formula (str): The analyzed formula.
+    tokens (list): The (value, type, subtype) tuples of the formula.
+    function_names (list): The function names in order of appearance, without the trailing '('.
+    ranges (list): The unique cleaned ranges that refer to the analyzed sheet. Only filled when a sheet
+        name was given.
+    range_errors (list): Messages for the ranges that do not refer to the analyzed sheet or are malformed.
+    pattern (str): The sorted, comma-joined function names (see get_formula_pattern).
+    errors (list): Messages for the tokens that failed validate_token, in order of appearance.
+    """
+    __slots__ = ('formula', 'tokens', 'function_names', 'ranges', 'range_errors', 'pattern', 'errors')
+
+    def __init__(self, formula, tokens, function_names, ranges, range_errors, errors):
+        self.formula = formula
+        self.tokens = tokens
+        self.function_names = function_names
+        self.ranges = ranges
+        self.range_errors = range_errors
+        self.pattern = ','.join(sorted(function_names))
+        self.errors = errors
+
+    @property
+    def is_valid(self):
+        """True if every token passed validate_token."""
+        return not self.errors
+
+    def raise_for_errors(self):
+        """Raise a ValueError with the first token error, as parse_formula would."""
+        if self.errors:
+            raise ValueError(self.errors[0])
+
+
+def analyze_formula(formula, sheet_name=None, address=None):
+    """
+    Tokenize a formula once and collect its function names, ranges, pattern and validation errors.
+
+    Unlike parse_formula, invalid tokens do not raise: their messages are collected in `errors`.
+
+    Parameters:
+    formula (str): The formula to analyze.
+    sheet_name (str): The sheet the formula belongs to. If given, the RANGE operands are checked with
+        validate_range and split into `ranges` and `range_errors`.
+    address (str): Optional A1 address of the cell holding the formula, used to share the tokenization
+        of fill-down variants (see tokenize_formula).
+
+    Returns:
+    FormulaAnalysis: The analysis of the formula.
+    """
+    tokens = tokenize_formula(formula, address)
+    function_names = []
+    ranges = []
+    range_errors = []
+    errors = []
+
+    for token in tokens:
+        t_value, t_type, t_subtype = token
+        try:
+            validate_token(token)
+        except ValueError as e:
+            errors.append(str(e))
+
+        if t_type == 'FUNC' and t_subtype == 'OPEN':
+            function_names.append(t_value.rstrip('('))
+        elif sheet_name is not None and t_type == 'OPERAND' and t_subtype == 'RANGE':
+            try:
+                clean_range = validate_range(t_value, sheet_name)
+            except ValueError as e:
+                range_errors.append(str(e))
+                continue
+            if clean_range not in ranges:
+                ranges.append(clean_range)
+
+    return FormulaAnalysis(formula, tokens, function_names, ranges, range_errors, errors)
+
+
 def parse_formula(formula):
     """
     Parse a formula and return a list of tuples, each containing the token value, type, and subtype.
@@ -162,13 +558,14 @@ def parse_formula(formula):
     return tokens
 
 
-def get_formula_pattern(formula):
+def get_formula_pattern(formula, address=None):
     """
     Get the pattern of a formula.
     The pattern is defined as the sorted list of function names in the formula.
 
     Parameters:
     formula (str): The formula to get the pattern from.
+    address (str): Optional A1 address of the cell holding the formula.
 
     Returns:
     str: The pattern of the formula.
@@ -176,11 +573,9 @@ def get_formula_pattern(formula):
     Raises:
     ValueError: If an error token is found in the formula.
     """
-    parsed_formula = parse_formula(formula)
-    func_names = [t_value.rstrip('(') for t_value, t_type, t_subtype in parsed_formula if
-                  t_type == 'FUNC' and t_subtype == 'OPEN']
-    pattern = ','.join(sorted(func_names))
-    return pattern
+    analysis = analyze_formula(formula, address=address)
+    analysis.raise_for_errors()
+    return analysis.pattern
 
 
 def validate_range(range_str, sheet_name):
@@ -189,58 +584,171 @@ def validate_range(range_str, sheet_name):
         if range_sheet != sheet_name:
             raise ValueError(f"Range refers to another sheet. Current sheet: {sheet_name}, range: {range_str}")
     clean_range = range_str.split('!')[-1].replace('$', '')
-    if not re.match(r"[A-Z]+[0-9]+(:[A-Z]+[0-9]+)?", clean_range):
+    if not _RANGE_FORMAT_RE.match(clean_range):
         raise ValueError(f"Invalid range format: {range_str}")
     return clean_range
 
 
-def extract_range_from_formula(formula, sheet_name):
-    parsed_formula = parse_formula(formula)
-    ranges = [t[0] for t in parsed_formula if t[1] == 'OPERAND' and t[2] == 'RANGE']
-    valid_ranges = []
-    for r in ranges:
+MAX_ROW = 1048576
+MAX_COL = 16384
+
+# Integer bounds of an A1 reference; `sheet` is None when the reference has no sheet prefix
+A1Reference = namedtuple('A1Reference', ['sheet', 'min_row', 'min_col', 'max_row', 'max_col'])
+
+_A1_PART_RE = re.compile(r"^\$?([A-Z]{1,3})?\$?([0-9]+)?$")
+
+
+@lru_cache(maxsize=65536)
+def _parse_a1_reference(ref):
+    sheet = None
+    area = ref
+    if '!' in ref:
+        sheet, _, area = ref.rpartition('!')
+        if len(sheet) > 1 and sheet[0] == "'" and sheet[-1] == "'":
+            sheet = sheet[1:-1].replace("''", "'")
+
+    parts = area.strip().upper().split(':')
+    if len(parts) > 2:
+        return None
+    coords = []
+    for part in parts:
+        match = _A1_PART_RE.match(part)
+        if match is None or match.group(1) is None and match.group(2) is None:
+            return None
+        col = _column_index(match.group(1)) if match.group(1) else None
+        row = int(match.group(2)) if match.group(2) else None
+        if col is not None and col > MAX_COL or row is not None and not 1 <= row <= MAX_ROW:
+            return None
+        coords.append((row, col))
+
+    (row1, col1), (row2, col2) = coords[0], coords[-1]
+    if (row1 is None) != (row2 is None) or (col1 is None) != (col2 is None):
+        return None  # Mixed kinds, e.g. A1:B
+    if len(coords) == 1 and (row1 is None or col1 is None):
+        return None  # A lone column or row needs a range, e.g. A:A or 3:3
+    min_row, max_row = (1, MAX_ROW) if row1 is None else (min(row1, row2), max(row1, row2))
+    min_col, max_col = (1, MAX_COL) if col1 is None else (min(col1, col2), max(col1, col2))
+    return A1Reference(sheet, min_row, min_col, max_row, max_col)
+
+
+def parse_a1_reference(ref):
+    """
+    Parse an A1 cell or range reference into integer bounds.
+
+    Handles sheet prefixes (quoted or not), $ anchors, reversed corners and whole-column or whole-row
+    references such as A:A and 3:5, which span all rows or columns of the sheet. Results are cached.
+
+    Parameters:
+    ref (str): The reference, e.g. "B3", "Sheet1!$A$1:$C$10" or "'My Sheet'!A:A".
+
+    Returns:
+    A1Reference: The sheet name (or None) and the 1-based min_row, min_col, max_row, max_col.
+
+    Raises:
+    ValueError: If the reference is not a valid A1 reference.
+    """
+    reference = _parse_a1_reference(ref)
+    if reference is None:
+        raise ValueError(f"Invalid A1 reference: {ref}")
+    return reference
+
+
+def ranges_overlap(a, b):
+    """Whether two A1References share at least one cell. References without a sheet match any sheet."""
+    if a.sheet is not None and b.sheet is not None and a.sheet != b.sheet:
+        return False
+    return a.min_row <= b.max_row and b.min_row <= a.max_row and a.min_col <= b.max_col and b.min_col <= a.max_col
+
+
+def range_contains(outer, inner):
+    """Whether the A1Reference `outer` covers every cell of `inner`."""
+    if outer.sheet is not None and inner.sheet is not None and outer.sheet != inner.sheet:
+        return False
+    return (outer.min_row <= inner.min_row and inner.max_row <= outer.max_row and
+            outer.min_col <= inner.min_col and inner.max_col <= outer.max_col)
+
+
+def extract_range_from_formula(formula, sheet_name, address=None):
+    analysis = analyze_formula(formula, sheet_name, address)
+    analysis.raise_for_errors()
+    return analysis.ranges
+
+
+class RangeExtraction:
+    """
+    Result of extract_ranges_from_formulas.
+
+    Attributes:
+    ranges (dict): Unique valid cleaned range -> indices of the formulas referencing it, in order of first
+        appearance.
+    formula_errors (list): (formula index, message) for the formulas that failed to tokenize or validate.
+    range_errors (list): (formula index, message) for the ranges of other sheets or with an invalid format.
+    formulas_scanned (int): Number of formulas scanned before `max_ranges` was reached.
+    """
+    __slots__ = ('ranges', 'formula_errors', 'range_errors', 'formulas_scanned')
+
+    def __init__(self):
+        self.ranges = {}
+        self.formula_errors = []
+        self.range_errors = []
+        self.formulas_scanned = 0
+
+
+def extract_ranges_from_formulas(formulas, sheet_name, addresses=None, max_ranges=None):
+    """
+    Extract the unique valid ranges of many formulas of one sheet in a single pass.
+
+    Unlike extract_range_from_formula, nothing is printed or raised per formula: failures are collected
+    in the result.
+
+    Parameters:
+    formulas (list): The formulas of the sheet.
+    sheet_name (str): The name of the sheet the formulas belong to.
+    addresses (list, optional): The A1 addresses of the formulas, used to share the tokenization of
+        fill-down variants.
+    max_ranges (int, optional): Stop after the formula that brings the number of unique ranges to
+        `max_ranges`. By default every formula is scanned.
+
+    Returns:
+    RangeExtraction: The ranges with their source formula indices and the collected errors.
+    """
+    result = RangeExtraction()
+    ranges = result.ranges
+
+    for index, formula in enumerate(formulas):
+        result.formulas_scanned = index + 1
+        address = addresses[index] if addresses is not None else None
         try:
-            clean_valid_range = validate_range(r, sheet_name)
-            valid_ranges.append(clean_valid_range)
-        except ValueError as e:
-            print(f"Invalid range found: {e}")
-    return list(set(valid_ranges))
-
-
-def check_formula_validity(formula, sheet_name):
-    functions = [
-        "CONCATENATE",
-        "CONCAT",
-        "TEXTJOIN",
-        "LEFT",
-        "RIGHT",
-        "MID",
-        "LEN",
-        "FIND",
-        "SEARCH",
-        "REPLACE",
-        "SUBSTITUTE",
-        "TRIM",
-        "LOWER",
-        "UPPER",
-        "PROPER",
-        "REPT",
-        "TEXT",
-        "VALUE",
-        "CHAR",
-        "CLEAN",
-        "CODE"
-    ]
-    parsed_formula = parse_formula(formula)
-    func_names = [t_value.rstrip('(') for t_value, t_type, t_subtype in parsed_formula if
-                  t_type == 'FUNC' and t_subtype == 'OPEN']
-    range_errors = extract_range_from_formula(formula, sheet_name)
+            analysis = analyze_formula(formula, sheet_name, address)
+        except Exception as e:
+            result.formula_errors.append((index, str(e)))
+            continue
+        if analysis.errors:
+            result.formula_errors.append((index, analysis.errors[0]))
+            continue
+
+        for error in analysis.range_errors:
+            result.range_errors.append((index, error))
+        for clean_range in analysis.ranges:
+            ranges.setdefault(clean_range, []).append(index)
+
+        if max_ranges is not None and len(ranges) >= max_ranges:
+            break
+
+    return result
+
+
+def check_formula_validity(formula, sheet_name, address=None):
+    analysis = analyze_formula(formula, sheet_name, address)
+    analysis.raise_for_errors()
+    func_names = analysis.function_names
+    range_errors = analysis.ranges
 
     if len(func_names) > 3:
         raise ValueError("More than 3 functions in formula")
     elif len(formula) > 60:
         raise ValueError("Formula length greater than 50")
-    elif len(func_names) == 1 and func_names[0] in functions and len(range_errors) > 0:
+    elif len(func_names) == 1 and func_names[0] in text_function_set and len(range_errors) > 0:
         raise ValueError("Only string operations and no range")
     elif len(range_errors) > 0:
         raise ValueError(f"Range errors: {range_errors}")
@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import bisect
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+LOGGER_PREFIX = "sheetpedia"
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram. Percentiles are reported as the upper bound of their bucket (at most the max)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count else None,
+            "min_seconds": self.min,
+            "max_seconds": self.max,
+            "p50_seconds": self.percentile(0.5),
+            "p90_seconds": self.percentile(0.9),
+            "p99_seconds": self.percentile(0.99),
+            "buckets": {(f"<={bound}" if i < len(self.buckets) else f">{self.buckets[-1]}"): count
+                        for i, (bound, count) in enumerate(zip(self.buckets + (None,), self.counts)) if count}
+        }
+
+
+class Metrics:
+    """
+    In-memory event counters with rate-limited logging and JSON snapshots.
+
+    Counting an event is a dict update under a lock. Its log line is emitted at most once per
+    `log_interval` seconds per category; the lines skipped in between are counted and reported with
+    the next emitted line, so a failure storm costs a handful of writes instead of one per event.
+    """
+
+    def __init__(self, log_interval=10.0):
+        """
+        Args:
+            log_interval (float): Minimum number of seconds between two log lines of a category. Default is 10.
+        """
+        self.log_interval = log_interval
+        self.started_at = time.time()
+        self._counters = Counter()
+        self._histograms = {}
+        self._usage = {}
+        self._last_logged = {}
+        self._suppressed = Counter()
+        self._lock = threading.Lock()
+        self._snapshot_thread = None
+        self._snapshot_stop = threading.Event()
+        self._snapshot_path = None
+
+    def increment(self, name, value=1):
+        """Add `value` to the counter `name`."""
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, seconds):
+        """Add a latency observation (in seconds) to the histogram `name`."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, name):
+        """Context manager recording the wall time of its block in the histogram `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def add_usage(self, model, prompt_tokens=0, completion_tokens=0, requests=1, retries=0):
+        """Accumulate request, retry and token counts of `model`."""
+        with self._lock:
+            usage = self._usage.get(model)
+            if usage is None:
+                usage = self._usage[model] = Counter()
+            usage["requests"] += requests
+            usage["retries"] += retries
+            usage["prompt_tokens"] += prompt_tokens or 0
+            usage["completion_tokens"] += completion_tokens or 0
+
+    def record(self, category, message=None, *args, level=logging.WARNING):
+        """
+        Count an event of `category` and log it, rate-limited per category.
+
+        The message is only formatted (with `args`, as in logging) when the line is actually emitted.
+        The logger is "sheetpedia.<category>", so categories can be silenced through logging config.
+
+        Args:
+            category (str): Dotted event category, e.g. "api.retry". Also the counter name.
+            message (str, optional): Log message. None only counts the event.
+            *args: Arguments merged into `message` with %-formatting.
+            level (int): Logging level of the line. Default is WARNING.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._counters[category] += 1
+            if message is None:
+                return
+            last = self._last_logged.get(category)
+            if last is not None and now - last < self.log_interval:
+                self._suppressed[category] += 1
+                return
+            self._last_logged[category] = now
+            suppressed = self._suppressed.pop(category, 0)
+
+        logger = logging.getLogger(f"{LOGGER_PREFIX}.{category}")
+        if suppressed:
+            logger.log(level, message + " (%d similar events suppressed)", *args, suppressed)
+        else:
+            logger.log(level, message, *args)
+
+    def counters(self):
+        """Return a copy of the counters."""
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        """Drop all counters and rate-limit state."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._usage.clear()
+            self._last_logged.clear()
+            self._suppressed.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """Return the counters, latency summaries and per-model usage with a timestamp, ready to be dumped as JSON."""
+        now = time.time()
+        with self._lock:
+            counters = dict(sorted(self._counters.items()))
+            latencies = {name: histogram.summary() for name, histogram in sorted(self._histograms.items())}
+            usage = {model: dict(model_usage) for model, model_usage in sorted(self._usage.items())}
+        return {
+            "timestamp": now,
+            "uptime_seconds": now - self.started_at,
+            "counters": counters,
+            "latencies": latencies,
+            "usage": usage
+        }
+
+    def write_snapshot(self, path, extra=None):
+        """Atomically write the current snapshot to `path` as JSON, merged with the `extra` dict if given."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        snapshot = self.snapshot()
+        if extra:
+            snapshot = {**extra, **snapshot}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_snapshots(self, path, interval=60.0):
+        """
+        Write a snapshot to `path` every `interval` seconds from a daemon thread until stop_snapshots.
+
+        Args:
+            path (str): Path of the JSON snapshot, overwritten on every write.
+            interval (float): Seconds between two snapshots. Default is 60.
+        """
+        self.stop_snapshots()
+        self._snapshot_stop = threading.Event()
+        stop_event = self._snapshot_stop
+
+        def _run():
+            while not stop_event.wait(interval):
+                try:
+                    self.write_snapshot(path)
+                except OSError as e:
+                    logging.getLogger(f"{LOGGER_PREFIX}.metrics").warning("Writing metrics snapshot failed: %s", e)
+
+        self._snapshot_path = path
+        self._snapshot_thread = threading.Thread(target=_run, daemon=True)
+        self._snapshot_thread.start()
+
+    def stop_snapshots(self):
+        """Stop the periodic snapshots, writing a final one."""
+        if self._snapshot_thread is None:
+            return
+        self._snapshot_stop.set()
+        self._snapshot_thread.join()
+        self._snapshot_thread = None
+        self.write_snapshot(self._snapshot_path)
+
+
+# Process-wide metrics shared by the utils, generators and evaluators
+_metrics = Metrics()
+
+
+def get_metrics():
+    """Return the process-wide Metrics instance."""
+    return _metrics
+
+
+def increment(name, value=1):
+    """Add `value` to the process-wide counter `name`."""
+    _metrics.increment(name, value)
+
+
+def observe(name, seconds):
+    """Add a latency observation to the process-wide histogram `name`."""
+    _metrics.observe(name, seconds)
+
+
+def timed(name):
+    """Context manager timing its block into the process-wide histogram `name`."""
+    return _metrics.timed(name)
+
+
+def add_usage(model, prompt_tokens=0, completion_tokens=0, requests=1, retries=0):
+    """Accumulate request, retry and token counts of `model` in the process-wide metrics."""
+    _metrics.add_usage(model, prompt_tokens, completion_tokens, requests, retries)
+
+
+def record_event(category, message=None, *args, level=logging.WARNING):
+    """Count an event in the process-wide metrics and log it, rate-limited (see Metrics.record)."""
+    _metrics.record(category, message, *args, level=level)
+
+
+def configure_logging(level=logging.INFO):
+    """Send log lines to stderr with timestamps, unless logging was configured already."""
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
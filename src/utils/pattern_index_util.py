@@ -0,0 +1,136 @@
+import argparse
+import glob
+import json
+import os
+import random
+
+from src.utils.formula_util import analyze_formula, to_r1c1_skeleton
+from src.utils.metrics_util import configure_logging, record_event
+
+
+def build_pattern_index(json_directories, output_path=None):
+    """
+    Group the formulas of a sheet corpus by pattern in one streaming pass.
+
+    Every sheet JSON file is read once and released before the next one. Formulas that fail validation
+    are left out, and fill-down copies within a sheet (formulas with the same R1C1 skeleton) are kept
+    only once, so each entry is a distinct training example.
+
+    Parameters:
+    json_directories (list): Directories, or glob patterns of directories, holding the sheet JSON files.
+    output_path (str, optional): Path of the JSON file the index is written to.
+
+    Returns:
+    dict: pattern -> list of [filename, sheetname, address]. The pattern is get_formula_pattern's
+        sorted function-name signature ("" for formulas without functions).
+    """
+    pattern_index = {}
+    for pattern in json_directories:
+        for directory in sorted(glob.glob(pattern)):
+            for file_path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    filename, sheetname = data['filename'], data['sheetname']
+                except (OSError, json.JSONDecodeError, KeyError, TypeError) as e:
+                    # Unreadable file, or a sheet without its filename/sheetname
+                    record_event("index.sheet_failed", "Error reading %s: %s", file_path, e)
+                    continue
+
+                seen_skeletons = set()
+                for formula_info in data.get('FilteredFormulas', []):
+                    formula = formula_info["Value"]
+                    address = formula_info.get("Address")
+                    skeleton = to_r1c1_skeleton(formula, address) if address else None
+                    dedup_key = skeleton or formula
+                    if dedup_key in seen_skeletons:
+                        continue
+                    seen_skeletons.add(dedup_key)
+
+                    try:
+                        analysis = analyze_formula(formula, address=address)
+                    except Exception:
+                        continue
+                    if analysis.is_valid:
+                        pattern_index.setdefault(analysis.pattern, []).append([filename, sheetname, address])
+
+    if output_path:
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(pattern_index, f, ensure_ascii=False, separators=(',', ':'))
+
+    return pattern_index
+
+
+def load_pattern_index(index_path):
+    """Load a pattern index written by build_pattern_index."""
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def pattern_histogram(pattern_index):
+    """Return (pattern, formula count) pairs, most frequent first."""
+    return sorted(((pattern, len(entries)) for pattern, entries in pattern_index.items()),
+                  key=lambda x: (-x[1], x[0]))
+
+
+def stratified_sample(pattern_index, budget, seed=0):
+    """
+    Pick up to `budget` formulas spread as evenly as possible over the patterns.
+
+    Patterns are visited round-robin, taking one formula of each pattern per round, so rare patterns
+    are fully used before frequent ones such as SUM get more than their share. Within a pattern the
+    formulas are shuffled and formulas from sheets not picked yet come first.
+
+    Parameters:
+    pattern_index (dict): pattern -> list of [filename, sheetname, address].
+    budget (int): Maximum number of formulas to pick, e.g. the generator's api_request_limit.
+    seed (int): Seed of the shuffles. Default is 0.
+
+    Returns:
+    list: The picked (filename, sheetname, address) tuples.
+    """
+    rng = random.Random(seed)
+    queues = []
+    for pattern in sorted(pattern_index):
+        entries = [tuple(entry) for entry in pattern_index[pattern]]
+        rng.shuffle(entries)
+        # Spread over sheets: the first formula of each sheet, then the second ones, and so on
+        rank = {}
+        ranked = []
+        for entry in entries:
+            sheet = entry[:2]
+            ranked.append((rank.get(sheet, 0), entry))
+            rank[sheet] = rank.get(sheet, 0) + 1
+        ranked.sort(key=lambda x: x[0])
+        queues.append([entry for _, entry in ranked])
+    rng.shuffle(queues)
+
+    sample = []
+    depth = 0
+    while len(sample) < budget and queues:
+        queues = [queue for queue in queues if depth < len(queue)]
+        for queue in queues:
+            if len(sample) >= budget:
+                break
+            sample.append(queue[depth])
+        depth += 1
+    return sample
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the formula pattern index of a sheet corpus.")
+    parser.add_argument("json_directories", nargs='+',
+                        help="Directories (or glob patterns, e.g. 'data/raw/raw_data_json_*') of sheet JSON files.")
+    parser.add_argument("--output", default="data/interim/pattern_index.json", help="Path of the index to write.")
+    parser.add_argument("--top", type=int, default=20, help="Number of most frequent patterns to print.")
+    args = parser.parse_args()
+
+    configure_logging()
+    index = build_pattern_index(args.json_directories, args.output)
+    histogram = pattern_histogram(index)
+    print(f"Indexed {sum(count for _, count in histogram)} formulas in {len(histogram)} patterns into {args.output}")
+    for pattern, count in histogram[:args.top]:
+        print(f"{count:>8}  {pattern or '<no function>'}")
@@ -0,0 +1,96 @@
+import queue
+import threading
+
+from src.utils.metrics_util import record_event
+
+_END = object()
+
+
+class TaskFailedError(Exception):
+    """Raised by a task that did not finish, e.g. because no candidate was generated, so that it is retried."""
+
+
+def run_pipeline(source, prepare, process, write, num_workers=4, queue_depth=8):
+    """
+    Run a bounded producer/consumer pipeline over the items of `source`.
+
+    One loader thread calls `prepare` on each item ahead of the workers, `num_workers` threads call
+    `process` on the prepared tasks, and the calling thread calls `write` on every result, so writes
+    never run concurrently. Both queues between the stages hold at most `queue_depth` entries, which
+    keeps memory bounded no matter how fast the loader is.
+
+    Parameters:
+    source (iterable): The items to feed into the pipeline, e.g. file paths.
+    prepare (callable): Loader stage, item -> task. Returning None skips the item.
+    process (callable): Worker stage, task -> result. Exceptions are reported and the task is dropped.
+    write (callable): Writer stage, result -> bool. Returning False stops the pipeline from starting
+        new tasks; results of tasks already being processed are still written.
+    num_workers (int): Number of worker threads. Default is 4.
+    queue_depth (int): Maximum number of pending entries in each queue. Default is 8.
+
+    Raises:
+    Exception: The first exception raised by the loader or writer stage.
+    """
+    task_queue = queue.Queue(maxsize=queue_depth)
+    result_queue = queue.Queue(maxsize=queue_depth)
+    stop_event = threading.Event()
+    errors = []
+
+    def _load():
+        try:
+            for item in source:
+                if stop_event.is_set():
+                    break
+                task = prepare(item)
+                if task is not None:
+                    task_queue.put(task)
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            for _ in range(num_workers):
+                task_queue.put(_END)
+
+    def _work():
+        try:
+            while True:
+                task = task_queue.get()
+                if task is _END:
+                    break
+                # Once stopped, drain the remaining tasks without spending work on them
+                if stop_event.is_set():
+                    continue
+                try:
+                    result_queue.put(process(task))
+                except Exception as e:
+                    record_event("pipeline.task_failed", "Pipeline task failed: %s", e)
+        finally:
+            result_queue.put(_END)
+
+    threads = [threading.Thread(target=_load, daemon=True)]
+    threads.extend(threading.Thread(target=_work, daemon=True) for _ in range(num_workers))
+    for thread in threads:
+        thread.start()
+
+    finished_workers = 0
+    write_failed = False
+    while finished_workers < num_workers:
+        result = result_queue.get()
+        if result is _END:
+            finished_workers += 1
+            continue
+        if write_failed:
+            continue
+        try:
+            if write(result) is False:
+                stop_event.set()
+        except Exception as e:
+            errors.append(e)
+            write_failed = True
+            stop_event.set()
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,116 @@
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.utils.metrics_util import record_event
+
+
+def normalize_score(score_result):
+    """
+    Return the normalized (0-1) score of a scoring result.
+
+    Returns None if the result has no numeric "score", so that the caller can reject the candidate.
+    """
+    score = score_result.get("score") if isinstance(score_result, dict) else None
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or score != score:
+        return None
+    return score / 10  # Scale to 0-1
+
+
+def _accept(score_result, query, min_accept_score, accepted):
+    """Record a scored candidate and return its normalized (0-1) score. Raises ValueError if it has no score."""
+    normalized_score = normalize_score(score_result)
+    if normalized_score is None:
+        raise ValueError(f"no numeric score in {score_result!r}")
+    if normalized_score >= min_accept_score:
+        accepted.append((normalized_score, query, score_result))
+    return normalized_score
+
+
+def stream_rejection_sampling(generate, parse, score, candidate_num, min_accept_score, target_score, target_count=1):
+    """
+    Streaming rejection sampling with early exit.
+
+    All `candidate_num` generations are started at once and each candidate is scored as soon as its
+    generation returns. As soon as `target_count` candidates reach `target_score`, the pending work is
+    cancelled: generations that have not returned yet are never scored.
+
+    Parameters:
+    generate (callable): () -> response of one generation request, or None.
+    parse (callable): response -> candidate query, or None if the response is unusable.
+    score (callable): query -> score dict with a "score" on a 0-10 scale.
+    candidate_num (int): Number of candidates to generate.
+    min_accept_score (float): Minimum normalized score (0-1) to accept a candidate.
+    target_score (float): Normalized score (0-1) a candidate needs to count towards the early exit.
+    target_count (int): Number of candidates reaching `target_score` after which sampling stops.
+
+    Returns:
+    list: Accepted (normalized_score, query, score_result) tuples, best first.
+    """
+    accepted = []
+    hits = 0
+    executor = ThreadPoolExecutor(max_workers=candidate_num * 2)
+    pending = {executor.submit(generate): None for _ in range(candidate_num)}
+
+    try:
+        while pending and hits < target_count:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                query = pending.pop(future)
+                try:
+                    result = future.result()
+                    if query is not None and _accept(result, query, min_accept_score, accepted) >= target_score:
+                        hits += 1
+                except Exception as e:
+                    stage = 'scoring' if query is not None else 'generation'
+                    record_event(f"sampling.{stage}_failed", "Candidate %s failed: %s", stage, e)
+                    continue
+
+                if query is None and hits < target_count:
+                    # A generation finished: score its candidate right away, unless sampling is already done
+                    candidate = parse(result) if result is not None else None
+                    if candidate is not None:
+                        pending[executor.submit(score, candidate)] = candidate
+    finally:
+        for future in pending:
+            future.cancel()
+        # Drop the calls still queued behind the workers, not only the pending futures
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return sorted(accepted, key=lambda x: x[0], reverse=True)
+
+
+async def astream_rejection_sampling(generate, parse, score, candidate_num, min_accept_score, target_score,
+                                     target_count=1):
+    """
+    Asyncio counterpart of stream_rejection_sampling.
+
+    `generate` and `score` are coroutine functions. Outstanding generation and scoring requests are
+    cancelled once `target_count` candidates reach `target_score`.
+    """
+    accepted = []
+    hits = 0
+    pending = {asyncio.ensure_future(generate()): None for _ in range(candidate_num)}
+
+    try:
+        while pending and hits < target_count:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                query = pending.pop(task)
+                try:
+                    result = task.result()
+                    if query is not None and _accept(result, query, min_accept_score, accepted) >= target_score:
+                        hits += 1
+                except Exception as e:
+                    stage = 'scoring' if query is not None else 'generation'
+                    record_event(f"sampling.{stage}_failed", "Candidate %s failed: %s", stage, e)
+                    continue
+
+                if query is None and hits < target_count:
+                    candidate = parse(result) if result is not None else None
+                    if candidate is not None:
+                        pending[asyncio.ensure_future(score(candidate))] = candidate
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return sorted(accepted, key=lambda x: x[0], reverse=True)
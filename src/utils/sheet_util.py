@@ -0,0 +1,444 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import re
+import sys
+from array import array
+from functools import lru_cache
+
+from src.utils.formula_util import MAX_COL, MAX_ROW, A1Reference, _column_index, column_letters, \
+    parse_a1_reference
+
+# Plain cell addresses such as "B12"; every other address is parsed with parse_a1_reference and stored as is
+_CELL_ADDRESS_RE = re.compile(r'([A-Z]{1,3})([1-9][0-9]{0,6})\Z')
+
+_column_name = lru_cache(maxsize=None)(column_letters)
+
+# Suffix of the sidecar offsets index of a sheet JSON file. Not ".json", so that it is not globbed as a sheet.
+KEY_INDEX_SUFFIX = '.keyidx'
+
+_SEPARATOR_RE = re.compile(rb'[\s,]*')
+_WHITESPACE_RE = re.compile(rb'\s*')
+_STRING_END_RE = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+# Runs of text, strings and innermost objects or arrays, which can be skipped without counting brackets.
+# A cell grid is skipped with one match per row.
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_TEXT = rb'[^"{}\[\]]*'
+_FLAT = _TEXT + rb'(?:' + _STRING + _TEXT + rb')*'
+_FLAT_RUN_RE = re.compile(_TEXT + rb'(?:(?:' + _STRING + rb'|\{' + _FLAT + rb'\}|\[' + _FLAT + rb'\])' + _TEXT + rb')*',
+                          re.DOTALL)
+_SCALAR_RE = re.compile(rb'[^,}\s]*')
+
+
+class CompactSheet:
+    """
+    Columnar in-memory form of a preprocessed sheet JSON.
+
+    The cells are stored as parallel arrays: 1-based row and column numbers and an index into a pool
+    of distinct cell texts, so a cell costs a few bytes instead of a dict with two strings. Cell
+    addresses are rebuilt from the row and column numbers; the few that are not plain A1 addresses are
+    kept verbatim. The formula addresses are interned.
+
+    The sheet can be read like the JSON dict it was built from (sheet['SheetString'],
+    sheet.get('FilteredFormulas'), ...), so code written for the dicts accepts it as well. sheet['Cells']
+    rebuilds the per-cell dicts and should be avoided; iterate cell_rows or cell_coordinates instead.
+    """
+
+    __slots__ = ('filename', 'sheetname', 'sheet_string', 'formula_values', 'formula_addresses', 'merged_addresses',
+                 'rows', 'cols', 'text_ids', 'texts', 'row_starts', 'address_overrides')
+
+    def __init__(self, data, include_cells=True):
+        """
+        Args:
+            data (dict or LazySheet): The sheet data, as loaded from the sheet JSON file.
+            include_cells (bool): Whether to load the cells. Without them the sheet only holds its
+                names, sheet string, formulas and merged regions. Default is True.
+        """
+        self.filename = data.get('filename')
+        self.sheetname = data.get('sheetname')
+        self.sheet_string = data.get('SheetString')
+        formulas = data.get('FilteredFormulas', [])
+        self.formula_values = [formula_info["Value"] for formula_info in formulas]
+        self.formula_addresses = [sys.intern(formula_info["Address"]) if formula_info.get("Address") is not None
+                                  else None for formula_info in formulas]
+        self.merged_addresses = [mr.get('Address', '') for mr in data.get('MergedRegions', [])]
+
+        self.rows = array('I')
+        self.cols = array('I')
+        self.text_ids = array('I')
+        self.texts = []
+        self.row_starts = array('I', [0])
+        # cell index -> address, for the addresses that cannot be rebuilt from the row and column numbers
+        self.address_overrides = {}
+
+        text_pool = {}
+        for row in (data.get('Cells', []) if include_cells else []):
+            for cell in row:
+                self._append_cell(cell['Address'], cell['Text'], text_pool)
+            self.row_starts.append(len(self.rows))
+        if include_cells and isinstance(data, LazySheet):
+            # The parsed cell dicts are not needed any more once they are compacted
+            data.release('Cells')
+
+    def _append_cell(self, address, text, text_pool):
+        match = _CELL_ADDRESS_RE.match(address)
+        row = col = 0
+        if match is not None:
+            col, row = _column_index(match.group(1)), int(match.group(2))
+            if col > MAX_COL or row > MAX_ROW:
+                row = col = 0
+        if not row:
+            self.address_overrides[len(self.rows)] = address
+            try:
+                reference = parse_a1_reference(address)
+                row, col = reference.min_row, reference.min_col
+            except ValueError:
+                row = col = 0
+
+        text_id = text_pool.get(text)
+        if text_id is None:
+            text_id = text_pool[text] = len(self.texts)
+            self.texts.append(text)
+
+        self.rows.append(row)
+        self.cols.append(col)
+        self.text_ids.append(text_id)
+
+    @classmethod
+    def load(cls, file_path, include_cells=True):
+        """
+        Load a sheet JSON file into a CompactSheet.
+
+        The file is read through a LazySheet, so only the keys the sheet needs are parsed and the
+        parsed cells are released once they are compacted.
+        """
+        with LazySheet(file_path) as sheet:
+            return cls(sheet, include_cells=include_cells)
+
+    def __len__(self):
+        """Number of cells."""
+        return len(self.rows)
+
+    def address(self, index):
+        """Address of the cell at `index`."""
+        address = self.address_overrides.get(index)
+        if address is None:
+            address = _column_name(self.cols[index]) + str(self.rows[index])
+        return address
+
+    def text(self, index):
+        """Text of the cell at `index`."""
+        return self.texts[self.text_ids[index]]
+
+    def cell_rows(self):
+        """
+        Iterate over the rows of the sheet as in the JSON 'Cells' list.
+
+        Yields:
+            list: The (address, text) pairs of one row.
+        """
+        for row_index in range(len(self.row_starts) - 1):
+            yield [(self.address(index), self.text(index))
+                   for index in range(self.row_starts[row_index], self.row_starts[row_index + 1])]
+
+    def cell_coordinates(self):
+        """
+        Iterate over the cells with a valid A1 address, in sheet order.
+
+        Yields:
+            tuple: (row, col, address, text) of a cell, with the row and column of the top-left cell
+                of its address.
+        """
+        for index in range(len(self.rows)):
+            if self.rows[index]:
+                yield self.rows[index], self.cols[index], self.address(index), self.text(index)
+
+    def cells_in_range(self, reference):
+        """
+        Return the cells inside an A1 range, in sheet order.
+
+        Args:
+            reference (str or A1Reference): The range, e.g. "B2:D10". Its sheet name is ignored.
+
+        Returns:
+            list: The (address, text) pairs of the cells whose top-left corner lies in the range.
+
+        Raises:
+            ValueError: If `reference` is not a valid A1 reference.
+        """
+        if not isinstance(reference, A1Reference):
+            reference = parse_a1_reference(reference)
+        rows, cols = self.rows, self.cols
+        return [(self.address(index), self.text(index)) for index in range(len(rows))
+                if reference.min_row <= rows[index] <= reference.max_row
+                and reference.min_col <= cols[index] <= reference.max_col]
+
+    def to_dict(self):
+        """Rebuild the sheet JSON dict."""
+        return {
+            "filename": self.filename,
+            "sheetname": self.sheetname,
+            "Cells": [[{"Address": address, "Text": text} for address, text in row] for row in self.cell_rows()],
+            "MergedRegions": [{"Address": address} for address in self.merged_addresses],
+            "SheetString": self.sheet_string,
+            "FilteredFormulas": [{"Value": value, "Address": address}
+                                 for value, address in zip(self.formula_values, self.formula_addresses)]
+        }
+
+    # Read-only access with the keys of the sheet JSON dict
+
+    def __getitem__(self, key):
+        if key == 'filename':
+            return self.filename
+        if key == 'sheetname':
+            return self.sheetname
+        if key == 'SheetString':
+            return self.sheet_string
+        if key == 'FilteredFormulas':
+            return [{"Value": value, "Address": address}
+                    for value, address in zip(self.formula_values, self.formula_addresses)]
+        if key == 'MergedRegions':
+            return [{"Address": address} for address in self.merged_addresses]
+        if key == 'Cells':
+            return [[{"Address": address, "Text": text} for address, text in row] for row in self.cell_rows()]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return key in ('filename', 'sheetname', 'SheetString', 'FilteredFormulas', 'MergedRegions', 'Cells')
+
+
+def iter_cell_rows(data):
+    """
+    Iterate over the rows of a sheet given as a JSON dict or a CompactSheet.
+
+    Yields:
+        list: The (address, text) pairs of one row.
+    """
+    if isinstance(data, CompactSheet):
+        yield from data.cell_rows()
+        return
+    for row in data.get('Cells', []):
+        yield [(cell['Address'], cell['Text']) for cell in row]
+
+
+class _TopLevelScanner:
+    """
+    Incremental scanner of the top-level members of a JSON object held in a bytes-like buffer.
+
+    Only the structure is scanned: strings are skipped with a regex and nested values by counting
+    brackets, so finding a key costs a pass over the bytes before it but no parsing of the values.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        match = _WHITESPACE_RE.match(buffer, 0)
+        if buffer[match.end():match.end() + 1] != b'{':
+            raise ValueError("Sheet JSON is not an object")
+        self.position = match.end() + 1
+        self.done = False
+
+    def _string_end(self, start):
+        match = _STRING_END_RE.match(self.buffer, start + 1)
+        if match is None:
+            raise ValueError(f"Unterminated string at byte {start}")
+        return match.end()
+
+    def _value_end(self, start):
+        first = self.buffer[start:start + 1]
+        if first == b'"':
+            return self._string_end(start)
+        if first not in (b'{', b'['):
+            return _SCALAR_RE.match(self.buffer, start).end()
+
+        depth = 0
+        position = start
+        while True:
+            char = self.buffer[position:position + 1]
+            if char in (b'{', b'['):
+                depth += 1
+            elif char in (b'}', b']'):
+                depth -= 1
+                if depth == 0:
+                    return position + 1
+            elif char == b'"':
+                position = self._string_end(position)
+                continue
+            else:
+                raise ValueError(f"Unterminated value at byte {start}")
+            position = _FLAT_RUN_RE.match(self.buffer, position + 1).end()
+
+    def next_member(self):
+        """Return (key, value start, value end) of the next member, or None after the last one."""
+        if self.done:
+            return None
+        position = _SEPARATOR_RE.match(self.buffer, self.position).end()
+        if self.buffer[position:position + 1] != b'"':
+            self.done = True
+            return None
+
+        key_end = self._string_end(position)
+        key = json.loads(self.buffer[position:key_end])
+        position = _WHITESPACE_RE.match(self.buffer, key_end).end()
+        if self.buffer[position:position + 1] != b':':
+            raise ValueError(f"Expected ':' at byte {position}")
+        start = _WHITESPACE_RE.match(self.buffer, position + 1).end()
+        end = self._value_end(start)
+        self.position = end
+        return key, start, end
+
+
+class LazySheet:
+    """
+    Sheet JSON file whose top-level keys are parsed on demand.
+
+    The file is memory-mapped and its top-level members are located by scanning its structure up to
+    the requested key, or all at once from a sidecar offsets index (see write_key_index) that is still
+    valid for the file. Only the requested values are parsed, so checking a sheet's filename and
+    sheetname does not load its cell grid. Parsed values are cached until the sheet is closed.
+
+    Use it as a context manager, or call close, to release the file.
+    """
+
+    def __init__(self, file_path, use_index=True):
+        """
+        Args:
+            file_path (str): Path of the sheet JSON file.
+            use_index (bool): Whether to read the member offsets from the sidecar index if it is valid.
+                Default is True.
+        """
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap cannot map empty files
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._offsets = None
+        self._scanner = None
+        self._values = {}
+        if use_index:
+            self._offsets = _read_key_index(file_path, os.fstat(self._file.fileno()))
+        if self._offsets is None:
+            self._offsets = {}
+            self._scanner = _TopLevelScanner(self._buffer)
+
+    def _locate(self, key):
+        offsets = self._offsets.get(key)
+        while offsets is None and self._scanner is not None and not self._scanner.done:
+            member = self._scanner.next_member()
+            if member is not None:
+                self._offsets.setdefault(member[0], member[1:])
+                if member[0] == key:
+                    offsets = self._offsets[key]
+        return offsets
+
+    def keys(self):
+        """Return the top-level keys of the sheet."""
+        while self._scanner is not None and not self._scanner.done:
+            member = self._scanner.next_member()
+            if member is not None:
+                self._offsets.setdefault(member[0], member[1:])
+        return list(self._offsets)
+
+    def offsets(self):
+        """Return key -> (start, end) byte offsets of every top-level value."""
+        self.keys()
+        return dict(self._offsets)
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        offsets = self._locate(key)
+        if offsets is None:
+            raise KeyError(key)
+        start, end = offsets
+        value = json.loads(self._buffer[start:end])
+        self._values[key] = value
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self._locate(key) is not None
+
+    def release(self, key):
+        """Drop the cached value of `key`, e.g. the cell grid once it has been compacted."""
+        self._values.pop(key, None)
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b''
+        self._file.close()
+        self._values.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _read_key_index(file_path, stat):
+    """Read the sidecar index of a sheet file, or return None if it is missing or stale."""
+    try:
+        with open(file_path + KEY_INDEX_SUFFIX, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("size") != stat.st_size or index.get("mtime_ns") != stat.st_mtime_ns:
+        return None
+    return {key: tuple(offsets) for key, offsets in index["offsets"].items()}
+
+
+def write_key_index(file_path):
+    """
+    Write the sidecar offsets index of a sheet JSON file, next to it with the KEY_INDEX_SUFFIX suffix.
+
+    The index records the byte offsets of the top-level values with the size and mtime of the file,
+    and is ignored by LazySheet once the file changes.
+
+    Parameters:
+    file_path (str): Path of the sheet JSON file.
+
+    Returns:
+    dict: key -> (start, end) byte offsets.
+    """
+    with LazySheet(file_path, use_index=False) as sheet:
+        offsets = sheet.offsets()
+        stat = os.fstat(sheet._file.fileno())
+    index = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "offsets": offsets}
+    tmp_path = file_path + KEY_INDEX_SUFFIX + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, file_path + KEY_INDEX_SUFFIX)
+    return offsets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write the sidecar offsets index of every sheet JSON file.")
+    parser.add_argument("json_directories", nargs='+',
+                        help="Directories (or glob patterns, e.g. 'data/raw/raw_data_json_*') of sheet JSON files.")
+    args = parser.parse_args()
+
+    count = 0
+    for pattern in args.json_directories:
+        for directory in sorted(glob.glob(pattern)):
+            for file_path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+                try:
+                    write_key_index(file_path)
+                    count += 1
+                except (OSError, ValueError) as e:
+                    print(f"Error indexing {file_path}: {e}")
+    print(f"Indexed {count} sheet files")
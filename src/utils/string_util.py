@@ -1,32 +1,228 @@
+from src.utils.formula_util import A1Reference, parse_a1_reference, ranges_overlap
+from src.utils.sheet_util import CompactSheet, iter_cell_rows
+
+
+class PromptTooLongError(Exception):
+    pass
+
+
+class SheetSerializer:
+    """
+    Serialize a sheet once and derive its variants from the cached string.
+
+    The sheet string has the format of generate_sheet_string_without_address_content. The offsets of
+    every cell's text in the string are recorded while serializing, so the string with one address
+    blanked is spliced out of the cached one instead of walking all cells again for every formula.
+    """
+
+    def __init__(self, data):
+        """
+        Args:
+            data (dict or CompactSheet): The sheet data.
+        """
+        self.data = data
+        # address -> list of (start, end) offsets of the cell text in sheet_string
+        self.text_offsets = {}
+        # (address, start, end) of every cell, in sheet order
+        self._cell_spans = []
+        self._cell_entries = None
+
+        parts = []
+        position = 0
+        for row_index, row in enumerate(iter_cell_rows(data)):
+            if row_index:
+                parts.append('\n')
+                position += 1
+            for cell_index, (address, text) in enumerate(row):
+                if cell_index:
+                    parts.append('|')
+                    position += 1
+                text = text.replace('\n', ' ')
+                start = position + len(address) + 1
+                parts.append(address)
+                parts.append(',')
+                parts.append(text)
+                position = start + len(text)
+                self.text_offsets.setdefault(address, []).append((start, position))
+                self._cell_spans.append((address, start, position))
+
+        merged_regions = data.get('MergedRegions', [])
+        if merged_regions:  # If MergedRegions is not empty
+            merged_region_address_list = [mr.get('Address', '') for mr in merged_regions]
+            parts.append('\n' + 'Merged Ranges:\n' + '\n'.join(merged_region_address_list))
+
+        self.sheet_string = ''.join(parts)
+
+    def without_address(self, address):
+        """
+        Return the sheet string with the content of the cell at `address` left empty.
+
+        Args:
+            address (str): The cell address to blank. An address that is not in the sheet leaves it unchanged.
+
+        Returns:
+            str: A string representation of the sheet.
+        """
+        offsets = self.text_offsets.get(address)
+        if not offsets:
+            return self.sheet_string
+
+        pieces = []
+        previous_end = 0
+        for start, end in offsets:
+            pieces.append(self.sheet_string[previous_end:start])
+            previous_end = end
+        pieces.append(self.sheet_string[previous_end:])
+        return ''.join(pieces)
+
+    def cell_entries(self):
+        """
+        Return (row, col, address, cell string) for every cell with a valid A1 address, parsed once.
+
+        Returns:
+            list: The cell entries in sheet order.
+        """
+        if self._cell_entries is None:
+            entries = []
+            compact = isinstance(self.data, CompactSheet)
+            for index, (address, start, end) in enumerate(self._cell_spans):
+                if compact:
+                    # The coordinates were parsed when the sheet was loaded
+                    row, col = self.data.rows[index], self.data.cols[index]
+                    if not row:
+                        continue
+                else:
+                    try:
+                        cell_ref = parse_a1_reference(address)
+                    except ValueError:
+                        continue
+                    row, col = cell_ref.min_row, cell_ref.min_col
+                entries.append((row, col, address, self.sheet_string[start - len(address) - 1:end]))
+            self._cell_entries = entries
+        return self._cell_entries
+
+
 def generate_sheet_string_without_address_content(data, formula_address):
     """
     Generate a string representation of the sheet without the content of the cell at the formula_address.
 
+    To blank several addresses of the same sheet, build a SheetSerializer once and call its
+    without_address method instead.
+
     Args:
-        data (dict): A dictionary representing the sheet data.
+        data (dict or CompactSheet): The sheet data.
         formula_address (str): A string representing the cell address of the formula.
 
     Returns:
         str: A string representation of the sheet.
     """
-    rows = data.get('Cells', [])
-    merged_regions = data.get('MergedRegions', [])
-    row_string_list = []
+    return SheetSerializer(data).without_address(formula_address)
+
+
+def build_windowed_sheet_string(data, target, max_tokens, header_rows=1, header_cols=1, blank_address=None,
+                                chars_per_token=4, serializer=None):
+    """
+    Generate a string representation of the sheet restricted to a window around a target address or range.
+
+    The window always contains the target, the first `header_rows` rows and the first `header_cols`
+    columns, and is widened symmetrically by whole rows and columns for as long as the estimated size
+    stays within `max_tokens`. The output uses the same format as the full sheet string.
+
+    Args:
+        data (dict or CompactSheet): The sheet data.
+        target (str): The cell address or range to center the window on.
+        max_tokens (int): The token budget of the sheet string.
+        header_rows (int): Number of leading rows always kept. Default is 1.
+        header_cols (int): Number of leading columns always kept. Default is 1.
+        blank_address (str, optional): A cell address whose content is left empty, as in
+            generate_sheet_string_without_address_content.
+        chars_per_token (int): Characters per token used to estimate the size. Default is 4.
+        serializer (SheetSerializer, optional): Serializer of `data`, whose parsed cells are reused
+            across the windows of a sheet. Built from `data` if not given.
+
+    Returns:
+        tuple: The windowed sheet string and a dict describing how much of the sheet was cut.
+
+    Raises:
+        PromptTooLongError: If the target and header cells alone exceed the token budget.
+    """
+    target_ref = parse_a1_reference(target)
+    min_row, min_col, max_row, max_col = target_ref.min_row, target_ref.min_col, target_ref.max_row, target_ref.max_col
+    max_chars = max_tokens * chars_per_token
+
+    # Reuse the serialized cells and their coordinates
+    serializer = serializer or SheetSerializer(data)
+    cells = [(row, col, address + ',' if address == blank_address else cell_str)
+             for row, col, address, cell_str in serializer.cell_entries()]
+
+    if not cells:
+        return '', {"truncated": False, "rows_total": 0, "rows_kept": 0, "cols_total": 0, "cols_kept": 0,
+                    "cells_total": 0, "cells_kept": 0, "chars_total": 0, "chars_kept": 0}
+
+    first_row = min(c[0] for c in cells)
+    first_col = min(c[1] for c in cells)
+    last_row = max(c[0] for c in cells)
+    last_col = max(c[1] for c in cells)
+
+    def _in_window(row, col, margin):
+        row_ok = min_row - margin <= row <= max_row + margin or row < first_row + header_rows
+        col_ok = min_col - margin <= col <= max_col + margin or col < first_col + header_cols
+        return row_ok and col_ok
 
-    for row in rows:
-        cell_string_list = []
-        for cell in row:
-            # If the cell address is the formula address, the cell content is empty.
-            cell_str = "{},{}".format(cell['Address'], '') if cell['Address'] == formula_address else "{},{}".format(
-                cell['Address'], cell['Text'].replace('\n', ' '))
-            cell_string_list.append(cell_str)
-        row_string_list.append('|'.join(cell_string_list))
+    def _window_size(margin):
+        # Each cell costs its text plus one separator
+        return sum(len(cell_str) + 1 for row, col, cell_str in cells if _in_window(row, col, margin))
 
+    if _window_size(0) > max_chars:
+        raise PromptTooLongError(f"Target {target} and header cells exceed the budget of {max_tokens} tokens")
+
+    # Find the largest margin that fits: exponential search, then binary search.
+    # No margin beyond the distance from the target to the farthest cell adds anything.
+    largest_margin = max(min_row - first_row, last_row - max_row, min_col - first_col, last_col - max_col, 0)
+    low, high = 0, 1
+    while high <= largest_margin and _window_size(high) <= max_chars:
+        low, high = high, high * 2
+    high = min(high, largest_margin + 1)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if _window_size(middle) <= max_chars:
+            low = middle
+        else:
+            high = middle
+    margin = low
+
+    kept_rows = {}
+    for row, col, cell_str in cells:
+        if _in_window(row, col, margin):
+            kept_rows.setdefault(row, []).append((col, cell_str))
+
+    row_string_list = ['|'.join(cell_str for _, cell_str in sorted(row_cells)) for _, row_cells in
+                       sorted(kept_rows.items())]
     sheet_string = '\n'.join(row_string_list)
 
-    if merged_regions:  # If MergedRegions is not empty
-        merged_region_address_list = [mr.get('Address', '') for mr in merged_regions]
+    merged_regions = data.get('MergedRegions', [])
+    merged_region_address_list = []
+    window = A1Reference(None, min_row - margin, min_col - margin, max_row + margin, max_col + margin)
+    for mr in merged_regions:
+        try:
+            mr_ref = parse_a1_reference(mr.get('Address', ''))
+        except ValueError:
+            continue
+        if ranges_overlap(mr_ref, window):
+            merged_region_address_list.append(mr.get('Address', ''))
+    if merged_region_address_list:
         sheet_string += '\n' + 'Merged Ranges:\n' + '\n'.join(merged_region_address_list)
 
-    return sheet_string
-
+    kept_cols = {col for row_cells in kept_rows.values() for col, _ in row_cells}
+    stats = {
+        "rows_total": len({c[0] for c in cells}),
+        "rows_kept": len(kept_rows),
+        "cols_total": len({c[1] for c in cells}),
+        "cols_kept": len(kept_cols),
+        "cells_total": len(cells),
+        "cells_kept": sum(len(row_cells) for row_cells in kept_rows.values()),
+        "chars_total": sum(len(cell_str) + 1 for _, _, cell_str in cells),
+        "chars_kept": _window_size(margin),
+    }
+    stats["truncated"] = stats["cells_kept"] < stats["cells_total"]
+    return sheet_string, stats
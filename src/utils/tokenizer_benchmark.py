@@ -0,0 +1,206 @@
+import argparse
+import glob
+import json
+import os
+import random
+import time
+
+from src.utils.formula_util import (fast_tokenize_formula, from_r1c1_skeleton, openpyxl_tokenize_formula,
+                                    to_r1c1_skeleton, tokenize_formula)
+
+# Hand-written edge cases, including the constructs the fast tokenizer defers to openpyxl for
+EDGE_CASE_FORMULAS = [
+    '', 'plain text', '=', '=1', '=-1', '=+A1', '=--A1', '=A1%', '=A1%+1', '=50%*B2',
+    '=SUM(B2:B3)', '=VLOOKUP(I46,I57,2,FALSE)', '=IF(A1>=10,"yes","no")', '=A1<>B1', '=A1<=B1',
+    '=A1&" "&B1', '="say ""hi"""&A1', '=""', '=TRUE', '=FALSE()', '=1.5', '=.5', '=1.',
+    '=1E5', '=1E+5', '=1.5E-3*A1', '=12E+5', '=2^-1', '=-(A1)', '=(A1+B1)*C1', '=((A1))',
+    '=SUM((A1,B1))', '=SUM(A1:A3 A2:B2)', '=A1 + B1', '=SUM( A1 , B1 )', '=  A1', '=A1\n+B1',
+    '=Sheet2!A1', '=Sheet2!$A$1:$B$10', "='My Sheet'!A1", "='It''s'!A1:B2", '=[1]Sheet1!A1',
+    "='C:\\dir\\[Book.xls]Sheet'!$A$4:$A$12", '=Table1[Col1]', '=SUM(Table1[[#This Row],[A]:[B]])',
+    '={1,2;3,4}', '=SUM({1,2,3})', '=#N/A', '=IFERROR(A1,#DIV/0!)', '=Sheet1!#REF!', '=A1,B1',
+    '=SUM(A1;B1)', '=LOG10(A1)+ATAN2(B1,C1)', '=A:A', '=1:1', '=SUM(A:A,1:1)', '=$A1+A$1',
+    '=INDEX(A1:C3,MATCH(E1,A1:A3,0),2)', '=DATE(2020,1,1)-TODAY()', '=NOW()', '=A1)', '=(A1',
+    '=SUM(A1}', '="unterminated', '=A1"x"', '=A1:"x"', '=Q1!B2', '=_xlfn.CONCAT(A1,B1)', '=inf',
+    '=nan', '=1_000', '=A1\tB1', '=SUM(A1:A3)/COUNT(A1:A3)', '=IF(AND(A1>0,B1<0),-A1,+B1)',
+]
+
+# Cells the R1C1 skeleton cache is checked from: the origin, an inner cell and one past column Z
+CHECK_ADDRESSES = ['A1', 'C3', 'AB100']
+
+_FUNCTIONS = ['SUM', 'IF', 'VLOOKUP', 'INDEX', 'MATCH', 'AVERAGE', 'ROUND', 'LEFT', 'COUNTIF', 'IFERROR']
+_OPERATORS = ['+', '-', '*', '/', '&', '^', '=', '<>', '>=', '<']
+
+
+def _random_reference(rng):
+    col = ''.join(rng.choice('ABCDEFGHIJ') for _ in range(rng.choice([1, 1, 1, 2])))
+    ref = f"{'$' if rng.random() < 0.2 else ''}{col}{'$' if rng.random() < 0.2 else ''}{rng.randint(1, 500)}"
+    if rng.random() < 0.4:
+        ref += f":{col}{rng.randint(1, 500)}"
+    if rng.random() < 0.1:
+        ref = f"Sheet{rng.randint(1, 3)}!{ref}"
+    return ref
+
+
+def _random_operand(rng, depth):
+    roll = rng.random()
+    if depth < 3 and roll < 0.3:
+        args = ','.join(_random_operand(rng, depth + 1) for _ in range(rng.randint(1, 3)))
+        return f"{rng.choice(_FUNCTIONS)}({args})"
+    if roll < 0.65:
+        return _random_reference(rng)
+    if roll < 0.8:
+        return str(rng.choice([rng.randint(0, 1000), round(rng.random() * 100, 2)]))
+    if roll < 0.9:
+        return '"' + rng.choice(['', 'a', 'Total', 'x "y"'.replace('"', '""'), '#N/A', "it's"]) + '"'
+    return f"({_random_operand(rng, depth + 1)})"
+
+
+def generate_synthetic_formulas(count, seed=0):
+    """
+    Generate random formulas in the style of the corpus: nested functions, A1 references and literals.
+
+    Parameters:
+    count (int): Number of formulas to generate.
+    seed (int): Seed of the random generator. Default is 0.
+
+    Returns:
+    list: The generated formulas.
+    """
+    rng = random.Random(seed)
+    formulas = []
+    for _ in range(count):
+        expr = _random_operand(rng, 0)
+        for _ in range(rng.randint(0, 2)):
+            expr += rng.choice(['', ' ']) + rng.choice(_OPERATORS) + rng.choice(['', ' ']) + _random_operand(rng, 1)
+        formulas.append('=' + ('-' if rng.random() < 0.05 else '') + expr)
+    return formulas
+
+
+def load_corpus_formulas(json_directory):
+    """
+    Collect the formulas of the preprocessed sheet JSON files in a directory.
+
+    Parameters:
+    json_directory (str): Directory with one JSON file per sheet, as read by the generators.
+
+    Returns:
+    list: The formula texts.
+    """
+    formulas = []
+    for file_path in glob.glob(os.path.join(json_directory, "*.json")):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        formulas.extend(item["Value"] for item in data.get('FilteredFormulas', []))
+    return formulas
+
+
+def _tokenize_or_error(tokenize, formula):
+    try:
+        return tokenize(formula)
+    except Exception as e:
+        return type(e)
+
+
+def differential_check(formulas):
+    """
+    Compare the fast tokenizer against openpyxl on every formula.
+
+    Exceptions are compared by type, so a formula openpyxl rejects must be rejected the same way.
+
+    Parameters:
+    formulas (list): The formulas to check.
+
+    Returns:
+    list: (formula, openpyxl result, fast result) tuples for every mismatch.
+    """
+    mismatches = []
+    for formula in formulas:
+        expected = _tokenize_or_error(openpyxl_tokenize_formula, formula)
+        actual = _tokenize_or_error(fast_tokenize_formula, formula)
+        if expected != actual:
+            mismatches.append((formula, expected, actual))
+    return mismatches
+
+
+def check_tokenizer(formulas, addresses=CHECK_ADDRESSES):
+    """
+    Assert that the fast tokenizer and the R1C1 skeleton cache agree with openpyxl. No timing is involved.
+
+    For every formula, the fast tokenizer must match openpyxl, and for every cell of `addresses` the
+    skeleton must resolve back to the formula and tokenize_formula(formula, address) must return the
+    openpyxl tokens.
+
+    Parameters:
+    formulas (list): The formulas to check.
+    addresses (list): A1 addresses of the cells the formulas are placed in. Default is CHECK_ADDRESSES.
+
+    Raises:
+    AssertionError: On the first formula that differs.
+    """
+    for formula, expected, actual in differential_check(formulas)[:1]:
+        raise AssertionError(f"Fast tokens of {formula!r} differ from openpyxl: {actual!r} != {expected!r}")
+
+    for address in addresses:
+        for formula in formulas:
+            skeleton = to_r1c1_skeleton(formula, address)
+            assert from_r1c1_skeleton(skeleton, address) == formula, \
+                f"Skeleton {skeleton!r} of {formula!r} in {address} does not resolve back"
+
+            expected = _tokenize_or_error(openpyxl_tokenize_formula, formula)
+            if isinstance(expected, tuple):
+                expected = list(expected)
+            actual = _tokenize_or_error(lambda text: tokenize_formula(text, address), formula)
+            assert actual == expected, f"Cached tokens of {formula!r} in {address} differ: {actual!r} != {expected!r}"
+
+
+def benchmark(formulas, repeat=3):
+    """
+    Time both tokenizers over the formulas and return the best of `repeat` runs in seconds.
+
+    Parameters:
+    formulas (list): The formulas to tokenize.
+    repeat (int): Number of timed runs per tokenizer. Default is 3.
+
+    Returns:
+    dict: Best run time per tokenizer and the speedup of the fast tokenizer.
+    """
+    timings = {}
+    for name, tokenize in (("openpyxl", openpyxl_tokenize_formula), ("fast", fast_tokenize_formula)):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for formula in formulas:
+                _tokenize_or_error(tokenize, formula)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    timings["speedup"] = timings["openpyxl"] / timings["fast"] if timings["fast"] else float('inf')
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Differential check and benchmark of the fast formula tokenizer.")
+    parser.add_argument("--json-directory", help="Directory of preprocessed sheet JSON files to take formulas from.")
+    parser.add_argument("--synthetic", type=int, default=20000, help="Number of synthetic formulas to add.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per tokenizer.")
+    parser.add_argument("--check-only", action="store_true",
+                        help="Only assert that the tokenizers and the skeleton cache agree, without timing.")
+    args = parser.parse_args()
+
+    corpus = EDGE_CASE_FORMULAS + generate_synthetic_formulas(args.synthetic)
+    if args.json_directory:
+        corpus += load_corpus_formulas(args.json_directory)
+
+    if args.check_only:
+        check_tokenizer(corpus)
+        print(f"Tokenizer check passed on {len(corpus)} formulas")
+        raise SystemExit(0)
+
+    mismatches = differential_check(corpus)
+    for formula, expected, actual in mismatches[:20]:
+        print(f"Mismatch for {formula!r}:\n  openpyxl: {expected}\n  fast:     {actual}")
+    print(f"Differential check: {len(corpus) - len(mismatches)}/{len(corpus)} formulas identical")
+
+    timings = benchmark(corpus, repeat=args.repeat)
+    print(f"openpyxl: {timings['openpyxl']:.3f}s, fast: {timings['fast']:.3f}s, speedup: {timings['speedup']:.1f}x")
+    if mismatches:
+        raise SystemExit(1)